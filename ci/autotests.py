@@ -19,16 +19,31 @@ OVS automatic test lib
 """
 import os
 import re
+import gzip
 import json
 import math
+import time
+import heapq
+import fnmatch
+import pipes
+import tempfile
+import itertools
+import collections
+import inspect
 import importlib
 import traceback
 import subprocess
+from contextlib import contextmanager
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 from ci.api_lib.helpers.ci_constants import CIConstants
 from ci.api_lib.helpers.exceptions import SectionNotFoundError
 from ci.api_lib.helpers.storagerouter import StoragerouterHelper
 from ci.api_lib.helpers.testrailapi import TestrailApi, TestrailCaseType, TestrailResult
+from ci.dependencies import ScenarioDependencies
+from ci.history import ScenarioHistory
+from ci.scheduler import ScenarioScheduler
+from ci.testrail import TestrailIndex, TestrailSession
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.system import System
 
@@ -37,9 +52,14 @@ class AutoTests(object):
 
     logger = Logger("autotests-ci_autotests")
     EXCLUDE_FLAG = "-exclude"
+    PACKAGE_PREFIXES = ('openvstorage', 'volumedriver', 'alba', 'arakoon', 'python-celery')
+    PACKAGE_QUERIES = [['dpkg-query', '-W', '-f=${binary:Package} ${Version}\t${Description}\n'],
+                       ['rpm', '-qa', '--queryformat', '%{NAME} %{VERSION}-%{RELEASE}\t%{SUMMARY}\n']]
+
+    _package_info = None
 
     @staticmethod
-    def run(scenarios=None, send_to_testrail=False, fail_on_failed_scenario=False, only_add_given_results=True, exclude_scenarios=None):
+    def run(scenarios=None, send_to_testrail=False, fail_on_failed_scenario=False, only_add_given_results=True, exclude_scenarios=None, processes=1, shard=None, preflight=False, isolate=False, rerun_failed=False, changed_since=None):
         """
         Run single, multiple or all test scenarios
         :param scenarios: run scenarios defined by the test_name, leave empty when ALL test scenarios need to be executed (e.g. ['ci.scenarios.alba.asd_benchmark', 'ci.scenarios.arakoon.collapse'])
@@ -52,6 +72,18 @@ class AutoTests(object):
         :type fail_on_failed_scenario: bool
         :param only_add_given_results: ONLY ADD the given cases in results
         :type only_add_given_results: bool
+        :param processes: amount of scenarios to run concurrently. When more than 1, scenarios run in separate processes and may not share the resources they lock
+        :type processes: int
+        :param shard: only run one part of the selected scenarios, balanced on their recorded durations (e.g. '2/4' runs the second out of four shards)
+        :type shard: str
+        :param preflight: import all selected scenarios up front in parallel and leave out the broken ones
+        :type preflight: bool
+        :param isolate: run every scenario within its own process, terminated when it exceeds its TIMEOUT. Always the case when processes is more than 1
+        :type isolate: bool
+        :param rerun_failed: only run the selected scenarios that failed or were blocked during their last execution
+        :type rerun_failed: bool
+        :param changed_since: only run the selected scenarios of which the code or the scenario helpers they import changed since this git revision
+        :type changed_since: str
         :returns: results and possible testrail url
         :rtype: tuple
         """
@@ -63,33 +95,54 @@ class AutoTests(object):
             exclude_scenarios = CIConstants.SETUP_CFG.get('exclude_scenarios', [])
         logger.info("Collecting tests.")  # Grab the tests to execute
         tests = [autotest for autotest in AutoTests.list_tests(scenarios[:]) if autotest not in exclude_scenarios]  # Filter out tests with EXCLUDE_FLAG
+        if rerun_failed is True:
+            tests = ScenarioHistory.select_failed(tests, exclude_flag=AutoTests.EXCLUDE_FLAG)
+        if changed_since is not None:
+            tests = ScenarioDependencies.select_changed(tests, changed_since)
+        durations = ScenarioHistory.get_durations()
+        if shard is not None:
+            shard_index, shard_count = AutoTests._parse_shard(shard)
+            tests = ScenarioHistory.shard(tests, shard_index, shard_count, durations=durations)
+            logger.info('Running shard {0}/{1}'.format(shard_index, shard_count))
+        if preflight is True:
+            logger.info('Importing tests up front.')
+            tests, preflight_errors = ScenarioScheduler.preflight(tests, processes=processes)
+            error_messages.extend(preflight_errors)
+        tests = ScenarioScheduler.order_by_critical_path(tests, durations=durations)  # Longest chains first, prerequisites before their dependents
         # print tests to be executed
         logger.info('Executing the following tests: {0}'.format(tests))
         # execute the tests
         logger.info('Starting tests.')
-        results = {}
-        blocked = False
-        for test in tests:
-            logger.info('\n{:=^100}\n'.format(test))
-            try:
-                mod = importlib.import_module('{0}.main'.format(test))
-            except Exception:
-                message = 'Unable to import test {0}'.format(test)
-                logger.exception(message)
-                error_messages.append('{0}: \n {1}'.format(message, traceback.format_exc()))
-                continue
-            module_result = mod.run(blocked)
-            if hasattr(TestrailResult, module_result['status']):  # check if a test has failed, if it has failed check if we should block all other tests
-                if getattr(TestrailResult, module_result['status']) == TestrailResult.FAILED and fail_on_failed_scenario:
-                    if 'blocking' not in module_result:
-                        blocked = True  # if a test reports failed but blocked is not present = by default blocked == True
-                    elif module_result['blocking'] is not False:
-                        blocked = True  # if a test reports failed but blocked != False
-            else:
-                error_messages.append('Test {0} returned attribute `{1}` which does not exists as status in TestrailResult'.format(test, module_result['status']))
-            # add test to results & also remove possible EXCLUDE_FLAGS on test name
-            results[test.replace(AutoTests.EXCLUDE_FLAG, '')] = module_result
+        if processes > 1 or isolate is True:
+            scheduler = ScenarioScheduler(tests, processes=processes, fail_on_failed_scenario=fail_on_failed_scenario)
+            module_results, scheduler_errors = scheduler.run()
+            error_messages.extend(scheduler_errors)
+            results = dict((test.replace(AutoTests.EXCLUDE_FLAG, ''), module_result) for test, module_result in module_results.iteritems())
+        else:
+            results = {}
+            blocked = False
+            for test in tests:
+                logger.info('\n{:=^100}\n'.format(test))
+                try:
+                    mod = importlib.import_module('{0}.main'.format(test))
+                except Exception:
+                    message = 'Unable to import test {0}'.format(test)
+                    logger.exception(message)
+                    error_messages.append('{0}: \n {1}'.format(message, traceback.format_exc()))
+                    continue
+                module_result = mod.run(blocked or not ScenarioScheduler.prerequisites_passed(test, tests, results))
+                blocks, error_message = ScenarioScheduler.evaluate_result(test, module_result, fail_on_failed_scenario)
+                if error_message is not None:
+                    error_messages.append(error_message)
+                blocked = blocked or blocks
+                # add test to results & also remove possible EXCLUDE_FLAGS on test name
+                results[test.replace(AutoTests.EXCLUDE_FLAG, '')] = module_result
         logger.info("Finished tests.")
+        try:
+            ScenarioHistory.record(results)
+            ScenarioHistory.save_last_results(results)
+        except Exception:
+            logger.exception('Unable to record the results of the tests')
         plan_url = None
         if send_to_testrail:
             logger.info('Start pushing tests to testrail.')
@@ -98,6 +151,23 @@ class AutoTests(object):
             raise RuntimeError('Unhandled errors occurred during the Autotests: \n - {0}'.format('\n - '.join(error_messages)))
         return results, plan_url
 
+    @staticmethod
+    def _parse_shard(shard):
+        """
+        Parse a shard specification
+        :param shard: shard specification (e.g. '2/4')
+        :type shard: str
+        :return: index of the shard (starting from 1), total amount of shards
+        :rtype: tuple(int, int)
+        """
+        match = re.match('^\s*(\d+)\s*/\s*(\d+)\s*$', str(shard))
+        if match is None:
+            raise ValueError('Shard `{0}` is not of the form i/N'.format(shard))
+        shard_index, shard_count = int(match.group(1)), int(match.group(2))
+        if not 1 <= shard_index <= shard_count:
+            raise ValueError('Shard `{0}` is out of range: index should be between 1 and {1}'.format(shard, shard_count))
+        return shard_index, shard_count
+
     @staticmethod
     def list_tests(cases=None, exclude=None, start_dir=CIConstants.TEST_SCENARIO_LOC, categories=None, subcategories=None, depth=1):
         """
@@ -201,27 +271,45 @@ class AutoTests(object):
             return None, error_messages
         project_id = client.get_project_by_name(testrail_config['project'])['id']
         suite_id = client.get_suite_by_name(project_id, testrail_config['suite'])['id']
+        session = TestrailSession(testrail_config['url'], key=testrail_config.get('key'),
+                                  username=testrail_config.get('username'), password=testrail_config.get('password'))
+        index = TestrailIndex(client, session)
 
         # Check if test_case & test_section exists in test_suite
+        cases_to_add = []
         for test_case, test_result in results.iteritems():
             test_name = test_case.split('.')[3]
             test_section = test_case.split('.')[2].capitalize()
+            # Check if section exists
             try:
-                client.get_case_by_name(project_id, suite_id, test_name)
-            except Exception:
-                # Check if section exists
-                try:
-                    section = client.get_section_by_name(project_id, suite_id, test_section)
-                except Exception:
-                    error_messages.append('Test {0}: section `{1}` is not available in testrail, please add or correct your mistake.'.format(test_name, test_section))
-                    continue
-                if hasattr(TestrailCaseType, test_result['case_type']):
-                    case_type_id = client.get_case_type_by_name(getattr(TestrailCaseType, test_result['case_type']))['id']
-                else:
-                    error_messages.append('Test {0}: attribute `{1}` does not exists as case_type in TestrailCaseType'.format(test_name, test_result['case_type']))
-                    continue
-                # Add case to existing section
-                client.add_case(section_id=section['id'], title=test_name, type_id=case_type_id)
+                section = index.get_section_by_name(project_id, suite_id, test_section)
+            except SectionNotFoundError:
+                error_messages.append('Test {0}: section `{1}` is not available in testrail, please add or correct your mistake.'.format(test_name, test_section))
+                continue
+            try:
+                index.get_case_by_name(project_id, suite_id, test_name, section_id=section['id'])
+                continue
+            except KeyError:
+                pass
+            if test_result['case_type'] is not None and hasattr(TestrailCaseType, test_result['case_type']):  # Unknown for killed tests
+                case_type_id = index.get_case_type_by_name(getattr(TestrailCaseType, test_result['case_type']))['id']
+            else:
+                error_messages.append('Test {0}: attribute `{1}` does not exists as case_type in TestrailCaseType'.format(test_name, test_result['case_type']))
+                continue
+            cases_to_add.append({'section_id': section['id'], 'title': test_name, 'type_id': case_type_id})
+        # Add cases to existing sections
+        index.add_cases(cases_to_add)
+
+        # Resolve the case of every executed test
+        executed_case_ids = {}
+        for test_case in results.iterkeys():
+            try:
+                section_id = index.get_section_by_name(project_id, suite_id, test_case.split('.')[2].capitalize().strip())['id']
+                executed_case_ids[test_case] = index.get_case_by_name(project_id, suite_id, test_case.split('.')[3], section_id=section_id)['id']
+            except SectionNotFoundError:
+                pass  # Error message was added when creating the case
+            except KeyError:
+                error_messages.append('Test {0}: no case was found or could be added in section `{1}`, its result is not pushed.'.format(test_case.split('.')[3], test_case.split('.')[2].capitalize()))
 
         # Add plan
         plan = client.add_plan(project_id, test_title, description)
@@ -230,58 +318,84 @@ class AutoTests(object):
         if not only_add_given_cases:
             # Add all tests to the test_suite, regardless of execution
             entry = client.add_plan_entry(plan['id'], suite_id, testrail_config['suite'])
+            run_case_ids = index.get_case_ids(project_id, suite_id)
         else:
-            # Collect case_ids of executed tests
-            executed_case_ids = []
-            for test_case in results.iterkeys():
-                section_id = client.get_section_by_name(project_id, suite_id, test_case.split('.')[2].capitalize().strip())['id']
-                executed_case_ids.append(client.get_case_by_name(project_id=project_id, suite_id=suite_id, name=test_case.split('.')[3], section_id=section_id)['id'])
             # Only add tests to test_suite that have been executed
-            entry = client.add_plan_entry(plan['id'], suite_id, testrail_config['suite'], case_ids=executed_case_ids, include_all=False)
+            run_case_ids = executed_case_ids.values()
+            entry = client.add_plan_entry(plan['id'], suite_id, testrail_config['suite'], case_ids=run_case_ids, include_all=False)
 
         # Add results to test cases
         run_id = entry['runs'][0]['id']
+        case_results = []
         for test_case, test_result in results.iteritems():
-            # Check if test exists
             test_name = test_case.split('.')[3]
-            test_id = client.get_test_by_name(run_id, test_name)['id']
-
+            if test_case not in executed_case_ids:
+                continue
             if hasattr(TestrailResult, test_result['status']):
                 test_status_id = getattr(TestrailResult, test_result['status'])
             else:
                 error_messages.append('Test {0}: attribute `{1}` does not exists as test_status in TestrailResult'.format(test_name, test_result['status']))
                 continue
+            case_result = {'case_id': executed_case_ids[test_case], 'status_id': test_status_id}
             # Add results to test cases, if the've got something in the field `errors`
             if test_result['errors'] is not None:
-                client.add_result(test_id, test_status_id, comment=str(test_result['errors']))
-            else:
-                client.add_result(test_id, test_status_id)
+                case_result['comment'] = str(test_result['errors'])
+            case_result.update(AutoTests._get_timing_fields(test_result, testrail_config.get('timing_fields', {})))
+            case_results.append(case_result)
 
-        # End of adding results to testplan, setting other cases in SKIPPED
+        # End of adding results to testplan, setting other cases in SKIPPED. The run is new so every other case is untested
         if skip_on_no_results:
-            for test in client.get_tests(run_id):
-                if test['status_id'] == TestrailResult.UNTESTED:
-                    client.add_result(test['id'], int(TestrailResult.SKIPPED))
+            tested_case_ids = set(case_result['case_id'] for case_result in case_results)
+            case_results.extend({'case_id': case_id, 'status_id': int(TestrailResult.SKIPPED)} for case_id in run_case_ids if case_id not in tested_case_ids)
+        session.add_results_for_cases(run_id, case_results)
 
+        logger.info('Pushed {0} results to testrail using {1} bulk calls.'.format(len(case_results), session.call_count))
         logger.info('Finished pushing tests to testrail ...')
         return plan['url'], error_messages
 
+    @staticmethod
+    def _get_timing_fields(test_result, timing_fields):
+        """
+        Convert the durations of a result to Testrail result fields
+        :param test_result: result of a test (e.g. {'status': 'PASSED', 'duration': 95.2, 'timings': {'setup': 60.1, 'io': 30.5}})
+        :type test_result: dict
+        :param timing_fields: phase name -> system name of the custom Testrail field to store its duration in seconds (e.g. {'setup': 'custom_setup_time'})
+        :type timing_fields: dict
+        :return: Testrail result fields
+        :rtype: dict
+        """
+        fields = {}
+        duration = int(round(test_result.get('duration') or 0))
+        if duration > 0:  # Testrail refuses empty timespans
+            fields['elapsed'] = '{0}m {1}s'.format(*divmod(duration, 60)) if duration >= 60 else '{0}s'.format(duration)
+        timings = test_result.get('timings') or {}
+        for phase_name, field_name in timing_fields.iteritems():
+            if phase_name in timings:
+                fields[field_name] = int(round(timings[phase_name]))
+        return fields
+
     @staticmethod
     def _get_package_info():
         """
         Retrieve package information for installation
+        The information is only gathered once per run, from dpkg or from rpm on redhat. Empty when neither is available
 
         :returns: package information of openvstorage, volumedriver, alba, arakoon & python-celery
         :rtype: str
         """
-        command = "dpkg-query -W -f='${binary:Package} ${Version}\t${Description}\n' " \
-                  "| grep '^openvstorage\|^volumedriver\|^alba\|^arakoon\|^python-celery'"
-
-        child_process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                         stderr=subprocess.PIPE)
-
-        (output, _error) = child_process.communicate()
-        return output
+        if AutoTests._package_info is None:
+            AutoTests._package_info = ''
+            with open(os.devnull, 'w') as devnull:
+                for command in AutoTests.PACKAGE_QUERIES:
+                    try:
+                        output = subprocess.check_output(command, stderr=devnull)
+                    except (OSError, subprocess.CalledProcessError):
+                        continue  # Package manager of another distribution
+                    AutoTests._package_info = ''.join(line for line in output.splitlines(True) if line.startswith(AutoTests.PACKAGE_PREFIXES))
+                    break
+                else:
+                    AutoTests.logger.warning('Unable to query the installed packages')
+        return AutoTests._package_info
 
     @staticmethod
     def _get_test_name():
@@ -311,53 +425,163 @@ class AutoTests(object):
         return re.split("\s*", main_pkg[0])[1]
 
     @staticmethod
-    def _get_description():
+    def _get_system_info():
+        """
+        Retrieve extensive information about the machine, in a structured way
+        Reads /proc and /sys directly, dmidecode and lsblk are executed concurrently
+
+        :returns: information about the ips, hypervisor, hardware & packages of the local machine
+        :rtype: dict
+        """
+        pool = ThreadPool(processes=2)
+        try:
+            board_result = pool.apply_async(subprocess.check_output, args=(['dmidecode', '-t', '2'],))
+            lsblk_result = pool.apply_async(subprocess.check_output, args=(['lsblk'],))
+            # fetch cpu information
+            with open('/proc/cpuinfo', 'r') as cpuinfo:
+                cpus = [line.split(':', 1)[1].strip() for line in cpuinfo if line.startswith('model name')]
+            # fetch memory information
+            memory_kib = 0
+            with open('/proc/meminfo', 'r') as meminfo:
+                for line in meminfo:
+                    if line.startswith('MemTotal:'):
+                        memory_kib = int(line.split()[1])
+                        break
+            # fetch disk information
+            disks = []
+            for device in sorted(os.listdir('/sys/block')):
+                if device.startswith(('loop', 'ram')):
+                    continue
+                disk = {'name': device}
+                for key, sys_path, convert in [('size', 'size', lambda value: int(value) * 512),  # Expressed in 512 byte sectors
+                                               ('rotational', 'queue/rotational', lambda value: value == '1'),
+                                               ('model', 'device/model', str)]:
+                    try:
+                        with open(os.path.join('/sys/block', device, sys_path), 'r') as sys_file:
+                            disk[key] = convert(sys_file.read().strip())
+                    except (IOError, ValueError):
+                        disk[key] = None
+                disks.append(disk)
+            packages = []
+            for line in AutoTests._get_package_info().splitlines():
+                name_version, _, description = line.partition('\t')
+                name, _, version = name_version.partition(' ')
+                packages.append({'name': name, 'version': version, 'description': description})
+            return {'ips': StoragerouterHelper.get_storagerouter_ips(),
+                    'hypervisor': CIConstants.SETUP_CFG['ci']['local_hypervisor']['type'],
+                    'board': board_result.get().replace('#', '').strip(),
+                    'cpu': {'type': cpus[0] if len(cpus) > 0 else None, 'amount': len(cpus)},
+                    'memory': {'total_gib': int(math.ceil(memory_kib / 1024.0 / 1024.0))},
+                    'disks': disks,
+                    'lsblk': lsblk_result.get().strip(),
+                    'packages': packages}
+        finally:
+            pool.close()
+            pool.join()
+
+    @staticmethod
+    def _get_description(system_info=None):
         """
         Retrieve extensive information about the machine
+        The structured system information is appended as JSON
 
+        :param system_info: information retrieved with _get_system_info. Gathered when not provided
+        :type system_info: dict
         :returns: a extensive description of the local machine
         :rtype: str
         """
+        if system_info is None:
+            system_info = AutoTests._get_system_info()
         description_lines = ['# IP INFO']
-        # fetch ip information
-        for ip in StoragerouterHelper.get_storagerouter_ips():
+        # ip information
+        for ip in system_info['ips']:
             description_lines.append('* {0}'.format(ip))
         description_lines.append('')  # New line gap
         # hypervisor information
-        ci_config = CIConstants.SETUP_CFG
         description_lines.append('# HYPERVISOR INFO')
-        description_lines.append('{0}'.format(ci_config['ci']['local_hypervisor']['type']))
+        description_lines.append('{0}'.format(system_info['hypervisor']))
         description_lines.append('')  # New line gap
-        # fetch hardware information
+        # hardware information
         description_lines.append("# HARDWARE INFO")
         # board information
         description_lines.append("### Base Board Information")
-        description_lines.append("{0}".format(subprocess.check_output("dmidecode -t 2", shell=True).replace("#", "").strip()))
+        description_lines.append("{0}".format(system_info['board']))
         description_lines.append('')  # New line gap
-        # fetch cpu information
+        # cpu information
         description_lines.append("### Processor Information")
-        output = subprocess.Popen("grep 'model name'", stdin=subprocess.Popen("cat /proc/cpuinfo", stdout=subprocess.PIPE, shell=True).stdout, stdout=subprocess.PIPE, shell=True)
-        cpus = subprocess.check_output("cut -d ':' -f 2", stdin=output.stdout, shell=True).strip().split('\n')
-        description_lines.append("* Type: {0}".format(cpus[0]))
-        description_lines.append("* Amount: {0}".format(len(cpus)))
+        description_lines.append("* Type: {0}".format(system_info['cpu']['type']))
+        description_lines.append("* Amount: {0}".format(system_info['cpu']['amount']))
         description_lines.append('')  # New line gap
-        # fetch memory information
+        # memory information
         description_lines.append("### Memory Information")
-        output = math.ceil(float(subprocess.check_output("grep MemTotal", stdin=subprocess.Popen("cat /proc/meminfo", stdout=subprocess.PIPE, shell=True).stdout, shell=True).strip().split()[1]) / 1024 / 1024)
-        description_lines.append("* {0}GiB System Memory".format(int(output)))
+        description_lines.append("* {0}GiB System Memory".format(system_info['memory']['total_gib']))
         description_lines.append('')  # New line gap
-        # fetch disk information
+        # disk information
         description_lines.append("### Disk Information")
-        output = subprocess.check_output("lsblk", shell=True)
-        description_lines.append(output.strip())
+        description_lines.append(system_info['lsblk'])
         description_lines.append('')  # New line gap
         # package info
         description_lines.append("# PACKAGE INFO")
         description_lines.append("{0}".format(AutoTests._get_package_info()))
+        # structured info, indented to be rendered as a code block
+        description_lines.append("# SYSTEM INFO")
+        description_lines.extend('    {0}'.format(line) for line in json.dumps(system_info, indent=2, sort_keys=True, separators=(',', ': ')).splitlines())
 
         return '\n'.join(description_lines)
 
 
+class ServiceTrie(object):
+    """
+    Prefix tree of service names, to expand unit patterns without scanning all services
+    """
+    def __init__(self, service_names):
+        """
+        :param service_names: names of the services
+        :type service_names: iterable[str]
+        """
+        self._root = {}
+        for service_name in service_names:
+            node = self._root
+            for character in service_name:
+                node = node.setdefault(character, {})
+            node[None] = service_name  # Marks the end of a name
+
+    def find(self, prefix):
+        """
+        :return: all service names starting with the given prefix
+        :rtype: list[str]
+        """
+        node = self._root
+        for character in prefix:
+            if character not in node:
+                return []
+            node = node[character]
+        found = []
+        nodes = [node]
+        while len(nodes) > 0:
+            node = nodes.pop()
+            for character, child in node.iteritems():
+                if character is None:
+                    found.append(child)
+                else:
+                    nodes.append(child)
+        return sorted(found)
+
+    def expand(self, pattern):
+        """
+        Expand a unit pattern. Patterns are matched as a prefix in which * matches anything
+        (e.g. ovs-arakoon-*-nsm matches ovs-arakoon-mybackend-nsm_0 but not ovs-arakoon-mybackend-abm)
+        :param pattern: pattern to expand
+        :type pattern: str
+        :return: the matching service names
+        :rtype: list[str]
+        """
+        candidates = self.find(pattern.split('*')[0])
+        if '*' not in pattern:
+            return candidates
+        return [service_name for service_name in candidates if fnmatch.fnmatchcase(service_name, pattern + '*')]
+
+
 class LogCollector(object):
     """
     Exposes to methods to collect logs
@@ -367,25 +591,58 @@ class LogCollector(object):
                          'arakoon': ['ovs-arakoon-*-abm', 'ovs-arakoon-*-nsm', 'ovs-arakoon-config'],
                          'alba': ['ovs-albaproxy_*'],
                          'volumedriver': ['ovs-volumedriver_*']}
+    LOG_DIRECTORY = '/var/log/ovs/autotests'  # Full logs of failed tests are stored here
+    ERROR_PATTERN = re.compile('error|exception|traceback|critical|fatal', re.IGNORECASE)
+    TAIL_SIZE = 100  # Amount of most recent lines to keep per unit
+    MAX_ERROR_LINES = 1000  # Amount of error lines to keep in the summary
+    THREADS = 8  # Amount of nodes to collect logs from concurrently
+    # Consecutive collections towards the same node reuse the master connection
+    SSH_OPTIONS = ['-o', 'BatchMode=yes', '-o', 'StrictHostKeyChecking=no', '-o', 'ControlMaster=auto',
+                   '-o', 'ControlPath=/tmp/ovs-autotests-ssh-%r@%h:%p', '-o', 'ControlPersist=10m']
+    SERVICE_CACHE_TIMEOUT = 5 * 60  # Services listed on a node are reused for this amount of seconds
+
+    _service_cache = {}  # Storagerouter IP -> (timestamp, ServiceTrie)
 
     @staticmethod
-    def get_logs(components=None, since=None, until=None, auto_complete=True):
+    def _get_services(storagerouter):
         """
-        Get logs for specified components
+        Retrieve the services of a storagerouter. The listing is cached for SERVICE_CACHE_TIMEOUT seconds
+        :param storagerouter: storagerouter to list the services of
+        :type storagerouter: ovs.dal.hybrids.storagerouter.StorageRouter
+        :return: the services of the storagerouter
+        :rtype: ServiceTrie
+        """
+        cached = LogCollector._service_cache.get(storagerouter.ip)
+        if cached is None or time.time() - cached[0] > LogCollector.SERVICE_CACHE_TIMEOUT:
+            from ovs.extensions.services.servicefactory import ServiceFactory
+            from ovs.extensions.generic.sshclient import SSHClient
+            service_manager = ServiceFactory.get_manager()
+            cached = (time.time(), ServiceTrie(service_manager.list_services(SSHClient(storagerouter))))
+            LogCollector._service_cache[storagerouter.ip] = cached
+        return cached[1]
+
+    @staticmethod
+    def clear_service_cache():
+        """
+        Forget all listed services, e.g. after services were added or removed
+        :return: None
+        :rtype: NoneType
+        """
+        LogCollector._service_cache.clear()
+
+    @staticmethod
+    def _get_units(components=None, auto_complete=True, storagerouter=None):
+        """
+        Resolve the systemd units of the specified components
         :param components: list of components. Can be strings or dicts to specify which logs
         :type components: list[str] / list[dict]
-        :param since: start collecting logs from this timestamp
-        :type since: str / DateTime
-        :param until: stop collecting when this timestamp is found
-        :type until: str / DateTime
         :param auto_complete: replaced * with found entries, works around the journalctl flaw
         :type auto_complete: bool
-        :return: all logs for the components listed
-        :rtype: str
+        :param storagerouter: storagerouter to auto complete the units on. Defaults to the local one
+        :type storagerouter: ovs.dal.hybrids.storagerouter.StorageRouter
+        :return: units (e.g. ['ovs-workers.service'])
+        :rtype: list[str]
         """
-        logger = AutoTests.logger
-        logger.debug('Grepping logs between {0} and {1}.'.format(since, until))
-        from ovs_extensions.log.log_reader import LogFileTimeParser
         if components is None:
             components = LogCollector.DEFAULT_COMPONENTS
         units = []
@@ -410,26 +667,272 @@ class LogCollector(object):
                         raise ValueError('Could not match the following components: [0]. Consider the following prefixes: [1]'.format(requested_units, filters))
                     units.extend(matched)
         if auto_complete is True:
-            from ovs.extensions.services.servicefactory import ServiceFactory
-            from ovs.extensions.generic.system import System
-            from ovs.extensions.generic.sshclient import SSHClient
-            service_manager = ServiceFactory.get_manager()
-            found_services = [service for service in service_manager.list_services(SSHClient(System.get_my_storagerouter()))]
+            if storagerouter is None:
+                storagerouter = System.get_my_storagerouter()
+            services = LogCollector._get_services(storagerouter)
             completed_units = []
             for item in units:
-                services = [service_name for service_name in found_services if service_name.startswith(item.split('*')[0])]
-                found_services = list(set(found_services) - set(services))
-                completed_units.extend(services)
+                for service_name in services.expand(item):
+                    if service_name not in completed_units:
+                        completed_units.append(service_name)
             units = completed_units
-        units = ['{0}.service'.format(unit) for unit in units[:]]  # append .service
+        return ['{0}.service'.format(unit) for unit in units[:]]  # append .service
+
+    @staticmethod
+    def get_logs(components=None, since=None, until=None, auto_complete=True):
+        """
+        Get logs for specified components
+        :param components: list of components. Can be strings or dicts to specify which logs
+        :type components: list[str] / list[dict]
+        :param since: start collecting logs from this timestamp
+        :type since: str / DateTime
+        :param until: stop collecting when this timestamp is found
+        :type until: str / DateTime
+        :param auto_complete: replaced * with found entries, works around the journalctl flaw
+        :type auto_complete: bool
+        :return: all logs for the components listed
+        :rtype: str
+        """
+        logger = AutoTests.logger
+        logger.debug('Grepping logs between {0} and {1}.'.format(since, until))
+        from ovs_extensions.log.log_reader import LogFileTimeParser
+        units = LogCollector._get_units(components, auto_complete)
         logger.debug('Grepping logs for the following units: {0} between {1} and {2}.'.format(units, since, until))
         return LogFileTimeParser.execute_search_on_remote(since=since, until=until, search_locations=units)
 
+    @staticmethod
+    def collect_logs(name, components=None, since=None, until=None, auto_complete=True, tail_size=TAIL_SIZE, log_directory=LOG_DIRECTORY, all_nodes=False):
+        """
+        Stream the logs of the specified components to a compressed file and summarize them
+        The journal is read line by line: memory usage is bounded by the tail size, regardless of the amount of logs
+        :param name: name to prefix the log file with (e.g. the test name)
+        :type name: str
+        :param components: list of components. Can be strings or dicts to specify which logs
+        :type components: list[str] / list[dict]
+        :param since: start collecting logs from this timestamp
+        :type since: str / DateTime
+        :param until: stop collecting when this timestamp is found
+        :type until: str / DateTime
+        :param auto_complete: replaced * with found entries, works around the journalctl flaw
+        :type auto_complete: bool
+        :param tail_size: amount of most recent lines to include in the summary per unit
+        :type tail_size: int
+        :param log_directory: directory to store the compressed logs in
+        :type log_directory: str
+        :param all_nodes: collect the logs of all storagerouters concurrently and merge them into one timeline
+        :type all_nodes: bool
+        :return: summary of the logs: the lines matching ERROR_PATTERN and the most recent lines of every unit
+        :rtype: str
+        """
+        logger = AutoTests.logger
+        local_storagerouter = System.get_my_storagerouter()
+        storagerouters = StoragerouterHelper.get_storagerouters() if all_nodes is True else [local_storagerouter]
+        nodes = []
+        for storagerouter in storagerouters:
+            units = LogCollector._get_units(components, auto_complete, storagerouter)
+            if len(units) > 0:
+                nodes.append((storagerouter, units))
+        if len(nodes) == 0:
+            return 'No units to collect logs for.'
+        if not os.path.isdir(log_directory):
+            os.makedirs(log_directory)
+        log_path = os.path.join(log_directory, '{0}_{1}.log.gz'.format(name, datetime.now().strftime('%Y%m%d%H%M%S')))
+
+        def _collect(node):
+            storagerouter, node_units = node
+            logger.debug('Streaming logs for the following units: {0} on {1} between {2} and {3}.'.format(node_units, storagerouter.ip, since, until))
+            command = LogCollector._get_journal_command(node_units, since, until)
+            if storagerouter.ip != local_storagerouter.ip:
+                command = ['ssh'] + LogCollector.SSH_OPTIONS + ['root@{0}'.format(storagerouter.ip), ' '.join(pipes.quote(part) for part in command)]
+            node_path = log_path if len(nodes) == 1 else '{0}.{1}'.format(log_path, storagerouter.ip)
+            try:
+                return LogCollector._stream_journal(command, node_path, tail_size)
+            except Exception as ex:
+                logger.exception('Collecting logs on {0} failed.'.format(storagerouter.ip))
+                return {'path': None, 'error': 'Collecting logs on {0} failed: {1}'.format(storagerouter.ip, ex)}
+
+        pool = ThreadPool(processes=min(LogCollector.THREADS, len(nodes)))
+        try:
+            collected = pool.map(_collect, nodes)
+        finally:
+            pool.close()
+            pool.join()
+        succeeded = [node_logs for node_logs in collected if node_logs['path'] is not None]
+        if len(nodes) > 1:
+            # Every node's journal is ordered in time and every line starts with its timestamp: merge them into one timeline
+            node_files = [gzip.open(node_logs['path'], 'rb') for node_logs in succeeded]
+            try:
+                with gzip.open(log_path, 'wb') as log_file:
+                    log_file.writelines(heapq.merge(*node_files))
+            finally:
+                for node_file in node_files:
+                    node_file.close()
+                    os.remove(node_file.name)
+        error_lines = list(itertools.islice(heapq.merge(*[node_logs['errors'] for node_logs in succeeded]), LogCollector.MAX_ERROR_LINES))
+        error_count = sum(node_logs['error_count'] for node_logs in succeeded)
+        summary = ['Collected {0} lines of {1}. Full logs are stored at {2}'.format(sum(node_logs['line_count'] for node_logs in succeeded),
+                                                                                 ', '.join(sorted(set(unit for _, units in nodes for unit in units))),
+                                                                                 log_path)]
+        summary.extend(node_logs['error'] for node_logs in collected if node_logs['path'] is None)
+        summary.append('\n{0} lines matched {1}:'.format(error_count, LogCollector.ERROR_PATTERN.pattern))
+        summary.extend(error_lines)
+        if error_count > len(error_lines):
+            summary.append('... {0} more, see the full logs'.format(error_count - len(error_lines)))
+        for node_logs in succeeded:
+            for (hostname, unit), tail in sorted(node_logs['tails'].iteritems()):
+                summary.append('\nLast {0} lines of {1} on {2}:'.format(len(tail), unit, hostname))
+                summary.extend(tail)
+        return '\n'.join(summary)
 
-def gather_results(case_type, logger, test_name, log_components=None):
+    @staticmethod
+    def _get_journal_command(units, since=None, until=None):
+        """
+        Build the journalctl command to retrieve the logs of the given units as JSON
+        :param units: units to retrieve the logs for
+        :type units: list[str]
+        :param since: start collecting logs from this timestamp
+        :type since: str / DateTime
+        :param until: stop collecting when this timestamp is found
+        :type until: str / DateTime
+        :return: command
+        :rtype: list[str]
+        """
+        command = ['journalctl', '--no-pager', '--output=json']
+        for option, timestamp in [('--since', since), ('--until', until)]:
+            if timestamp is not None:
+                command.append('{0}={1}'.format(option, timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else timestamp))
+        for unit in units:
+            command.extend(['--unit', unit])
+        return command
+
+    @staticmethod
+    def _stream_journal(command, log_path, tail_size=TAIL_SIZE):
+        """
+        Execute a journalctl command and stream its output to a compressed file
+        :param command: command outputting the journal as JSON
+        :type command: list[str]
+        :param log_path: path of the compressed file to write the formatted lines to
+        :type log_path: str
+        :param tail_size: amount of most recent lines to keep per unit
+        :type tail_size: int
+        :return: statistics of the logs (e.g. {'path': ..., 'line_count': 10, 'error_count': 1, 'errors': [...], 'tails': {(hostname, unit): deque}})
+        :rtype: dict
+        """
+        tails = {}
+        error_lines = []
+        error_count = 0
+        line_count = 0
+        with tempfile.TemporaryFile() as stderr_file:  # A pipe would block journalctl once it fills up, as it is only read afterwards
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+            try:
+                with gzip.open(log_path, 'wb') as log_file:
+                    for entry in iter(process.stdout.readline, ''):
+                        try:
+                            hostname, unit, line = LogCollector._format_journal_entry(json.loads(entry))
+                        except ValueError:
+                            continue
+                        line_count += 1
+                        log_file.write(line + '\n')
+                        tails.setdefault((hostname, unit), collections.deque(maxlen=tail_size)).append(line)
+                        if LogCollector.ERROR_PATTERN.search(line):
+                            error_count += 1
+                            if len(error_lines) < LogCollector.MAX_ERROR_LINES:
+                                error_lines.append(line)
+                process.wait()
+            finally:
+                if process.poll() is None:  # Writing or parsing failed
+                    process.kill()
+                    process.wait()
+                process.stdout.close()
+            if process.returncode != 0:
+                stderr_file.seek(0)
+                raise RuntimeError('Collecting logs failed with exit code {0}: {1}'.format(process.returncode, stderr_file.read().strip()))
+        return {'path': log_path, 'line_count': line_count, 'error_count': error_count, 'errors': error_lines, 'tails': tails}
+
+    @staticmethod
+    def _format_journal_entry(entry):
+        """
+        Format a journal entry, as outputted by journalctl --output=json
+        :param entry: journal entry
+        :type entry: dict
+        :return: hostname and unit of the entry, formatted line
+        :rtype: tuple(str, str, str)
+        """
+        message = entry.get('MESSAGE', '')
+        if isinstance(message, list):  # Binary messages are represented as a list of bytes
+            message = bytearray(message).decode('utf-8', 'replace')
+        timestamp = datetime.fromtimestamp(int(entry['__REALTIME_TIMESTAMP']) / 1000000.0)
+        unit = entry.get('_SYSTEMD_UNIT', entry.get('SYSLOG_IDENTIFIER', 'unknown'))
+        hostname = entry.get('_HOSTNAME', '')
+        line = u'{0} {1} {2}: {3}'.format(timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'), hostname, unit, message)
+        return hostname, unit, line.encode('utf-8')
+
+
+class PhaseTimer(object):
+    """
+    Measures how long the phases of a scenario take (e.g. setup, io, validation and teardown)
+    gather_results activates a timer for every test, scenarios mark their phases with:
+        with PhaseTimer.phase('setup'):
+            ...
+    Phases that are entered multiple times accumulate their durations. Outside of gather_results, phases are not measured
+    """
+    _active = []  # Timers of the tests currently executing, the last one receives the measurements
+
+    def __init__(self):
+        self.timings = {}  # phase name -> seconds
+        self.current_phase = None
+        self.failed_phase = None  # Innermost phase the last exception was raised in
+        self._failed_exception = None
+
+    def __enter__(self):
+        PhaseTimer._active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        PhaseTimer._active.remove(self)
+
+    @classmethod
+    @contextmanager
+    def phase(cls, name):
+        """
+        Measure the enclosed block as the given phase of the active test
+        :param name: name of the phase (e.g. setup)
+        :type name: str
+        """
+        timer = cls._active[-1] if len(cls._active) > 0 else None
+        if timer is None:
+            yield
+            return
+        previous_phase = timer.current_phase
+        timer.current_phase = name
+        start = time.time()
+        try:
+            yield
+        except BaseException as ex:
+            if ex is not timer._failed_exception:  # Enclosing phases keep pointing to the phase that raised
+                timer.failed_phase = name
+                timer._failed_exception = ex
+            raise
+        finally:
+            timer.timings[name] = timer.timings.get(name, 0) + time.time() - start
+            timer.current_phase = previous_phase
+
+    def get_failed_phase(self, exception):
+        """
+        Retrieve the phase an exception was raised in. Exceptions that were caught within the scenario do not count
+        :param exception: exception the test failed with
+        :type exception: BaseException
+        :return: the innermost phase the exception was raised in, None when it was raised outside of any phase
+        :rtype: str
+        """
+        return self.failed_phase if exception is self._failed_exception else None
+
+
+def gather_results(case_type, logger, test_name, log_components=None, log_all_nodes=False):
     """
     Result gathering to be used as decorator for the autotests
     Gathers the logs when the test has failed and will push these to testrail
+    The results include the duration of every phase marked with PhaseTimer.phase
     Must be put on the main method of every class that is part of the suite
     Replaces:
         if not blocked:
@@ -452,38 +955,85 @@ def gather_results(case_type, logger, test_name, log_components=None):
     :type test_name: str
     :param log_components: components to fetch logging from when the test would fail
     :type log_components: list
+    :param log_all_nodes: fetch the logging from all storagerouters instead of only the local one
+    :type log_all_nodes: bool
     :return:
+    The decorated method also exposes run_matrix to run it once for every combination of parameters:
+        MyTester.main.run_matrix({'configuration': CIConstants.DATA_TEST_CASES}, blocked=False)
     """
-    import inspect
-    import datetime
-
     def wrapper(func):
+        func_args = inspect.getargspec(func)[0]  # Resolved once, the signature does not change
+        if 'blocked' not in func_args:
+            raise ValueError('Expected argument blocked on {0} but failed to retrieve it.'.format(func.__name__))
+        blocked_index = func_args.index('blocked')
+
         def wrapped(*args, **kwargs):
-            start = datetime.datetime.now()
+            start = datetime.now()
+            timer = PhaseTimer()
             try:
-                func_args = inspect.getargspec(func)[0]
-                try:
-                    blocked_index = func_args.index('blocked')  # Expect blocked
-                except ValueError:
-                    raise ValueError('Expected argument blocked but failed to retrieve it.')
                 blocked = kwargs.get('blocked', None)
                 if kwargs.get('blocked') is None:  # in args
                     blocked = args[blocked_index]
                 if blocked is True:
-                    return {'status': 'BLOCKED', 'case_type': case_type, 'errors': None}
-                result = func(*args, **kwargs)  # Execute the method
-                return {'status': 'PASSED', 'case_type': case_type, 'errors': result}
+                    return {'status': 'BLOCKED', 'case_type': case_type, 'errors': None, 'duration': 0, 'timings': {}}
+                with timer:
+                    result = func(*args, **kwargs)  # Execute the method
+                return {'status': 'PASSED', 'case_type': case_type, 'errors': result, 'duration': (datetime.now() - start).total_seconds(), 'timings': timer.timings}
             except Exception as ex:
-                end = datetime.datetime.now()
-                result_message = ['Exception occurred during {0}'.format(test_name),
+                end = datetime.now()
+                failed_phase = timer.get_failed_phase(ex)
+                result_message = ['Exception occurred during {0}{1}'.format(test_name, ' in phase {0}'.format(failed_phase) if failed_phase else ''),
                                   'Stack trace:\n{0}\n'.format(traceback.format_exc())]
                 try:
                     result_message.extend(['Logs collected between {0} and {1}\n'.format(start, end),
-                                           LogCollector.get_logs(components=log_components, since=start, until=end)])
+                                           LogCollector.collect_logs(test_name, components=log_components, since=start, until=end, all_nodes=log_all_nodes)])
                 except Exception:
                     result_message.extend(['Logs could not be collected between {0} and {1}\n'.format(start, end),
                                            'Stack trace:\n {0}'.format(traceback.format_exc())])
                 logger.exception('Test {0} has failed with error: {1}.'.format(test_name, str(ex)))
-                return {'status': 'FAILED', 'case_type': case_type, 'errors': '\n'.join(result_message), 'blocking': False}
+                return {'status': 'FAILED', 'case_type': case_type, 'errors': '\n'.join(result_message), 'blocking': False, 'duration': (end - start).total_seconds(),
+                        'timings': timer.timings}
+
+        def run_matrix(matrix, *args, **kwargs):
+            """
+            Run the decorated method once for every cell of a parameter matrix. The parameters of a cell are passed as keyword arguments
+            A blocked test is reported as blocked once, without running any cell
+            :param matrix: parameter name -> values to combine (e.g. {'configuration': [(0, 100), (100, 0)], 'vdisk_amount': [1, 2]})
+                           or the list of cells to run (e.g. [{'configuration': (0, 100), 'vdisk_amount': 1}])
+            :type matrix: dict / list[dict]
+            :return: combined result, the result, duration and timings of every cell are listed under cells
+            :rtype: dict
+            """
+            blocked = kwargs.get('blocked')
+            if blocked is None and len(args) > blocked_index:
+                blocked = args[blocked_index]
+            if blocked is True:
+                return dict(wrapped(*args, **kwargs), cells=[])
+            if isinstance(matrix, dict):
+                names = sorted(matrix.keys())
+                cells = [dict(zip(names, values)) for values in itertools.product(*[matrix[name] for name in names])]
+            else:
+                cells = list(matrix)
+            start = datetime.now()
+            cell_results = []
+            for parameters in cells:
+                logger.info('Running {0} with {1}'.format(test_name, parameters))
+                cell_kwargs = kwargs.copy()
+                cell_kwargs.update(parameters)
+                cell_result = wrapped(*args, **cell_kwargs)
+                cell_result['parameters'] = parameters
+                cell_results.append(cell_result)
+            timings = {}
+            for cell_result in cell_results:
+                for phase_name, duration in cell_result['timings'].iteritems():
+                    timings[phase_name] = timings.get(phase_name, 0) + duration
+            errors = ['{0}: {1}'.format(cell_result['parameters'], cell_result['errors']) for cell_result in cell_results if cell_result['status'] == 'FAILED']
+            result = {'status': 'FAILED' if len(errors) > 0 else 'PASSED', 'case_type': case_type, 'errors': '\n\n'.join(errors) if len(errors) > 0 else None,
+                      'duration': (datetime.now() - start).total_seconds(), 'timings': timings, 'cells': cell_results}
+            if len(errors) > 0:
+                result['blocking'] = False
+            return result
+
+        wrapped.run_matrix = run_matrix
         return wrapped
     return wrapper
@@ -0,0 +1,149 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+OVS autotest scenario dependencies
+"""
+import os
+import ast
+import subprocess
+from ovs.extensions.generic.logger import Logger
+
+
+class ScenarioDependencies(object):
+    """
+    Determines which source files a scenario depends on, by statically analysing its imports
+    A scenario depends on all files of its own package and on the helper modules it imports, directly or through other helpers
+    """
+    logger = Logger("autotests-ci_dependencies")
+
+    ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Directory containing the ci package
+    TRACKED_PACKAGES = ('ci.scenario_helpers',)  # Imports of other packages are not followed
+
+    _imports_cache = {}  # path -> set of paths
+
+    @classmethod
+    def get_module_path(cls, module):
+        """
+        Resolve a module name to its source file within the ROOT
+        :param module: name of the module (e.g. ci.scenario_helpers.vm_handler)
+        :type module: str
+        :return: path to the source file, None if the module is not part of the ROOT
+        :rtype: str
+        """
+        base_path = os.path.join(cls.ROOT, *module.split('.'))
+        for path in ['{0}.py'.format(base_path), os.path.join(base_path, '__init__.py')]:
+            if os.path.isfile(path):
+                return path
+        return None
+
+    @classmethod
+    def get_imports(cls, path):
+        """
+        Retrieve the tracked modules imported by a source file
+        :param path: path to the source file
+        :type path: str
+        :return: paths to the source files of the imported modules, including the __init__ of their packages
+        :rtype: set
+        """
+        if path in cls._imports_cache:
+            return cls._imports_cache[path]
+        with open(path, 'r') as source_file:
+            tree = ast.parse(source_file.read(), path)
+        package = os.path.relpath(os.path.dirname(path), cls.ROOT).split(os.sep)
+        modules = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module.split('.') if node.module else []
+                if node.level > 0:  # Relative import
+                    base = package[:len(package) - node.level + 1] + base
+                modules.add('.'.join(base))
+                modules.update('.'.join(base + [alias.name]) for alias in node.names)  # Might be submodules
+        imports = set()
+        for module in modules:
+            if not module.startswith(cls.TRACKED_PACKAGES):
+                continue
+            parts = module.split('.')
+            for index in xrange(1, len(parts) + 1):  # Importing a module executes the __init__ of all its packages
+                module_path = cls.get_module_path('.'.join(parts[:index]))
+                if module_path is not None and '.'.join(parts[:index]).startswith(cls.TRACKED_PACKAGES):
+                    imports.add(module_path)
+        imports.discard(path)
+        cls._imports_cache[path] = imports
+        return imports
+
+    @classmethod
+    def get_dependencies(cls, test):
+        """
+        Retrieve all source files a scenario depends on
+        :param test: name of the scenario (e.g. ci.scenarios.vDisk.data_corruption_reg_test)
+        :type test: str
+        :return: paths to the source files
+        :rtype: set
+        """
+        test_directory = os.path.join(cls.ROOT, *test.split('.'))
+        to_check = []
+        for directory, _, file_names in os.walk(test_directory):
+            to_check.extend(os.path.join(directory, file_name) for file_name in file_names if file_name.endswith('.py'))
+        dependencies = set()
+        while len(to_check) > 0:
+            path = to_check.pop()
+            if path in dependencies:
+                continue
+            dependencies.add(path)
+            try:
+                to_check.extend(cls.get_imports(path))
+            except SyntaxError:
+                cls.logger.warning('Unable to parse {0}, its imports are not followed'.format(path))
+        return dependencies
+
+    @classmethod
+    def get_changed_files(cls, revision):
+        """
+        Retrieve the files that changed since the given git revision, including uncommitted changes
+        :param revision: git revision (e.g. HEAD~3, origin/master or a commit hash)
+        :type revision: str
+        :return: paths to the changed files
+        :rtype: set
+        """
+        try:
+            output = subprocess.check_output(['git', 'diff', '--name-only', revision, '--'], cwd=cls.ROOT)
+            top_level = subprocess.check_output(['git', 'rev-parse', '--show-toplevel'], cwd=cls.ROOT).strip()
+        except (OSError, subprocess.CalledProcessError) as ex:
+            raise RuntimeError('Unable to list the files changed since {0} in {1}: {2}'.format(revision, cls.ROOT, ex))
+        return set(os.path.join(top_level, line.strip()) for line in output.splitlines() if line.strip())
+
+    @classmethod
+    def select_changed(cls, tests, revision):
+        """
+        Select the scenarios of which the code or the helpers they depend on changed since the given git revision
+        :param tests: scenarios to select from
+        :type tests: list[str]
+        :param revision: git revision
+        :type revision: str
+        :return: the affected scenarios, in their original order
+        :rtype: list[str]
+        """
+        changed_files = set(os.path.realpath(path) for path in cls.get_changed_files(revision))
+        selected = []
+        for test in tests:
+            dependencies = set(os.path.realpath(path) for path in cls.get_dependencies(test))
+            if len(dependencies & changed_files) > 0:
+                selected.append(test)
+        cls.logger.info('{0} out of {1} tests are affected by the changes since {2}'.format(len(selected), len(tests), revision))
+        return selected
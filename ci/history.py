@@ -0,0 +1,220 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+OVS autotest scenario history
+"""
+import os
+import json
+import time
+from ci.scheduler import ScenarioScheduler
+from ovs.extensions.generic.logger import Logger
+
+
+class ScenarioHistory(object):
+    """
+    Keeps track of how long every scenario took, within an append-only JSON lines file
+    Each line represents one execution: {"scenario": ..., "status": ..., "duration": ..., "timestamp": ...}
+    """
+    logger = Logger("autotests-ci_history")
+
+    HISTORY_LOC = '/opt/OpenvStorage/ci/config/scenario_history.jsonl'
+    LAST_RESULTS_LOC = '/opt/OpenvStorage/ci/config/last_results.json'
+    RERUN_STATUSES = ['FAILED', 'BLOCKED']  # Statuses of scenarios that are executed again when rerunning failed ones
+    RECORDED_STATUSES = ['PASSED', 'FAILED']  # Blocked or skipped scenarios do not say anything about the duration
+    WINDOW = 10  # Amount of most recent executions to base the expected duration on
+
+    @classmethod
+    def record(cls, results, history_path=HISTORY_LOC):
+        """
+        Append the durations of the given results to the history
+        :param results: results of the scenarios (e.g {'ci.scenarios.arakoon.collapse': {'status': 'FAILED', 'duration': 12.3}})
+        :type results: dict
+        :param history_path: path to the history file
+        :type history_path: str
+        :return: None
+        :rtype: NoneType
+        """
+        lines = []
+        now = time.time()
+        for test, result in sorted(results.iteritems()):
+            if result.get('duration') is None or result.get('status') not in cls.RECORDED_STATUSES:
+                continue
+            lines.append(json.dumps({'scenario': test, 'status': result['status'], 'duration': result['duration'], 'timestamp': now}))
+        if len(lines) == 0:
+            return
+        with open(history_path, 'a') as history_file:
+            history_file.write('\n'.join(lines) + '\n')
+
+    @classmethod
+    def save_last_results(cls, results, last_results_path=LAST_RESULTS_LOC):
+        """
+        Persist the status of the given results. Scenarios that were not part of the results keep their previous status
+        :param results: results of the scenarios (e.g {'ci.scenarios.arakoon.collapse': {'status': 'FAILED', 'duration': 12.3}})
+        :type results: dict
+        :param last_results_path: path to the last results file
+        :type last_results_path: str
+        :return: None
+        :rtype: NoneType
+        """
+        last_results = cls.get_last_results(last_results_path)
+        now = time.time()
+        for test, result in results.iteritems():
+            last_results[test] = {'status': result.get('status'), 'timestamp': now}
+        temporary_path = '{0}.tmp'.format(last_results_path)
+        with open(temporary_path, 'w') as last_results_file:
+            json.dump(last_results, last_results_file, indent=4, sort_keys=True)
+        os.rename(temporary_path, last_results_path)  # Never leave a half written file behind
+
+    @classmethod
+    def get_last_results(cls, last_results_path=LAST_RESULTS_LOC):
+        """
+        Retrieve the last persisted status of every scenario
+        :param last_results_path: path to the last results file
+        :type last_results_path: str
+        :return: last status per scenario (e.g {'ci.scenarios.arakoon.collapse': {'status': 'FAILED', 'timestamp': 1500000000.0}})
+        :rtype: dict
+        """
+        if not os.path.exists(last_results_path):
+            return {}
+        try:
+            with open(last_results_path, 'r') as last_results_file:
+                return json.load(last_results_file)
+        except ValueError:
+            cls.logger.warning('Ignoring malformed last results file {0}'.format(last_results_path))
+            return {}
+
+    @classmethod
+    def select_failed(cls, tests, exclude_flag='', last_results_path=LAST_RESULTS_LOC):
+        """
+        Select the scenarios that failed or were blocked during their last execution
+        :param tests: scenarios to select from
+        :type tests: list[str]
+        :param exclude_flag: flag stripped from the scenario names within the results
+        :type exclude_flag: str
+        :param last_results_path: path to the last results file
+        :type last_results_path: str
+        :return: the scenarios to execute again, in their original order
+        :rtype: list[str]
+        """
+        last_results = cls.get_last_results(last_results_path)
+        selected = []
+        for test in tests:
+            result = last_results.get(test.replace(exclude_flag, '') if exclude_flag else test)
+            if result is not None and result['status'] in cls.RERUN_STATUSES:
+                selected.append(test)
+        cls.logger.info('{0} out of {1} tests failed during their last execution'.format(len(selected), len(tests)))
+        return selected
+
+    @classmethod
+    def get_durations(cls, history_path=HISTORY_LOC, window=WINDOW):
+        """
+        Retrieve the expected duration of every scenario: the median of its most recent executions
+        :param history_path: path to the history file
+        :type history_path: str
+        :param window: amount of most recent executions to take into account
+        :type window: int
+        :return: expected duration in seconds per scenario
+        :rtype: dict
+        """
+        executions = {}
+        if not os.path.exists(history_path):
+            return executions
+        with open(history_path, 'r') as history_file:
+            for line_number, line in enumerate(history_file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                    scenario, duration = entry['scenario'], float(entry['duration'])
+                except (ValueError, KeyError, TypeError):
+                    cls.logger.warning('Ignoring malformed line {0} of {1}'.format(line_number, history_path))
+                    continue
+                executions.setdefault(scenario, []).append(duration)
+        durations = {}
+        for test, test_durations in executions.iteritems():
+            recent = sorted(test_durations[-window:])
+            middle = len(recent) / 2
+            durations[test] = recent[middle] if len(recent) % 2 == 1 else (recent[middle - 1] + recent[middle]) / 2.0
+        return durations
+
+    @classmethod
+    def get_expected_duration(cls, test, durations):
+        """
+        Expected duration of a scenario. Falls back to the EXPECTED_DURATION of the scenario when it has no history
+        :param test: name of the scenario
+        :type test: str
+        :param durations: durations retrieved with get_durations
+        :type durations: dict
+        :return: expected duration in seconds
+        :rtype: float
+        """
+        if test in durations:
+            return durations[test]
+        try:
+            return ScenarioScheduler.get_metadata(test)['expected_duration']
+        except Exception:
+            return ScenarioScheduler.DEFAULT_DURATION
+
+    @classmethod
+    def shard(cls, tests, shard_index, shard_count, durations=None):
+        """
+        Split the given scenarios into duration-balanced shards and return the requested one
+        Every node computes the same split given the same history, so all nodes together run every scenario once
+        Scenarios linked through prerequisites always end up within the same shard
+        :param tests: scenarios to split
+        :type tests: list[str]
+        :param shard_index: index of the requested shard, starting from 1
+        :type shard_index: int
+        :param shard_count: total amount of shards
+        :type shard_count: int
+        :param durations: durations retrieved with get_durations. Read from the history when not provided
+        :type durations: dict
+        :return: scenarios within the requested shard, in their original order
+        :rtype: list[str]
+        """
+        if not 1 <= shard_index <= shard_count:
+            raise ValueError('Shard {0}/{1} does not exist'.format(shard_index, shard_count))
+        if durations is None:
+            durations = cls.get_durations()
+        # Group the scenarios that depend on each other
+        groups = dict((test, set([test])) for test in tests)
+        for test in tests:
+            try:
+                prerequisites = ScenarioScheduler.get_metadata(test)['prerequisites']
+            except Exception:
+                continue  # Will surface when running the scenario
+            for prerequisite in prerequisites:
+                if prerequisite not in groups or groups[prerequisite] is groups[test]:
+                    continue
+                merged = groups[test] | groups[prerequisite]
+                for member in merged:
+                    groups[member] = merged
+        units = []
+        for group in groups.values():
+            if group not in units:
+                units.append(group)
+        # Longest processing time first: hand out the longest groups to the least loaded shard
+        units.sort(key=lambda unit: (-sum(cls.get_expected_duration(test, durations) for test in unit), sorted(unit)))
+        loads = [0] * shard_count
+        assigned = [set() for _ in xrange(shard_count)]
+        for unit in units:
+            target = loads.index(min(loads))
+            loads[target] += sum(cls.get_expected_duration(test, durations) for test in unit)
+            assigned[target].update(unit)
+        cls.logger.info('Expected shard durations: {0}'.format(', '.join('{0}/{1}: {2}s'.format(index, shard_count, int(load)) for index, load in enumerate(loads, 1))))
+        return [test for test in tests if test in assigned[shard_index - 1]]
@@ -0,0 +1,99 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+OVS autotest scenario preflight
+Executed as `python -m ci.preflight <scenario>` by ScenarioScheduler.preflight. Only the standard library is loaded before
+the scenario is imported, so the measured import time includes every module the scenario needs
+"""
+import sys
+import json
+import time
+import __builtin__
+import importlib
+import traceback
+
+
+class ImportProfiler(object):
+    """
+    Measures how long every imported module takes to load, similar to -X importtime of newer python versions
+    Used as a context manager: all imports within the block are measured
+    """
+    def __init__(self):
+        self.timings = {}  # module name -> {'self': seconds, 'cumulative': seconds}
+        self._original_import = None
+        self._stack = []
+
+    def __enter__(self):
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        __builtin__.__import__ = self._original_import
+
+    def _import(self, name, *args, **kwargs):
+        loaded_modules = len(sys.modules)
+        self._stack.append(0)  # Time spent in nested imports
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            cumulative = time.time() - start
+            nested = self._stack.pop()
+            if len(self._stack) > 0:
+                self._stack[-1] += cumulative
+            if len(sys.modules) > loaded_modules:  # Only account imports that actually loaded something
+                timing = self.timings.setdefault(name, {'self': 0, 'cumulative': 0})
+                timing['self'] += cumulative - nested
+                timing['cumulative'] += cumulative
+
+    def get_slowest(self, amount=10):
+        """
+        :param amount: amount of modules to return
+        :type amount: int
+        :return: the modules that took the longest to load themselves: list of (module name, self time, cumulative time)
+        :rtype: list[tuple(str, float, float)]
+        """
+        timings = sorted(self.timings.iteritems(), key=lambda item: item[1]['self'], reverse=True)[:amount]
+        return [(name, timing['self'], timing['cumulative']) for name, timing in timings]
+
+
+def preflight_scenario(test):
+    """
+    Imports a scenario while measuring its import time
+    :param test: name of the scenario
+    :type test: str
+    :return: outcome of the import: {'test': ..., 'duration': ..., 'modules': ..., 'error': None}
+    :rtype: dict
+    """
+    profiler = ImportProfiler()
+    start = time.time()
+    error = None
+    try:
+        with profiler:
+            importlib.import_module('{0}.main'.format(test))
+    except Exception:
+        error = 'Unable to import test {0}: \n {1}'.format(test, traceback.format_exc())
+    return {'test': test, 'duration': time.time() - start, 'modules': profiler.get_slowest(), 'error': error}
+
+
+if __name__ == '__main__':
+    stdout = sys.stdout
+    sys.stdout = sys.stderr  # Whatever the scenario prints while being imported does not end up within the outcome
+    outcome = preflight_scenario(sys.argv[1])
+    sys.stdout = stdout
+    sys.stdout.write('{0}\n'.format(json.dumps(outcome)))
@@ -0,0 +1,255 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+# This module is copied to and executed on the clients of which the data is verified: it only depends on the standard library
+# and runs on both python 2 and 3
+import os
+import sys
+import json
+import mmap
+import stat
+import zlib
+import errno
+import struct
+import threading
+
+
+class IntegrityPattern(object):
+    """
+    Writes and verifies self-describing blocks
+    Every block starts with a header holding a magic, the offset of the block, a generation and a CRC32 over the payload and
+    the header. A block that got lost, misdirected, went stale or got corrupted is therefore recognized on its own,
+    without keeping a copy of the data. Verification maps the target in memory and checks ranges of blocks concurrently
+    """
+    MAGIC = b'OVSBLK01'
+    HEADER = struct.Struct('<8sQQI')  # Magic, offset, generation, CRC32
+    PREFIX = struct.Struct('<8sQQ')  # The part of the header covered by the CRC
+    BLOCK_SIZE = 4096
+    WRITE_SIZE = 1024 * 1024  # Bytes written per call
+    THREADS = 4
+    MAX_RANGES = 1000  # Corrupted ranges to report, the counts include all of them
+    REASONS = ['unwritten', 'misplaced', 'stale', 'checksum']
+
+    @classmethod
+    def _get_crc(cls, payload, offset, generation):
+        """
+        :return: the CRC32 of a block
+        :rtype: int
+        """
+        return zlib.crc32(cls.PREFIX.pack(cls.MAGIC, offset, generation), zlib.crc32(payload)) & 0xffffffff
+
+    @staticmethod
+    def _get_size(fd, size=None):
+        """
+        :return: the amount of bytes to write or verify: the given size, limited to the size of a block device
+        :rtype: int
+        """
+        if stat.S_ISBLK(os.fstat(fd).st_mode):
+            device_size = os.lseek(fd, 0, os.SEEK_END)
+            return device_size if size is None else min(size, device_size)
+        if size is None:
+            return os.fstat(fd).st_size
+        return size
+
+    @classmethod
+    def write(cls, filename, size=None, generation=1, block_size=BLOCK_SIZE, direct=True):
+        """
+        Fill the target with blocks of the given generation
+        The payload is random but shared by all blocks of a write, only the headers differ
+        :param filename: file or block device to write
+        :type filename: str
+        :param size: amount of bytes to write, rounded down to whole blocks. Defaults to the whole target
+        :type size: int
+        :param generation: generation to stamp the blocks with. Use a new generation to recognize stale blocks afterwards
+        :type generation: int
+        :param block_size: size of the blocks, a multiple of 4k
+        :type block_size: int
+        :param direct: bypass the page cache
+        :type direct: bool
+        :return: summary of the write (e.g. {'blocks': 512, 'bytes': 2097152, 'generation': 1})
+        :rtype: dict
+        """
+        if block_size % 4096 != 0 or block_size <= cls.HEADER.size:
+            raise ValueError('The block size should be a multiple of 4k')
+        flags = os.O_WRONLY | os.O_CREAT
+        fd = None
+        if direct is True and hasattr(os, 'O_DIRECT'):
+            try:
+                fd = os.open(filename, flags | os.O_DIRECT, 0o644)
+            except OSError as ex:
+                if ex.errno != errno.EINVAL:  # The filesystem does not support direct IO (e.g. tmpfs)
+                    raise
+        if fd is None:
+            fd = os.open(filename, flags, 0o644)
+        blocks_per_write = max(1, cls.WRITE_SIZE // block_size)
+        buffer = mmap.mmap(-1, blocks_per_write * block_size)  # Page aligned, as required by O_DIRECT
+        try:
+            size = cls._get_size(fd, size)
+            block_count = size // block_size
+            if block_count == 0:
+                raise ValueError('Nothing to write within {0}, specify a size of at least one block'.format(filename))
+            payload = os.urandom(block_size - cls.HEADER.size)
+            payload_crc = zlib.crc32(payload)
+            for index in range(blocks_per_write):
+                buffer[index * block_size + cls.HEADER.size:(index + 1) * block_size] = payload
+            for first_block in range(0, block_count, blocks_per_write):
+                amount = min(blocks_per_write, block_count - first_block)
+                for index in range(amount):
+                    offset = (first_block + index) * block_size
+                    crc = zlib.crc32(cls.PREFIX.pack(cls.MAGIC, offset, generation), payload_crc) & 0xffffffff
+                    cls.HEADER.pack_into(buffer, index * block_size, cls.MAGIC, offset, generation, crc)
+                os.lseek(fd, first_block * block_size, os.SEEK_SET)
+                if amount == blocks_per_write:
+                    written = os.write(fd, buffer)
+                else:  # The last write: slicing the buffer would copy it to memory that is not aligned
+                    tail = mmap.mmap(-1, amount * block_size)
+                    try:
+                        tail[:] = buffer[:amount * block_size]
+                        written = os.write(fd, tail)
+                    finally:
+                        tail.close()
+                if written != amount * block_size:
+                    raise IOError(errno.EIO, 'Short write of {0} bytes at offset {1}'.format(written, first_block * block_size))
+            os.fsync(fd)
+        finally:
+            buffer.close()
+            os.close(fd)
+        return {'blocks': block_count, 'bytes': block_count * block_size, 'generation': generation}
+
+    @classmethod
+    def _verify_range(cls, mapping, first_block, last_block, block_size, generation):
+        """
+        Verify a range of blocks
+        :return: the corrupted ranges, as [start offset, end offset, reason], merged when consecutive blocks share the reason
+        :rtype: list[list]
+        """
+        ranges = []
+        header_size = cls.HEADER.size
+        unpack_from = cls.HEADER.unpack_from
+        for block in range(first_block, last_block):
+            offset = block * block_size
+            magic, block_offset, block_generation, crc = unpack_from(mapping, offset)
+            if magic != cls.MAGIC:
+                reason = 'unwritten'
+            elif block_offset != offset:
+                reason = 'misplaced'
+            elif block_generation != generation:
+                reason = 'stale'
+            elif cls._get_crc(mapping[offset + header_size:offset + block_size], offset, generation) != crc:
+                reason = 'checksum'
+            else:
+                continue
+            if len(ranges) > 0 and ranges[-1][1] == offset and ranges[-1][2] == reason:
+                ranges[-1][1] = offset + block_size
+            else:
+                ranges.append([offset, offset + block_size, reason])
+        return ranges
+
+    @classmethod
+    def verify(cls, filename, size=None, generation=1, block_size=BLOCK_SIZE, threads=THREADS):
+        """
+        Verify all blocks of the target
+        :param filename: file or block device to verify
+        :type filename: str
+        :param size: amount of bytes to verify. Defaults to the whole target
+        :type size: int
+        :param generation: generation the blocks should have
+        :type generation: int
+        :param block_size: size of the blocks the target was written with
+        :type block_size: int
+        :param threads: amount of ranges to verify concurrently
+        :type threads: int
+        :return: report (e.g. {'blocks': 512, 'corrupted_blocks': 1, 'reasons': {'checksum': 1}, 'ranges': [{'start': 4096, 'end': 8192, 'reason': 'checksum'}]})
+        :rtype: dict
+        """
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            size = cls._get_size(fd, size)
+            block_count = size // block_size
+            if block_count == 0:
+                raise ValueError('Nothing to verify within {0}'.format(filename))
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, size, os.POSIX_FADV_DONTNEED)  # Read the data from the device instead of the page cache
+            mapping = mmap.mmap(fd, block_count * block_size, mmap.MAP_SHARED, mmap.PROT_READ)
+        finally:
+            os.close(fd)
+        try:
+            threads = max(1, min(threads, block_count))
+            per_thread = -(-block_count // threads)
+            results = [None] * threads
+
+            def _verify(index):
+                results[index] = cls._verify_range(mapping, index * per_thread, min(block_count, (index + 1) * per_thread), block_size, generation)
+
+            workers = [threading.Thread(target=_verify, args=(index,)) for index in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            mapping.close()
+        ranges = []
+        for thread_ranges in results:
+            for start, end, reason in thread_ranges or []:
+                if len(ranges) > 0 and ranges[-1][1] == start and ranges[-1][2] == reason:  # Merge over the borders of the threads
+                    ranges[-1][1] = end
+                else:
+                    ranges.append([start, end, reason])
+        reasons = dict((reason, 0) for reason in cls.REASONS)
+        for start, end, reason in ranges:
+            reasons[reason] += (end - start) // block_size
+        if None in results:
+            raise RuntimeError('Not all ranges of {0} could be verified'.format(filename))
+        return {'blocks': block_count, 'bytes': block_count * block_size, 'generation': generation,
+                'corrupted_blocks': sum(reasons.values()), 'reasons': reasons,
+                'ranges': [{'start': start, 'end': end, 'reason': reason} for start, end, reason in ranges[:cls.MAX_RANGES]]}
+
+    @classmethod
+    def main(cls, arguments):
+        """
+        Command line entry: write or verify, with --key=value options. The result is printed as JSON
+        e.g. python data_integrity.py verify --filename=/mnt/data/vm.raw --size=2097152 --generation=1
+        :return: exit code: 0 when successful and no corruption was found, 1 when corruption was found, 2 on errors
+        :rtype: int
+        """
+        if len(arguments) == 0 or arguments[0] not in ['write', 'verify']:
+            sys.stderr.write('Usage: data_integrity.py write|verify --filename=... [--size=...] [--generation=...] [--block_size=...]\n')
+            return 2
+        options = {}
+        for argument in arguments[1:]:
+            key, _, value = argument.lstrip('-').partition('=')
+            options[key.replace('-', '_')] = value
+        try:
+            kwargs = {'filename': options.pop('filename'),
+                      'generation': int(options.pop('generation', 1)),
+                      'block_size': int(options.pop('block_size', cls.BLOCK_SIZE))}
+            if 'size' in options:
+                kwargs['size'] = int(options.pop('size'))
+            if arguments[0] == 'write':
+                kwargs['direct'] = options.pop('direct', '1') == '1'
+            else:
+                kwargs['threads'] = int(options.pop('threads', cls.THREADS))
+            if len(options) > 0:
+                raise ValueError('Unsupported options: {0}'.format(', '.join(sorted(options))))
+            result = cls.write(**kwargs) if arguments[0] == 'write' else cls.verify(**kwargs)
+        except (KeyError, ValueError, OSError, IOError, RuntimeError) as ex:
+            sys.stdout.write(json.dumps({'error': str(ex)}) + '\n')
+            return 2
+        sys.stdout.write(json.dumps(result) + '\n')
+        return 1 if result.get('corrupted_blocks', 0) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(IntegrityPattern.main(sys.argv[1:]))
@@ -13,8 +13,19 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+import json
 import math
 import uuid
+import pipes
+import inspect
+from multiprocessing.pool import ThreadPool
+from ci.api_lib.helpers.thread import Waiter
+from ci.scenario_helpers import data_integrity, io_engine, io_trace
+from ci.scenario_helpers.data_integrity import IntegrityPattern
+from ci.scenario_helpers.fio_results import FioResult
+from ci.scenario_helpers.fio_status import FioStatusStream
+from ci.scenario_helpers.io_trace import TraceReplayer
+from ci.scenario_helpers.vdbench_results import VdbenchMonitor
 from ovs.extensions.generic.logger import Logger
 from ovs_extensions.generic.toolbox import ExtensionsToolbox
 
@@ -25,17 +36,23 @@ class DataWriter(object):
     """
     LOGGER = Logger('scenario_helpers-data_writer')
     FIO_VDISK_LIMIT = 50
+    EDGE_QUEUE_LIMIT = 1024  # Outstanding IOs a single fio process keeps towards the edge
+    ENGINES = ['fio', 'builtin']
+    IO_ENGINE_INTERPRETER = 'python3'  # Interpreter that runs the built-in engine and the integrity checks on the client, both support python 2 and 3
 
     @classmethod
     def write_data_fio(cls, client, fio_configuration, edge_configuration=None, file_locations=None, fio_vdisk_limit=FIO_VDISK_LIMIT,
-                       screen=True, loop_screen=True, nbd_device=False, logger=LOGGER):
+                       screen=True, loop_screen=True, nbd_device=False, fetch_results=False, job_file=False, status_interval=None,
+                       engine='fio', logger=LOGGER):
         """
         Start writing data using fio
         Will output to files within /tmp/
         :param client: 
-        :param fio_configuration: configuration for fio. Specify iodepth and bs
-        :type fio_configuration: dict {'bs': '4k', 'iodepth': 32}
+        :param fio_configuration: configuration for fio. Specify iodepth and bs. numjobs is only used with job files
+                                  bssplit, percentage_random and rate_iops describe a mixed workload, see ci.scenario_helpers.workload
+        :type fio_configuration: dict {'bs': '4k', 'iodepth': 32, 'numjobs': 1}
         :param edge_configuration: configuration to fio over edge -OPTIONAL eg {'port': 26203, 'hostname': 10.100.10.100, 'protocol': tcp|udp, 'fio_bin_location': /tmp/fio.bin, 'volumename': ['myvdisk00']}
+                                   'queue_limit' optionally overrules the EDGE_QUEUE_LIMIT for job files
         :type edge_configuration: dict
         :param file_locations: in conjunction with edge_configuration=None, points towards the files to perform fio on -OPTIONAL
         :type file_locations: list
@@ -47,14 +64,134 @@ class DataWriter(object):
         :type loop_screen: bool
         :param nbd_device: whether or not the target is an nbd_device
         :type nbd_device: bool
+        :param fetch_results: parse the json output of fio once it finished. Only possible when not offloading to a screen
+        :type fetch_results: bool
+        :param job_file: describe the jobs in fio job files instead of on the command line. The volumes or files are split over
+                         one fio process per core, pinned to its cores. Edge batches are limited by the queue limit of the edge
+        :type job_file: bool
+        :param status_interval: let fio append a status report to its output every x seconds, e.g. to follow it with a FioStatusStream.
+                                Requires the json output format
+        :type status_interval: int
+        :param engine: generate the IO with fio or with the built-in engine (ci.scenario_helpers.io_engine). The built-in engine only
+                       requires python on the client and produces the same output, but only supports file_locations without job files
+        :type engine: str
         :param logger: logging instance
-        :return: 
+        :return: list of screen names (empty if screen is False), list of output files and, when fetch_results is True, the parsed results
+        :rtype: tuple(list, list) / tuple(list, list, ci.scenario_helpers.fio_results.FioResult)
+        """
+        if fetch_results is True and screen is True:
+            raise ValueError('Results can only be fetched when fio does not run within a screen')
+        cmds, screen_names, output_files = cls._prepare_fio(client=client,
+                                                            fio_configuration=fio_configuration,
+                                                            edge_configuration=edge_configuration,
+                                                            file_locations=file_locations,
+                                                            fio_vdisk_limit=fio_vdisk_limit,
+                                                            screen=screen,
+                                                            loop_screen=loop_screen,
+                                                            nbd_device=nbd_device,
+                                                            job_file=job_file,
+                                                            status_interval=status_interval,
+                                                            engine=engine,
+                                                            logger=logger)
+        for cmd in cmds:
+            logger.debug('Writing data with: {0}'.format(' '.join(cmd)))
+            client.run(cmd)
+        if fetch_results is True:
+            if fio_configuration.get('output_format', 'json') != 'json':
+                raise ValueError('Results can only be fetched with the json output format')
+            return screen_names, output_files, cls.get_fio_results(client, output_files)
+        return screen_names, output_files
+
+    @classmethod
+    def dispatch_fio(cls, targets, fio_configuration, logger=LOGGER, **kwargs):
+        """
+        Start fio on multiple clients at once
+        The commands are prepared on all clients concurrently. Once every client is prepared, all of them start fio
+        at the same moment, so the load on all targets starts simultaneously instead of one client after the other
+        :param targets: clients to write from, with their write_data_fio arguments (e.g. [{'client': vm_client, 'file_locations': ['/mnt/data/vm.raw']}])
+        :type targets: list[dict]
+        :param fio_configuration: configuration for fio, shared by all targets. See write_data_fio
+        :type fio_configuration: dict
+        :param logger: logging instance
+        :param kwargs: write_data_fio arguments shared by all targets (e.g. job_file=True). Overruled by those of the target
+                       When a status_interval is passed, the status reports of all instances are followed live
+        :return: handle on all started fio instances
+        :rtype: FioDispatch
+        """
+        if len(targets) == 0:
+            raise ValueError('No targets to dispatch fio to')
+        if kwargs.get('fetch_results') is True:
+            raise ValueError('Results of dispatched fio instances are fetched through the returned handle')
+        kwargs.pop('fetch_results', None)
+        start_barrier = Waiter(len(targets))
+        failures = []
+
+        def _start(target):
+            target_kwargs = dict(kwargs)
+            target_kwargs.update(target)
+            client = target_kwargs.pop('client')
+            prepared = None
+            try:
+                prepared = cls._prepare_fio(client=client, fio_configuration=fio_configuration, logger=logger, **target_kwargs)
+            except Exception as ex:
+                logger.exception('Preparing fio on {0} has failed'.format(client.ip))
+                failures.append('{0}: {1}'.format(client.ip, str(ex)))
+            finally:
+                start_barrier.wait()  # Every target passes the barrier, so a failing one can not block the others
+            if len(failures) > 0:
+                return None
+            cmds, screen_names, output_files = prepared
+            instance = {'client': client, 'screen_names': screen_names, 'output_files': output_files}
+            try:
+                for cmd in cmds:
+                    logger.debug('Writing data on {0} with: {1}'.format(client.ip, ' '.join(cmd)))
+                    client.run(cmd)
+            except Exception as ex:
+                logger.exception('Starting fio on {0} has failed'.format(client.ip))
+                failures.append('{0}: {1}'.format(client.ip, str(ex)))
+            return instance
+
+        pool = ThreadPool(processes=len(targets))  # One thread per target, all of them have to reach the barrier
+        try:
+            instances = pool.map(_start, targets)
+        finally:
+            pool.close()
+            pool.join()
+        handle = FioDispatch([instance for instance in instances if instance is not None], fio_configuration.get('output_format', 'json'))
+        if len(failures) > 0:
+            handle.stop()
+            raise RuntimeError('Fio could not be started on all targets: {0}'.format(', '.join(failures)))
+        logger.info('Started fio on {0} target(s)'.format(len(targets)))
+        if kwargs.get('status_interval') is not None:
+            try:
+                handle.start_status_streams()
+            except Exception:
+                handle.stop()  # Do not leave the fio screens running behind
+                raise
+        return handle
+
+    @classmethod
+    def _prepare_fio(cls, client, fio_configuration, edge_configuration=None, file_locations=None, fio_vdisk_limit=FIO_VDISK_LIMIT,
+                     screen=True, loop_screen=True, nbd_device=False, job_file=False, status_interval=None, engine='fio', logger=LOGGER):
+        """
+        Validate the configuration and prepare the fio commands, without starting them
+        See write_data_fio for the parameters
+        :return: the commands to run, the screen names and the output files
+        :rtype: tuple(list, list, list)
         """
         if edge_configuration is None and file_locations is None:
             raise ValueError('Either edge configuration or file_locations need to be specified')
+        if engine not in cls.ENGINES:
+            raise ValueError('Unknown engine {0}. Choose from {1}'.format(engine, ', '.join(cls.ENGINES)))
+        if engine == 'builtin' and (edge_configuration is not None or job_file is True):
+            raise ValueError('The built-in engine only supports file_locations without job files')
         required_fio_params = {'bs': (str, None, False),  # Block size
+                               'bssplit': (str, None, False),  # Weighted block sizes, overrules bs (e.g. 4k/70:64k/30)
+                               'percentage_random': (int, {'min': 0, 'max': 100}, False),  # Share of random IO, the rest is sequential
+                               'rate_iops': (int, {'min': 1}, False),  # IOPS limit per job
                                'iodepth': (int, {'min': 1, 'max': 1024}, False),  # Iodepth, correlated to the amount of iterations to do
                                'output_format': (str, ['normal', 'terse', 'json'], False),  # Output format of fio
+                               'numjobs': (int, {'min': 1, 'max': 64}, False),  # Clones of every job, only used with job files
                                'io_size': (int, None),  # Nr of bytes to write/read
                                'configuration': (tuple, None)}  # configuration params for fio.First value represents read, second one write percentage eg (10, 90)
         ExtensionsToolbox.verify_required_params(required_fio_params, fio_configuration)
@@ -65,7 +202,8 @@ class DataWriter(object):
                                     'hostname': (str, None),
                                     'fio_bin_location': (str, None),
                                     'username': (str, None, False),
-                                    'password': (str, None, False)}
+                                    'password': (str, None, False),
+                                    'queue_limit': (int, {'min': 1}, False)}
             ExtensionsToolbox.verify_required_params(required_edge_params, edge_configuration)
         bs = fio_configuration.get('bs', '4k')
         iodepth = fio_configuration.get('iodepth', 32)
@@ -77,12 +215,35 @@ class DataWriter(object):
         cmds = []
         output_directory = '/tmp/data_write_{0}'.format(uuid.uuid4())
         client.dir_create(output_directory)
-        cmd = ['--iodepth={0}'.format(iodepth), '--rw=randrw', '--bs={0}'.format(bs),
+        cmd = ['--iodepth={0}'.format(iodepth), '--rw=randrw',
+               '--bssplit={0}'.format(fio_configuration['bssplit']) if 'bssplit' in fio_configuration else '--bs={0}'.format(bs),
                '--rwmixread={0}'.format(configuration[0]), '--rwmixwrite={0}'.format(configuration[1]),
                '--randrepeat=0', '--size={0}'.format(write_size)]  # Base config for both edge fio and file fio
+        for option in ['percentage_random', 'rate_iops']:
+            if option in fio_configuration:
+                cmd.append('--{0}={1}'.format(option, fio_configuration[option]))
         if not nbd_device:
             cmd.append('--direct=1')
-        if edge_configuration:
+        if engine == 'builtin':
+            engine_location = cls._deploy_script(client, io_engine, output_directory)
+            current_cmd = [cls.IO_ENGINE_INTERPRETER, engine_location] + cmd
+            for index, file_location in enumerate(file_locations):
+                current_cmd.extend(['--name=test{0}'.format(index), '--filename={0}'.format(file_location)])
+            output_file = '{0}/fio'.format(output_directory)
+            output_files.append(output_file)
+            current_cmd.extend(['--output={0}'.format(output_file), '--output-format={0}'.format(fio_output_format)])
+            cmds.append(current_cmd)
+        elif job_file is True:
+            cmds, output_files = cls._prepare_fio_job_files(client=client,
+                                                            base_options=[option[2:].split('=', 1) for option in cmd],
+                                                            output_directory=output_directory,
+                                                            output_format=fio_output_format,
+                                                            edge_configuration=edge_configuration,
+                                                            file_locations=file_locations,
+                                                            numjobs=fio_configuration.get('numjobs', 1),
+                                                            fio_vdisk_limit=fio_vdisk_limit,
+                                                            logger=logger)
+        elif edge_configuration:
             volumes = edge_configuration['volumenames']
             fio_amount = int(math.ceil(float(len(volumes)) / fio_vdisk_limit))  # Amount of fio commands to prep
             for fio_nr in xrange(0, fio_amount):
@@ -115,40 +276,368 @@ class DataWriter(object):
             output_files.append(output_file)
             current_cmd.extend(['--output={0}'.format(output_file), '--output-format={0}'.format(fio_output_format)])
             cmds.append(current_cmd)
+        if status_interval is not None:
+            if fio_output_format != 'json':
+                raise ValueError('Status reports can only be followed with the json output format')
+            for cmd in cmds:
+                cmd.append('--status-interval={0}'.format(status_interval))
         if screen is True:
             for index, cmd in enumerate(cmds):
                 screen_name = 'fio_{0}'.format(str(index).zfill(3))
                 cmds[index] = cls._prepend_screen(' '.join(cmd), screen_name, loop_screen)
                 screen_names.append(screen_name)
-        for cmd in cmds:
-            logger.debug('Writing data with: {0}'.format(' '.join(cmd)))
-            client.run(cmd)
-        return screen_names, output_files
+        return cmds, screen_names, output_files
+
+    @classmethod
+    def _prepare_fio_job_files(cls, client, base_options, output_directory, output_format, edge_configuration=None, file_locations=None,
+                               numjobs=1, fio_vdisk_limit=FIO_VDISK_LIMIT, logger=LOGGER):
+        """
+        Write the fio job files and build the commands to execute them
+        Every job file describes one batch of volumes or files and is executed by its own fio process, pinned to its share of the cores
+        :param client: client to run fio on
+        :param base_options: fio options shared by all jobs (e.g. [['iodepth', '32'], ['bs', '4k']])
+        :type base_options: list[list[str]]
+        :param output_directory: directory to write the job files and the output files to
+        :type output_directory: str
+        :param output_format: output format of fio
+        :type output_format: str
+        :param edge_configuration: configuration to fio over edge (see write_data_fio)
+        :type edge_configuration: dict
+        :param file_locations: in conjunction with edge_configuration=None, the files to perform fio on
+        :type file_locations: list
+        :param numjobs: clones of every job
+        :type numjobs: int
+        :param fio_vdisk_limit: maximum amount of volumes or files to handle with one fio process
+        :type fio_vdisk_limit: int
+        :param logger: logging instance
+        :return: commands to execute, output files
+        :rtype: tuple(list[list[str]], list[str])
+        """
+        global_options = [(key, value) for key, value in base_options]
+        batch_limit = fio_vdisk_limit
+        if edge_configuration:
+            binary = edge_configuration['fio_bin_location']
+            target_key, targets = 'volumename', edge_configuration['volumenames']
+            global_options.extend([('ioengine', 'openvstorage'), ('hostname', edge_configuration['hostname']), ('port', edge_configuration['port']),
+                                   ('protocol', edge_configuration['protocol']), ('enable_ha', 1), ('group_reporting', 1)])
+            if edge_configuration.get('username') and edge_configuration.get('password'):
+                global_options.extend([('username', edge_configuration['username']), ('password', edge_configuration['password']),
+                                       ('verify', 'crc32c-intel'), ('verifysort', 1), ('verify_fatal', 1), ('verify_backlog', 1000000)])
+            iodepth = int(dict(base_options).get('iodepth', 1))
+            queue_limit = edge_configuration.get('queue_limit', cls.EDGE_QUEUE_LIMIT)
+            batch_limit = max(1, min(batch_limit, queue_limit / (iodepth * numjobs)))  # Keep the outstanding IOs per process within the limit
+        else:
+            binary = 'fio'
+            target_key, targets = 'filename', file_locations or []
+            global_options.append(('ioengine', 'libaio'))
+        if numjobs > 1:
+            global_options.append(('numjobs', numjobs))
+        cpu_count = cls._get_cpu_count(client)
+        batches = cls._plan_batches(targets, cpu_count, batch_limit)
+        logger.debug('Splitting {0} fio targets over {1} job files using {2} cores'.format(len(targets), len(batches), cpu_count))
+        cmds = []
+        output_files = []
+        for fio_nr, (batch, cpus_allowed) in enumerate(batches):
+            output_file = '{0}/fio_{1}-{2}'.format(output_directory, fio_nr, len(batch))
+            job_file_path = '{0}.fio'.format(output_file)
+            lines = ['[global]'] + ['{0}={1}'.format(key, value) for key, value in global_options + [('cpus_allowed', cpus_allowed)]]
+            for index, target in enumerate(batch):
+                lines.extend(['', '[test{0}]'.format(index), '{0}={1}'.format(target_key, target)])
+            client.file_write(job_file_path, '\n'.join(lines) + '\n')
+            output_files.append(output_file)
+            cmds.append([binary, '--output={0}'.format(output_file), '--output-format={0}'.format(output_format), job_file_path])
+        return cmds, output_files
+
+    @staticmethod
+    def _get_cpu_count(client, logger=LOGGER):
+        """
+        Retrieve the amount of cores available on the client
+        :param client: client to query
+        :param logger: logging instance
+        :return: amount of cores, 1 when they could not be determined
+        :rtype: int
+        """
+        try:
+            return max(1, int(client.run(['nproc']).strip()))
+        except Exception as ex:
+            logger.warning('Could not determine the amount of cores on {0}: {1}'.format(client.ip, str(ex)))
+            return 1
+
+    @staticmethod
+    def _plan_batches(targets, cpu_count, batch_limit):
+        """
+        Split the targets into evenly sized batches, one per core when possible, and assign the cores to pin every batch to
+        :param targets: volumes or files to split
+        :type targets: list[str]
+        :param cpu_count: amount of cores available
+        :type cpu_count: int
+        :param batch_limit: maximum amount of targets within one batch
+        :type batch_limit: int
+        :return: batches and their cpus_allowed value (e.g. [(['vol0', 'vol1'], '0-1'), (['vol2', 'vol3'], '2-3')])
+        :rtype: list[tuple(list[str], str)]
+        """
+        if len(targets) == 0:
+            return []
+        batch_amount = max(int(math.ceil(float(len(targets)) / batch_limit)), min(cpu_count, len(targets)))
+        batch_size = int(math.ceil(float(len(targets)) / batch_amount))
+        batches = [targets[index:index + batch_size] for index in xrange(0, len(targets), batch_size)]
+        planned = []
+        for index, batch in enumerate(batches):
+            if len(batches) >= cpu_count:  # Cores are shared by multiple batches
+                cpus_allowed = str(index % cpu_count)
+            else:
+                cores_per_batch = cpu_count / len(batches)
+                first_core = index * cores_per_batch
+                cpus_allowed = '{0}-{1}'.format(first_core, first_core + cores_per_batch - 1) if cores_per_batch > 1 else str(first_core)
+            planned.append((batch, cpus_allowed))
+        return planned
+
+    @staticmethod
+    def _deploy_script(client, module, directory='/tmp'):
+        """
+        Copy a standalone helper module to the client, to execute it there
+        :param client: client to copy the module to
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param module: module to copy, may only depend on the standard library
+        :type module: module
+        :param directory: directory to copy the module to
+        :type directory: str
+        :return: location of the copy
+        :rtype: str
+        """
+        location = '{0}/{1}.py'.format(directory, module.__name__.rsplit('.', 1)[-1])
+        client.file_write(location, inspect.getsource(module))
+        return location
+
+    @classmethod
+    def _run_script(cls, client, module, action, dependencies=None, **options):
+        """
+        Run a standalone helper module on the client and parse the JSON it prints
+        :param client: client to run on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param module: module to run (e.g. data_integrity)
+        :type module: module
+        :param action: action of the module (e.g. verify)
+        :type action: str
+        :param dependencies: modules the module imports, copied next to it
+        :type dependencies: list
+        :param options: options of the action
+        :return: the output of the action
+        :rtype: dict
+        """
+        for dependency in dependencies or []:
+            cls._deploy_script(client, dependency)
+        location = cls._deploy_script(client, module)
+        name = module.__name__.rsplit('.', 1)[-1]
+        cmd = [cls.IO_ENGINE_INTERPRETER, location, action] + ['--{0}={1}'.format(key, value) for key, value in sorted(options.iteritems()) if value is not None]
+        # Non-zero exit codes are expected (e.g. found corruption exits with 1), the output tells what happened
+        output = client.run('{0} || true'.format(' '.join(pipes.quote(str(part)) for part in cmd)), allow_insecure=True)
+        try:
+            result = json.loads(output.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            raise RuntimeError('Unexpected output of the {0} {1} on {2}: {3}'.format(name, action, client.ip, output))
+        if 'error' in result and not isinstance(result['error'], int):
+            raise RuntimeError('The {0} {1} on {2} failed: {3}'.format(name, action, client.ip, result['error']))
+        return result
+
+    @classmethod
+    def write_pattern(cls, client, location, size, generation=1, block_size=IntegrityPattern.BLOCK_SIZE, logger=LOGGER):
+        """
+        Fill a file or device with self-describing blocks, which verify_pattern can verify afterwards without a copy of the data
+        :param client: client to write on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param location: file or device to write
+        :type location: str
+        :param size: amount of bytes to write
+        :type size: int
+        :param generation: generation of the blocks. Writing the next generation makes blocks of earlier writes recognizable as stale
+        :type generation: int
+        :param block_size: size of the blocks
+        :type block_size: int
+        :param logger: logging instance
+        :return: summary of the write (e.g. {'blocks': 512, 'bytes': 2097152, 'generation': 1})
+        :rtype: dict
+        """
+        logger.info('Writing generation {0} of the integrity pattern to {1} on {2}'.format(generation, location, client.ip))
+        return cls._run_script(client, data_integrity, 'write', filename=location, size=size, generation=generation, block_size=block_size)
+
+    @classmethod
+    def verify_pattern(cls, client, location, size=None, generation=1, block_size=IntegrityPattern.BLOCK_SIZE, threads=IntegrityPattern.THREADS, logger=LOGGER):
+        """
+        Verify a file or device written by write_pattern
+        :param client: client to verify on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param location: file or device to verify
+        :type location: str
+        :param size: amount of bytes to verify. Defaults to the whole file or device
+        :type size: int
+        :param generation: generation that was written last
+        :type generation: int
+        :param block_size: size of the blocks
+        :type block_size: int
+        :param threads: amount of threads verifying concurrently
+        :type threads: int
+        :param logger: logging instance
+        :return: report (e.g. {'blocks': 512, 'corrupted_blocks': 1, 'reasons': {'checksum': 1, ...}, 'ranges': [{'start': 4096, 'end': 8192, 'reason': 'checksum'}]})
+        :rtype: dict
+        """
+        report = cls._run_script(client, data_integrity, 'verify', filename=location, size=size, generation=generation, block_size=block_size, threads=threads)
+        if report['corrupted_blocks'] > 0:
+            logger.error('Found {0} corrupted blocks out of {1} in {2} on {3}: {4}'.format(report['corrupted_blocks'], report['blocks'], location, client.ip,
+                                                                                      cls.format_corrupted_ranges(report)))
+        else:
+            logger.info('Verified {0} blocks of {1} on {2}, no corruption found'.format(report['blocks'], location, client.ip))
+        return report
+
+    @staticmethod
+    def format_corrupted_ranges(report, limit=10):
+        """
+        :return: a readable summary of the corrupted ranges of a verify_pattern report (e.g. 4096-8192 (checksum), ...)
+        :rtype: str
+        """
+        ranges = ['{0}-{1} ({2})'.format(corrupted['start'], corrupted['end'], corrupted['reason']) for corrupted in report['ranges'][:limit]]
+        if report['corrupted_blocks'] > 0 and len(report['ranges']) > limit:
+            ranges.append('...')
+        return ', '.join(ranges)
+
+    @classmethod
+    def capture_trace(cls, client, device, duration, trace_location, logger=LOGGER):
+        """
+        Capture the block IO of a device with blktrace into a trace file, which replay_trace can replay afterwards
+        Requires blktrace on the client. Store the trace on a different device than the traced one
+        :param client: client to capture on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param device: block device to trace (e.g. /dev/vdb)
+        :type device: str
+        :param duration: seconds to capture
+        :type duration: int
+        :param trace_location: trace file to write
+        :type trace_location: str
+        :param logger: logging instance
+        :return: summary of the capture (e.g. {'records': 120000, 'skipped': 12})
+        :rtype: dict
+        """
+        logger.info('Capturing the IO of {0} on {1} for {2}s'.format(device, client.ip, duration))
+        return cls._run_script(client, io_trace, 'capture', dependencies=[io_engine], device=device, duration=duration, output=trace_location)
+
+    @classmethod
+    def convert_trace(cls, client, blkparse_location, trace_location, logger=LOGGER):
+        """
+        Convert the output of blkparse (e.g. supplied along with a bug report) into a trace file
+        :param client: client on which the output resides
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param blkparse_location: file holding the default output of blkparse
+        :type blkparse_location: str
+        :param trace_location: trace file to write
+        :type trace_location: str
+        :param logger: logging instance
+        :return: summary of the conversion (e.g. {'records': 120000, 'skipped': 12})
+        :rtype: dict
+        """
+        logger.info('Converting {0} into a trace on {1}'.format(blkparse_location, client.ip))
+        return cls._run_script(client, io_trace, 'convert', dependencies=[io_engine], input=blkparse_location, output=trace_location)
+
+    @classmethod
+    def replay_trace(cls, client, trace_location, target, speed=1.0, threads=TraceReplayer.THREADS, direct=True, logger=LOGGER):
+        """
+        Replay a trace against a file or device, e.g. a vdisk through FUSE (/mnt/<vpool>/<vdisk>.raw) or a blktap device
+        Blocks until the replay finished
+        :param client: client to replay on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param trace_location: trace file on the client
+        :type trace_location: str
+        :param target: file or device to replay on. IO beyond its end wraps around
+        :type target: str
+        :param speed: factor to speed up (> 1) or slow down (< 1) the replay, 'max' to issue the IO as fast as possible
+        :type speed: float / str
+        :param threads: maximum amount of IO in flight
+        :type threads: int
+        :param direct: bypass the page cache
+        :type direct: bool
+        :param logger: logging instance
+        :return: report of the replay. Latencies are in nanoseconds, formatted as the clat_ns section of fio. 'lag' tells how late
+                 the IO was issued, 'deviation' compares the replayed latencies with the captured ones
+                 (e.g. {'records': 120000, 'duration': 30.1, 'read': {...}, 'write': {...}, 'lag': {...}, 'deviation': {'mean': 35000.2, ...}})
+        :rtype: dict
+        """
+        logger.info('Replaying {0} on {1} of {2} at speed {3}'.format(trace_location, target, client.ip, speed))
+        report = cls._run_script(client, io_trace, 'replay', dependencies=[io_engine], trace=trace_location, filename=target, speed=speed,
+                                 threads=threads, direct=int(direct))
+        if report['error'] != 0:
+            raise RuntimeError('Replaying {0} on {1} of {2} failed with error {3}'.format(trace_location, target, client.ip, report['error']))
+        deviation = report['deviation']
+        logger.info('Replayed {0} IOs in {1}s (originally {2}s), issued {3}us late on average. {4}'.format(
+            report['records'], report['duration'], round(report['original_duration'], 3), int(report['lag']['mean'] / 1000),
+            'Latency deviated {0}us on average ({1}us stddev), {2} of {3} IOs were slower than captured'.format(
+                int(deviation['mean'] / 1000), int(deviation['stddev'] / 1000), deviation['slower'], deviation['compared'])
+            if deviation['compared'] > 0 else 'The trace holds no latencies to compare with'))
+        return report
+
+    @staticmethod
+    def get_fio_results(client, output_files, logger=LOGGER):
+        """
+        Parse the json output files of fio
+        Files that do not exist (yet) or that cannot be parsed (e.g. being rewritten by a looping screen) are skipped
+        :param client: client on which fio ran
+        :param output_files: output files of fio, as returned by write_data_fio
+        :type output_files: list[str]
+        :param logger: logging instance
+        :return: the results of all output files combined, None if none of them could be parsed
+        :rtype: ci.scenario_helpers.fio_results.FioResult
+        """
+        results = []
+        for output_file in output_files:
+            if not client.file_exists(output_file):
+                logger.warning('Fio output {0} does not exist on {1}'.format(output_file, client.ip))
+                continue
+            try:
+                results.append(FioResult.parse(client.file_read(output_file)))
+            except ValueError:
+                logger.warning('Fio output {0} on {1} could not be parsed'.format(output_file, client.ip))
+        if len(results) == 0:
+            return None
+        return FioResult.combine(results)
 
     @classmethod
     def write_data_vdbench(cls, client, binary_location, config_location, screen=True, loop_screen=True, logger=LOGGER):
         """
-        @todo support output files
         Write data using vdbench.
+        The console output of vdbench, holding its interval reports, is captured in an output file. Follow it with a VdbenchMonitor
         :param client: sshclient instance
         :param binary_location: path to the binary file
         :param config_location: path to the config location
         :param screen: offload command to a screen 
         :param loop_screen: loop the screen command indefinitely
         :param logger: logging instance
-        :return: list of screen names (empty if screen is False), list of output files (empty for vdbench)
+        :return: list of screen names (empty if screen is False), list of output files
         :rtype: tuple(list, list)
         """
         screen_names = []
-        output_files = []
-        cmd = [binary_location, '-vr', '-f', config_location]
+        output_directory = '/tmp/data_write_{0}'.format(uuid.uuid4())
+        client.dir_create(output_directory)
+        output_file = '{0}/vdbench'.format(output_directory)
+        cmd = '{0} >> {1} 2>&1'.format(' '.join(pipes.quote(part) for part in [binary_location, '-vr', '-f', config_location]), output_file)
+        logger.debug('Writing data with: {0}'.format(cmd))
         if screen is True:
             screen_name = 'vdbench_0'
-            cmd = cls._prepend_screen(' '.join(cmd), screen_name, loop_screen)
             screen_names.append(screen_name)
-        logger.debug('Writing data with: {0}'.format(' '.join(cmd)))
-        client.run(cmd)
-        return screen_names, output_files
+            client.run(cls._prepend_screen(cmd, screen_name, loop_screen))
+        else:
+            client.run(cmd, allow_insecure=True)
+        return screen_names, [output_file]
+
+    @staticmethod
+    def get_vdbench_monitor(client, output_files):
+        """
+        Follow the output of vdbench started by write_data_vdbench
+        :param client: client vdbench runs on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param output_files: output files returned by write_data_vdbench
+        :type output_files: list[str]
+        :return: monitor of which update() parses the new interval reports and get_results() returns the series and summary
+        :rtype: ci.scenario_helpers.vdbench_results.VdbenchMonitor
+        """
+        return VdbenchMonitor(client, output_files[0])
 
     @staticmethod
     def deploy_vdbench(client, zip_remote_location, unzip_location, amount_of_errors, vdbench_config_path, lun_location,
@@ -201,3 +690,137 @@ class DataWriter(object):
         else:
             screen_cmd.extend(['{0}; exec bash'.format(cmd)])
         return screen_cmd
+
+
+class FioDispatch(object):
+    """
+    Handle on fio instances that were started on multiple clients by DataWriter.dispatch_fio
+    """
+    LOGGER = Logger('scenario_helpers-fio_dispatch')
+
+    def __init__(self, instances, output_format='json'):
+        """
+        :param instances: started instances (e.g. [{'client': vm_client, 'screen_names': ['fio_000'], 'output_files': ['/tmp/data_write_x/fio']}])
+        :type instances: list[dict]
+        :param output_format: output format of the fio instances
+        :type output_format: str
+        """
+        self.instances = instances
+        self.output_format = output_format
+        self.status_streams = []
+
+    @property
+    def output_files(self):
+        """
+        :return: the output files of all instances
+        :rtype: list[str]
+        """
+        return [output_file for instance in self.instances for output_file in instance['output_files']]
+
+    def _map(self, function):
+        """
+        Execute a function for every instance concurrently
+        :param function: function to execute, receives the instance
+        :type function: callable
+        :return: the results, in the order of the instances
+        :rtype: list
+        """
+        if len(self.instances) == 0:
+            return []
+        pool = ThreadPool(processes=len(self.instances))
+        try:
+            return pool.map(function, self.instances)
+        finally:
+            pool.close()
+            pool.join()
+
+    def start_status_streams(self):
+        """
+        Follow the status reports of all instances, one channel per client
+        Afterwards errors are taken from the streams as they arrive, instead of searching the output files
+        :return: None
+        :rtype: NoneType
+        """
+        if len(self.status_streams) > 0:
+            return
+        clients = {}  # Instances on the same client share the channel
+        for instance in self.instances:
+            client, output_files = clients.setdefault(instance['client'].ip, (instance['client'], []))
+            output_files.extend(instance['output_files'])
+        try:
+            for client, output_files in clients.itervalues():
+                stream = FioStatusStream(client, output_files)
+                stream.start()
+                self.status_streams.append(stream)
+        except Exception:
+            self.stop_status_streams()
+            raise
+
+    def stop_status_streams(self):
+        """
+        Close the channels of the status streams
+        :return: None
+        :rtype: NoneType
+        """
+        for stream in self.status_streams:
+            stream.stop()
+        self.status_streams = []
+
+    def get_latest_samples(self):
+        """
+        :return: the latest sample of every job, only available when following the status reports (e.g. [{'job': 'test0', 'read_iops': 1520.0, ...}])
+        :rtype: list[dict]
+        """
+        return [dict(sample, ip=stream.client.ip) for stream in self.status_streams for sample in stream.get_latest_samples()]
+
+    def get_errors(self):
+        """
+        Retrieve the errors reported by fio. Taken from the status streams when following them, otherwise by searching the output files
+        :return: client ip -> error lines
+        :rtype: dict
+        """
+        if len(self.status_streams) > 0:
+            errors = {}
+            for stream in self.status_streams:
+                for error in stream.get_errors():
+                    errors.setdefault(stream.client.ip, set()).add(error['message'] if error['source'] is None else
+                                                                   '{0}: {1}'.format(error['source'], error['message']))
+            return errors
+
+        def _get_errors(instance):
+            errors = set()
+            for output_file in instance['output_files']:
+                errors.update(instance['client'].run('grep -a error {0} || true'.format(pipes.quote(output_file)), allow_insecure=True).splitlines())
+            return instance['client'].ip, errors
+
+        return dict((ip, errors) for ip, errors in self._map(_get_errors) if len(errors) > 0)
+
+    def get_results(self):
+        """
+        Parse the json output of all instances. Only complete for instances that finished
+        :return: the combined results, None if no instance produced results yet
+        :rtype: ci.scenario_helpers.fio_results.FioResult
+        """
+        if self.output_format != 'json':
+            raise ValueError('Results can only be fetched with the json output format')
+        return FioResult.combine(self._map(lambda instance: DataWriter.get_fio_results(instance['client'], instance['output_files'])))
+
+    def stop(self, logger=LOGGER):
+        """
+        Stop the screens of all instances and the status streams. Failing to stop one does not prevent stopping the others
+        :param logger: logging instance
+        :return: None
+        :rtype: NoneType
+        """
+        self.stop_status_streams()
+
+        def _stop(instance):
+            for screen_name in instance['screen_names']:
+                logger.debug('Stopping screen {0} on {1}.'.format(screen_name, instance['client'].ip))
+                try:
+                    instance['client'].run(['screen', '-S', screen_name, '-X', 'quit'])
+                except Exception:
+                    logger.exception('Unable to stop screen {0} on {1}'.format(screen_name, instance['client'].ip))
+            instance['screen_names'] = []
+
+        self._map(_stop)
@@ -0,0 +1,292 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+import json
+import math
+from ovs.extensions.generic.logger import Logger
+
+
+class LatencyStats(object):
+    """
+    Latency statistics of one direction of a fio job. All values are in microseconds
+    """
+    def __init__(self, minimum=0.0, maximum=0.0, mean=0.0, stddev=0.0, percentiles=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.mean = mean
+        self.stddev = stddev
+        self.percentiles = percentiles or {}  # percentile (e.g. 99.0) -> microseconds
+
+    def get_percentile(self, percentile):
+        """
+        :return: the latency of the given percentile (e.g. 99 or 99.9), None if fio did not report it
+        :rtype: float
+        """
+        return self.percentiles.get(float(percentile))
+
+    @classmethod
+    def from_fio(cls, direction, key):
+        """
+        Parse the latency statistics of a direction of a fio job
+        Older fio versions report in microseconds (e.g. clat), newer ones in nanoseconds (e.g. clat_ns)
+        :param direction: read or write section of a fio job
+        :type direction: dict
+        :param key: latency to parse: slat, clat or lat
+        :type key: str
+        :return: the latency statistics, None if fio did not report them
+        :rtype: LatencyStats
+        """
+        if '{0}_ns'.format(key) in direction:
+            stats, factor = direction['{0}_ns'.format(key)], 1000.0
+        elif key in direction:
+            stats, factor = direction[key], 1.0
+        else:
+            return None
+        percentiles = dict((float(percentile), value / factor) for percentile, value in (stats.get('percentile') or {}).iteritems())
+        return cls(minimum=stats.get('min', 0) / factor, maximum=stats.get('max', 0) / factor,
+                   mean=stats.get('mean', 0) / factor, stddev=stats.get('stddev', 0) / factor, percentiles=percentiles)
+
+    @classmethod
+    def combine(cls, weighted_stats):
+        """
+        Combine the latencies of multiple jobs. Means and deviations are weighted by the amount of IOs
+        Percentiles cannot be combined exactly, the highest value of all jobs is kept as an upper bound
+        :param weighted_stats: latency statistics and their amount of IOs
+        :type weighted_stats: list[tuple(LatencyStats, int)]
+        :return: the combined latency statistics, None if there is nothing to combine
+        :rtype: LatencyStats
+        """
+        weighted_stats = [(stats, weight) for stats, weight in weighted_stats if stats is not None and weight > 0]
+        if len(weighted_stats) == 0:
+            return None
+        total_weight = float(sum(weight for _, weight in weighted_stats))
+        mean = sum(stats.mean * weight for stats, weight in weighted_stats) / total_weight
+        variance = sum(weight * (stats.stddev ** 2 + (stats.mean - mean) ** 2) for stats, weight in weighted_stats) / total_weight
+        percentiles = {}
+        for stats, _ in weighted_stats:
+            for percentile, value in stats.percentiles.iteritems():
+                percentiles[percentile] = max(percentiles.get(percentile, value), value)
+        return cls(minimum=min(stats.minimum for stats, _ in weighted_stats), maximum=max(stats.maximum for stats, _ in weighted_stats),
+                   mean=mean, stddev=math.sqrt(variance), percentiles=percentiles)
+
+    def to_dict(self):
+        """
+        :return: serializable representation
+        :rtype: dict
+        """
+        return {'min': self.minimum, 'max': self.maximum, 'mean': self.mean, 'stddev': self.stddev,
+                'percentiles': dict(('{0:g}'.format(percentile), value) for percentile, value in self.percentiles.iteritems())}
+
+
+class DirectionStats(object):
+    """
+    Statistics of one direction (read or write) of a fio job
+    """
+    def __init__(self, io_bytes=0, total_ios=0, bandwidth=0.0, iops=0.0, runtime=0, slat=None, clat=None, lat=None):
+        self.io_bytes = io_bytes
+        self.total_ios = total_ios
+        self.bandwidth = bandwidth  # In KiB/s
+        self.iops = iops
+        self.runtime = runtime  # In milliseconds
+        self.slat = slat  # Submission latency
+        self.clat = clat  # Completion latency
+        self.lat = lat  # Total latency
+
+    @classmethod
+    def from_fio(cls, direction):
+        """
+        Parse the read or write section of a fio job
+        :param direction: read or write section of a fio job
+        :type direction: dict
+        :return: the statistics of the direction
+        :rtype: DirectionStats
+        """
+        io_bytes = direction.get('io_bytes', direction.get('io_kbytes', 0) * 1024)
+        return cls(io_bytes=io_bytes, total_ios=direction.get('total_ios', 0), bandwidth=float(direction.get('bw', 0)),
+                   iops=float(direction.get('iops', 0)), runtime=direction.get('runtime', 0),
+                   slat=LatencyStats.from_fio(direction, 'slat'), clat=LatencyStats.from_fio(direction, 'clat'), lat=LatencyStats.from_fio(direction, 'lat'))
+
+    @classmethod
+    def combine(cls, directions):
+        """
+        Combine the statistics of jobs that ran concurrently: throughput adds up, latencies are weighted
+        :param directions: statistics to combine
+        :type directions: list[DirectionStats]
+        :return: the combined statistics
+        :rtype: DirectionStats
+        """
+        directions = list(directions)
+        return cls(io_bytes=sum(direction.io_bytes for direction in directions),
+                   total_ios=sum(direction.total_ios for direction in directions),
+                   bandwidth=sum(direction.bandwidth for direction in directions),
+                   iops=sum(direction.iops for direction in directions),
+                   runtime=max([direction.runtime for direction in directions] or [0]),
+                   slat=LatencyStats.combine([(direction.slat, direction.total_ios) for direction in directions]),
+                   clat=LatencyStats.combine([(direction.clat, direction.total_ios) for direction in directions]),
+                   lat=LatencyStats.combine([(direction.lat, direction.total_ios) for direction in directions]))
+
+    def to_dict(self):
+        """
+        :return: serializable representation
+        :rtype: dict
+        """
+        return {'io_bytes': self.io_bytes, 'total_ios': self.total_ios, 'bw': self.bandwidth, 'iops': self.iops, 'runtime': self.runtime,
+                'slat': self.slat.to_dict() if self.slat else None,
+                'clat': self.clat.to_dict() if self.clat else None,
+                'lat': self.lat.to_dict() if self.lat else None}
+
+
+class JobResult(object):
+    """
+    Result of one fio job (or of one group, when fio ran with group_reporting)
+    """
+    def __init__(self, name, group_id, error, read, write):
+        self.name = name
+        self.group_id = group_id
+        self.error = error
+        self.read = read
+        self.write = write
+
+    @classmethod
+    def from_fio(cls, job):
+        """
+        Parse a job of the fio output
+        :param job: job of the fio output
+        :type job: dict
+        :return: the result of the job
+        :rtype: JobResult
+        """
+        return cls(name=job.get('jobname'), group_id=job.get('groupid', 0), error=job.get('error', 0),
+                   read=DirectionStats.from_fio(job.get('read', {})), write=DirectionStats.from_fio(job.get('write', {})))
+
+    def to_dict(self):
+        """
+        :return: serializable representation
+        :rtype: dict
+        """
+        return {'name': self.name, 'group_id': self.group_id, 'error': self.error, 'read': self.read.to_dict(), 'write': self.write.to_dict()}
+
+
+class FioResult(object):
+    """
+    Parsed output of one or more fio runs
+    """
+    logger = Logger('scenario_helpers-fio_results')
+
+    def __init__(self, jobs, version=None):
+        """
+        :param jobs: results of the individual jobs
+        :type jobs: list[JobResult]
+        :param version: version of fio that produced the output
+        :type version: str
+        """
+        self.jobs = jobs
+        self.version = version
+
+    @classmethod
+    def parse(cls, output):
+        """
+        Parse the output of fio, ran with --output-format=json
+        Anything fio printed around the JSON documents (e.g. warnings) is ignored. When fio ran with --status-interval,
+        the output holds a document per interval: the last one holds the final results
+        :param output: output of fio
+        :type output: str
+        :return: the parsed output
+        :rtype: FioResult
+        """
+        decoder = json.JSONDecoder()
+        document = None
+        start = output.find('{')
+        while start != -1:
+            try:
+                document, end = decoder.raw_decode(output, start)
+            except ValueError:  # Incomplete document, e.g. fio got interrupted while writing a status report
+                break
+            start = output.find('{', end)
+        if document is None:
+            raise ValueError('No JSON document found within the fio output')
+        return cls(jobs=[JobResult.from_fio(job) for job in document.get('jobs', [])], version=document.get('fio version'))
+
+    @classmethod
+    def combine(cls, results):
+        """
+        Combine the results of multiple fio runs, e.g. one per output file
+        :param results: results to combine. None entries are skipped
+        :type results: list[FioResult]
+        :return: all jobs of the given results
+        :rtype: FioResult
+        """
+        results = [result for result in results if result is not None]
+        return cls(jobs=[job for result in results for job in result.jobs], version=results[0].version if results else None)
+
+    @property
+    def errors(self):
+        """
+        :return: the jobs that reported an error
+        :rtype: list[JobResult]
+        """
+        return [job for job in self.jobs if job.error != 0]
+
+    @property
+    def read(self):
+        """
+        :return: read statistics of all jobs combined
+        :rtype: DirectionStats
+        """
+        return DirectionStats.combine(job.read for job in self.jobs)
+
+    @property
+    def write(self):
+        """
+        :return: write statistics of all jobs combined
+        :rtype: DirectionStats
+        """
+        return DirectionStats.combine(job.write for job in self.jobs)
+
+    def get_groups(self):
+        """
+        Combine the jobs per reporting group
+        :return: group id -> read statistics, write statistics
+        :rtype: dict
+        """
+        groups = {}
+        for job in self.jobs:
+            groups.setdefault(job.group_id, []).append(job)
+        return dict((group_id, (DirectionStats.combine(job.read for job in jobs), DirectionStats.combine(job.write for job in jobs)))
+                    for group_id, jobs in groups.iteritems())
+
+    def get_summary(self, percentile=99):
+        """
+        Summarize the result in a few figures, e.g. to report within a results matrix
+        :param percentile: completion latency percentile to report
+        :type percentile: float
+        :return: summary (e.g. {'read_iops': 1520.3, 'read_bw': 6081.0, 'read_clat_p99': 1400.0, 'write_iops': ...})
+        :rtype: dict
+        """
+        summary = {}
+        for direction_name, direction in [('read', self.read), ('write', self.write)]:
+            summary['{0}_iops'.format(direction_name)] = round(direction.iops, 1)
+            summary['{0}_bw'.format(direction_name)] = round(direction.bandwidth, 1)
+            clat_percentile = direction.clat.get_percentile(percentile) if direction.clat else None
+            summary['{0}_clat_p{1:g}'.format(direction_name, percentile)] = round(clat_percentile, 1) if clat_percentile is not None else None
+        return summary
+
+    def to_dict(self):
+        """
+        :return: serializable representation
+        :rtype: dict
+        """
+        return {'version': self.version, 'jobs': [job.to_dict() for job in self.jobs],
+                'read': self.read.to_dict(), 'write': self.write.to_dict()}
@@ -0,0 +1,351 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+import os
+import json
+import time
+import pipes
+import base64
+import threading
+import subprocess
+from collections import deque
+from ci.scenario_helpers.fio_results import JobResult
+from ovs.extensions.generic.logger import Logger
+
+
+class FioStatusParser(object):
+    """
+    Incremental parser for the output of fio ran with --status-interval and --output-format=json
+    fio appends a complete JSON document to its output on every interval. The parser is fed the output in arbitrary chunks,
+    only scans the new data and turns every completed document into samples. The headers tail prints when following
+    multiple files (==> file <==) switch the source the samples are attributed to
+    Lines outside of the documents that mention an error (e.g. fio: io_u error) are reported as errors
+    """
+    def __init__(self, source=None):
+        """
+        :param source: output file the data originates from, until a tail header says otherwise
+        :type source: str
+        """
+        self.source = source
+        self._buffer = ''
+        self._position = 0  # Scan position within the buffer
+        self._document_start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._previous = {}  # (source, job name) -> (timestamp in ms, read JobResult direction, write JobResult direction)
+        self._reported_errors = set()  # (source, job name, error) reported so far
+
+    def feed(self, data):
+        """
+        Parse a chunk of output
+        :param data: the chunk
+        :type data: str
+        :return: events for every completed document and error line (e.g. [{'type': 'sample', 'source': '/tmp/x/fio', 'job': 'test0', ...}])
+        :rtype: list[dict]
+        """
+        self._buffer += data
+        events = []
+        while self._position < len(self._buffer):
+            if self._depth == 0:
+                start = self._buffer.find('{', self._position)
+                text = self._buffer[self._position:] if start == -1 else self._buffer[self._position:start]
+                lines = text.split('\n')
+                if start == -1:  # The last line might be incomplete
+                    lines, remainder = lines[:-1], lines[-1]
+                    self._position = len(self._buffer) - len(remainder)
+                for line in lines:
+                    events.extend(self._parse_line(line))
+                if start == -1:
+                    break
+                self._position = self._document_start = start
+            character = self._buffer[self._position]
+            self._position += 1
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif character == '\\':
+                    self._escaped = True
+                elif character == '"':
+                    self._in_string = False
+            elif character == '"':
+                self._in_string = True
+            elif character == '{':
+                self._depth += 1
+            elif character == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    events.extend(self._parse_document(self._buffer[self._document_start:self._position]))
+                    self._buffer = self._buffer[self._position:]
+                    self._position = 0
+        if self._depth == 0:  # Drop what has been scanned, keep incomplete lines
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        return events
+
+    def _parse_line(self, line):
+        """
+        Parse a line that is not part of a JSON document
+        :return: an error event if the line reports an error
+        :rtype: list[dict]
+        """
+        line = line.strip()
+        if line.startswith('==> ') and line.endswith(' <=='):
+            self.source = line[4:-4]
+        elif 'error' in line.lower():
+            return [{'type': 'error', 'source': self.source, 'job': None, 'message': line}]
+        return []
+
+    def _parse_document(self, document):
+        """
+        Turn a status report into samples. fio reports totals since the start of the job, the IOPS and mean latencies
+        of the last interval are derived from the difference with the previous report of the same job
+        :return: a sample event per job and an error event the first time a job reports an error
+        :rtype: list[dict]
+        """
+        try:
+            report = json.loads(document)
+        except ValueError:
+            return [{'type': 'error', 'source': self.source, 'job': None, 'message': 'Unparsable fio status report: {0}'.format(document[:200])}]
+        timestamp = report.get('timestamp_ms', report.get('timestamp', time.time()) * 1000)
+        events = []
+        for job_data in report.get('jobs', []):
+            job = JobResult.from_fio(job_data)
+            key = (self.source, job.name)
+            previous = self._previous.get(key)
+            sample = {'type': 'sample', 'source': self.source, 'job': job.name, 'timestamp': timestamp / 1000.0, 'error': job.error}
+            for direction_name, direction in [('read', job.read), ('write', job.write)]:
+                previous_direction = previous[1 if direction_name == 'read' else 2] if previous is not None else None
+                sample.update(self._get_interval(direction_name, direction, previous_direction, timestamp - previous[0] if previous else None))
+            self._previous[key] = (timestamp, job.read, job.write)
+            events.append(sample)
+            if job.error != 0 and (self.source, job.name, job.error) not in self._reported_errors:  # Reported on every interval by fio
+                self._reported_errors.add((self.source, job.name, job.error))
+                events.append({'type': 'error', 'source': self.source, 'job': job.name,
+                               'message': 'Job {0} reported error {1}'.format(job.name, job.error)})
+        return events
+
+    @staticmethod
+    def _get_interval(direction_name, direction, previous, elapsed_ms):
+        """
+        Calculate the IOPS and mean completion latency of a direction over the last interval
+        Falls back to the averages since the start for the first report and when fio started anew (e.g. within a looping screen)
+        :return: e.g. {'read_iops': 1520.0, 'read_clat_mean': 410.2}
+        :rtype: dict
+        """
+        clat_mean = direction.clat.mean if direction.clat else None
+        iops = direction.iops
+        if previous is not None and elapsed_ms > 0 and direction.total_ios >= previous.total_ios:
+            ios = direction.total_ios - previous.total_ios
+            iops = ios * 1000.0 / elapsed_ms
+            if ios > 0 and direction.clat and previous.clat:
+                clat_mean = (direction.clat.mean * direction.total_ios - previous.clat.mean * previous.total_ios) / ios
+        return {'{0}_iops'.format(direction_name): round(iops, 1),
+                '{0}_clat_mean'.format(direction_name): round(clat_mean, 1) if clat_mean is not None else None}
+
+
+class FioStatusStream(object):
+    """
+    Follows the output files of fio instances on a client over a single persistent channel
+    The status reports are parsed as they arrive: errors surface immediately and the latest samples of every job are kept
+    Clients without a paramiko connection (e.g. rpyc clients of vms) have their output files polled instead
+    """
+    LOGGER = Logger('scenario_helpers-fio_status')
+    SAMPLE_HISTORY = 120  # Samples kept per job
+    READ_SIZE = 64 * 1024
+    POLL_INTERVAL = 5  # Seconds between reading the output files when no channel can be opened
+
+    def __init__(self, client, output_files, sample_history=SAMPLE_HISTORY, poll_interval=POLL_INTERVAL):
+        """
+        :param client: client on which fio writes the output files
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param output_files: output files to follow
+        :type output_files: list[str]
+        :param sample_history: amount of samples to keep per job
+        :type sample_history: int
+        :param poll_interval: seconds between reading the output files when polling
+        :type poll_interval: float
+        """
+        self.client = client
+        self.output_files = output_files
+        self.errors = []
+        self.samples = {}  # (output file, job name) -> deque of samples
+        self._sample_history = sample_history
+        self._poll_interval = poll_interval
+        self._parser = FioStatusParser(source=output_files[0] if len(output_files) == 1 else None)
+        self._lock = threading.Lock()
+        self._channel = None
+        self._process = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, logger=LOGGER):
+        """
+        Open the channel and start following the output files
+        Falls back to polling the output files when the client has no usable paramiko connection
+        :param logger: logging instance
+        :return: None
+        :rtype: NoneType
+        """
+        command = ['tail', '-n', '+1', '-F'] + list(self.output_files)
+        target = self._follow
+        if getattr(self.client, 'is_local', False) is True:
+            self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+        else:
+            try:
+                self._channel = self._open_session(self.client)
+            except RuntimeError as ex:
+                logger.warning('{0}. Polling the output files every {1}s instead'.format(str(ex), self._poll_interval))
+                target = self._poll
+            else:
+                self._channel.exec_command(' '.join(pipes.quote(part) for part in command) + ' 2>/dev/null')
+        self._thread = threading.Thread(target=target, name='fio_status_{0}'.format(self.client.ip))
+        self._thread.daemon = True
+        self._thread.start()
+
+    @staticmethod
+    def _open_session(client):
+        """
+        Open a new channel over the existing connection of the client
+        The SSHClient does not expose its paramiko connection, so it is retrieved from its private attribute
+        Raises a RuntimeError when it is not available, e.g. because rpyc refuses the access to private attributes
+        :param client: client to open the channel on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :return: the channel
+        :rtype: paramiko.Channel
+        """
+        paramiko_client = getattr(client, '_client', None)
+        if not hasattr(paramiko_client, 'get_transport'):
+            raise RuntimeError('Unable to follow the fio output on {0}: its SSHClient does not expose a paramiko connection'.format(client.ip))
+        transport = paramiko_client.get_transport()
+        if transport is None or not transport.is_active():
+            raise RuntimeError('Unable to follow the fio output on {0}: its SSH connection is not active'.format(client.ip))
+        return transport.open_session()
+
+    def _read(self):
+        """
+        :return: the next chunk of output, an empty string when the channel closed
+        :rtype: str
+        """
+        if self._process is not None:
+            return os.read(self._process.stdout.fileno(), self.READ_SIZE)
+        return self._channel.recv(self.READ_SIZE)
+
+    def _follow(self, logger=LOGGER):
+        """
+        Read and parse the output until the stream is stopped
+        :param logger: logging instance
+        :return: None
+        :rtype: NoneType
+        """
+        while not self._stopped.is_set():
+            try:
+                data = self._read()
+            except Exception:
+                if not self._stopped.is_set():
+                    logger.exception('Following the fio output on {0} has failed'.format(self.client.ip))
+                break
+            if not data:
+                if not self._stopped.is_set():
+                    with self._lock:
+                        self.errors.append({'type': 'error', 'source': None, 'job': None,
+                                            'message': 'The fio status stream of {0} closed unexpectedly'.format(self.client.ip)})
+                break
+            self._process_events(self._parser.feed(data), logger=logger)
+
+    def _poll(self, logger=LOGGER):
+        """
+        Read the new part of every output file on each interval and parse it, until the stream is stopped
+        Every output file has its own parser, as no tail headers separate them. The data is base64 encoded so
+        the client returning its output stripped does not shift the offsets. A file that shrunk was rewritten
+        by a new fio run (e.g. within a looping screen) and is read again from the start
+        :param logger: logging instance
+        :return: None
+        :rtype: NoneType
+        """
+        parsers = dict((output_file, FioStatusParser(source=output_file)) for output_file in self.output_files)
+        offsets = dict((output_file, 0) for output_file in self.output_files)
+        while True:
+            for output_file in self.output_files:
+                try:
+                    output = self.client.run('wc -c 2>/dev/null < {0}; tail -c +{1} {0} 2>/dev/null | base64 -w 0'.format(pipes.quote(output_file), offsets[output_file] + 1),
+                                             allow_insecure=True)
+                except Exception:
+                    if not self._stopped.is_set():
+                        logger.exception('Polling the fio output file {0} on {1} has failed'.format(output_file, self.client.ip))
+                    continue
+                size, _, encoded = output.strip().partition('\n')
+                if not size.strip().isdigit():  # The file does not exist yet
+                    continue
+                if int(size) < offsets[output_file]:
+                    parsers[output_file] = FioStatusParser(source=output_file)
+                    offsets[output_file] = 0
+                    continue
+                data = base64.b64decode(encoded.strip())
+                offsets[output_file] += len(data)
+                self._process_events(parsers[output_file].feed(data), logger=logger)
+            if self._stopped.wait(self._poll_interval):
+                break
+
+    def _process_events(self, events, logger=LOGGER):
+        """
+        Keep the samples and errors produced by a parser
+        :param events: events returned by the parser
+        :type events: list[dict]
+        :param logger: logging instance
+        :return: None
+        :rtype: NoneType
+        """
+        for event in events:
+            with self._lock:
+                if event['type'] == 'error':
+                    logger.error('Fio on {0} reported an error: {1}'.format(self.client.ip, event['message']))
+                    self.errors.append(event)
+                else:
+                    key = (event['source'], event['job'])
+                    if key not in self.samples:
+                        self.samples[key] = deque(maxlen=self._sample_history)
+                    self.samples[key].append(event)
+
+    def get_errors(self):
+        """
+        :return: the errors reported so far
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return list(self.errors)
+
+    def get_latest_samples(self):
+        """
+        :return: the latest sample of every job
+        :rtype: list[dict]
+        """
+        with self._lock:
+            return [samples[-1] for samples in self.samples.itervalues() if len(samples) > 0]
+
+    def stop(self):
+        """
+        Close the channel and stop following
+        :return: None
+        :rtype: NoneType
+        """
+        self._stopped.set()
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+        if self._channel is not None:
+            self._channel.close()
+        if self._thread is not None:
+            self._thread.join(5)
@@ -0,0 +1,475 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+# This module is copied to and executed on the clients that generate IO: it only depends on the standard library
+# and runs on both python 2 and 3
+import io
+import os
+import sys
+import json
+import mmap
+import stat
+import time
+import errno
+import bisect
+import random
+import itertools
+import threading
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies in nanoseconds, with a relative precision of about 1.5%
+    """
+    PRECISION_BITS = 6  # Values keep their 6 most significant bits
+    PERCENTILES = [1.0, 5.0, 10.0, 20.0, 30.0, 40.0, 50.0, 60.0, 70.0, 80.0, 90.0, 95.0, 99.0, 99.5, 99.9, 99.95, 99.99]  # Reported by fio
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.minimum = None
+        self.maximum = 0
+
+    def add(self, value):
+        """
+        Add a latency
+        :param value: latency in nanoseconds
+        :type value: int
+        :return: None
+        :rtype: NoneType
+        """
+        shift = max(0, value.bit_length() - self.PRECISION_BITS)
+        bucket = (value >> shift) << shift
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.total_squares += value * value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+
+    @classmethod
+    def merge(cls, histograms):
+        """
+        Merge histograms that are possibly still being added to by other threads
+        :param histograms: histograms to merge
+        :type histograms: list[LatencyHistogram]
+        :return: the merged histogram
+        :rtype: LatencyHistogram
+        """
+        merged = cls()
+        for histogram in histograms:
+            for bucket, count in list(dict(histogram.buckets).items()):  # Copying the dict does not release the GIL
+                merged.buckets[bucket] = merged.buckets.get(bucket, 0) + count
+            merged.count += histogram.count
+            merged.total += histogram.total
+            merged.total_squares += histogram.total_squares
+            if histogram.minimum is not None and (merged.minimum is None or histogram.minimum < merged.minimum):
+                merged.minimum = histogram.minimum
+            merged.maximum = max(merged.maximum, histogram.maximum)
+        return merged
+
+    def to_fio(self):
+        """
+        :return: the statistics, formatted as the clat_ns section of the json output of fio
+        :rtype: dict
+        """
+        if self.count == 0:
+            return {'min': 0, 'max': 0, 'mean': 0.0, 'stddev': 0.0, 'percentile': {}}
+        mean = float(self.total) / self.count
+        variance = max(0.0, float(self.total_squares) / self.count - mean ** 2)
+        percentiles = {}
+        cumulative = 0
+        targets = iter(self.PERCENTILES)
+        target = next(targets)
+        for bucket in sorted(self.buckets):
+            cumulative += self.buckets[bucket]
+            while target is not None and cumulative >= target / 100.0 * self.count:
+                percentiles['{0:f}'.format(target)] = bucket
+                target = next(targets, None)
+            if target is None:
+                break
+        return {'min': self.minimum, 'max': self.maximum, 'mean': mean, 'stddev': variance ** 0.5, 'percentile': percentiles}
+
+
+class IOJob(object):
+    """
+    Read/write IO towards a single file or block device, from 'iodepth' threads that each use their own file descriptor
+    The IO is done with O_DIRECT when requested, on page aligned mmap buffers
+    """
+    def __init__(self, name, filename, bs, iodepth, size, rwmixread, direct, bssplit=None, percentage_random=100, rate_iops=None):
+        """
+        :param bs: block size in bytes, when no bssplit is given
+        :param bssplit: block sizes in bytes and their weights (e.g. [(4096, 70), (65536, 30)])
+        :param percentage_random: percentage of the IO at random offsets, the rest continues sequentially
+        :param rate_iops: limit of the IOPS of the job
+        """
+        self.name = name
+        self.filename = filename
+        self.block_sizes = [block_size for block_size, _ in bssplit] if bssplit else [bs]
+        self.bs = max(self.block_sizes)
+        self.iodepth = iodepth
+        self.size = size
+        self.rwmixread = rwmixread
+        self.direct = direct
+        self.percentage_random = percentage_random
+        self.rate_iops = rate_iops
+        weights = [weight for _, weight in bssplit] if bssplit else [1]
+        self._cumulative_weights = [sum(weights[:index + 1]) for index in range(len(weights))]
+        mean_bs = sum(block_size * weight for block_size, weight in zip(self.block_sizes, weights)) / float(sum(weights))
+        self.error = 0
+        self.start_time = None
+        self.end_time = None
+        self.region = 0
+        self._stats = []  # Statistics of every thread
+        self._counter = itertools.count()
+        self._total_ios = max(1, int(size / mean_bs))  # Like fio, the size is both the region and the amount of IO
+        self._threads = []
+
+    def _open(self):
+        """
+        :return: a file descriptor, opened with O_DIRECT when possible
+        :rtype: int
+        """
+        flags = os.O_RDWR | os.O_CREAT
+        if self.direct is True and hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(self.filename, flags | os.O_DIRECT, 0o644)
+            except OSError as ex:
+                if ex.errno != errno.EINVAL:  # The filesystem does not support direct IO (e.g. tmpfs)
+                    raise
+        return os.open(self.filename, flags, 0o644)
+
+    def start(self):
+        """
+        Prepare the target and start the threads
+        :return: None
+        :rtype: NoneType
+        """
+        self.start_time = time.time()
+        try:
+            fd = self._open()
+            try:
+                if stat.S_ISBLK(os.fstat(fd).st_mode):
+                    self.region = min(self.size, os.lseek(fd, 0, os.SEEK_END))
+                else:
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                    self.region = self.size
+            finally:
+                os.close(fd)
+            if self.region < self.bs:
+                raise OSError(errno.EINVAL, 'The target is smaller than the block size')
+        except (OSError, IOError) as ex:
+            self._fail(ex)
+            return
+        for index in range(self.iodepth):
+            stats = {'read': LatencyHistogram(), 'write': LatencyHistogram(), 'read_bytes': 0, 'write_bytes': 0}
+            self._stats.append(stats)
+            thread = threading.Thread(target=self._work, args=(stats, index), name='{0}_{1}'.format(self.name, index))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        """
+        Wait for all threads to finish
+        :return: None
+        :rtype: NoneType
+        """
+        for thread in self._threads:
+            while thread.is_alive():
+                thread.join(1)  # Joining without a timeout blocks signals on python 2
+        self.end_time = time.time()
+
+    def _fail(self, exception):
+        """
+        Register the first error, every thread stops at its next IO
+        """
+        if self.error == 0:
+            self.error = getattr(exception, 'errno', None) or errno.EIO
+            sys.stderr.write('io_engine: error on {0}: {1}\n'.format(self.filename, exception))
+
+    def _work(self, stats, index):
+        """
+        Issue IO until the job has done its amount of IO or failed
+        :param stats: latency histograms and byte counts of this thread
+        :type stats: dict
+        :param index: index of the thread, sequential IO of every thread starts in its own part of the region
+        :type index: int
+        :return: None
+        :rtype: NoneType
+        """
+        buffers = {}
+        for block_size in self.block_sizes:  # A buffer per block size: slices of a single buffer are copies on python 2, which are not aligned
+            buffers[block_size] = mmap.mmap(-1, block_size)  # Anonymous mappings are page aligned, as required by O_DIRECT
+            buffers[block_size].write(os.urandom(block_size))
+        generator = random.Random()  # Seeded from os.urandom, like fio with randrepeat=0
+        position = (self.region // self.iodepth * index) // self.bs * self.bs
+        interval = self.iodepth / float(self.rate_iops) if self.rate_iops else None  # Every thread takes its share of the rate
+        next_time = _clock()
+        fd = None
+        try:
+            fd = self._open()
+            file_object = io.FileIO(fd, 'r+', closefd=False)
+            while self.error == 0 and next(self._counter) < self._total_ios:
+                if len(self.block_sizes) == 1:
+                    block_size = self.block_sizes[0]
+                else:
+                    block_size = self.block_sizes[bisect.bisect_right(self._cumulative_weights, generator.random() * self._cumulative_weights[-1])]
+                buffer = buffers[block_size]
+                if self.percentage_random >= 100 or generator.random() * 100 < self.percentage_random:
+                    offset = generator.randrange(self.region // block_size) * block_size
+                else:
+                    if position + block_size > self.region:
+                        position = 0
+                    offset = position
+                position = offset + block_size
+                is_read = generator.random() * 100 < self.rwmixread
+                if interval is not None:
+                    next_time += interval
+                    delay = next_time - _clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                start = _clock()
+                if is_read is True:
+                    if hasattr(os, 'preadv'):
+                        done = os.preadv(fd, [buffer], offset)
+                    else:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        done = file_object.readinto(buffer)
+                else:
+                    if hasattr(os, 'pwrite'):
+                        done = os.pwrite(fd, buffer, offset)
+                    else:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        done = os.write(fd, buffer)
+                latency = int((_clock() - start) * 1e9)
+                if done != block_size:
+                    raise IOError(errno.EIO, 'Short {0} of {1} bytes at offset {2}'.format('read' if is_read else 'write', done, offset))
+                direction = 'read' if is_read else 'write'
+                stats[direction].add(latency)
+                stats['{0}_bytes'.format(direction)] += block_size
+        except (OSError, IOError) as ex:
+            self._fail(ex)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            for buffer in buffers.values():
+                buffer.close()
+
+    def to_fio(self):
+        """
+        :return: the statistics of the job, formatted as a job of the json output of fio
+        :rtype: dict
+        """
+        runtime = max(0.001, (self.end_time or time.time()) - (self.start_time or time.time()))
+        job = {'jobname': self.name, 'groupid': 0, 'error': self.error}
+        for direction in ['read', 'write']:
+            histogram = LatencyHistogram.merge([stats[direction] for stats in self._stats])
+            clat = histogram.to_fio()
+            io_bytes = sum(stats['{0}_bytes'.format(direction)] for stats in self._stats)
+            job[direction] = {'io_bytes': io_bytes, 'io_kbytes': io_bytes // 1024, 'total_ios': histogram.count,
+                              'bw': int(io_bytes / 1024.0 / runtime), 'iops': histogram.count / runtime, 'runtime': int(runtime * 1000),
+                              'slat_ns': {'min': 0, 'max': 0, 'mean': 0.0, 'stddev': 0.0}, 'clat_ns': clat, 'lat_ns': clat}  # Synchronous IO is not submitted separately
+        return job
+
+
+class IOEngine(object):
+    """
+    Built-in IO load generator, for clients on which fio is not available
+    Supports mixed block sizes (bssplit), partially sequential IO (percentage_random) and a limited rate (rate_iops), as fio does
+    Accepts the fio command line options used by DataWriter and writes its results in the json output format of fio
+    e.g. python io_engine.py --rw=randrw --bs=4k --iodepth=32 --rwmixread=70 --size=1073741824 --direct=1 --name=test0 --filename=/mnt/data/vm.raw --output=/tmp/fio --output-format=json
+    """
+    VERSION = 'ovs-io-engine-1'
+    COMMAND_OPTIONS = ['output', 'output_format', 'status_interval']  # Apply to the whole run, wherever they are passed
+    JOB_OPTIONS = ['filename', 'bs', 'bssplit', 'iodepth', 'rw', 'rwmixread', 'rwmixwrite', 'size', 'direct', 'randrepeat',
+                   'percentage_random', 'rate_iops']
+    RW_MODES = ['read', 'write', 'rw', 'readwrite', 'randread', 'randwrite', 'randrw']
+    SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+    def __init__(self, jobs, output=None, status_interval=None):
+        """
+        :param jobs: jobs to run concurrently
+        :type jobs: list[IOJob]
+        :param output: file to write the results to. Defaults to stdout
+        :type output: str
+        :param status_interval: append a status report to the output every x seconds
+        :type status_interval: float
+        """
+        self.jobs = jobs
+        self.output = output
+        self.status_interval = status_interval
+        self._output_lock = threading.Lock()
+
+    @classmethod
+    def parse_size(cls, value):
+        """
+        Parse a size the way fio does (e.g. 4k, 1m, 4096)
+        :return: the amount of bytes
+        :rtype: int
+        """
+        value = value.strip().lower()
+        if value.endswith('ib'):
+            value = value[:-2]
+        elif value.endswith('b') and len(value) > 1 and not value[-2].isdigit():
+            value = value[:-1]
+        unit = value[-1] if value and value[-1] in cls.SIZE_UNITS else ''
+        return int(value[:len(value) - len(unit)]) * cls.SIZE_UNITS[unit]
+
+    @classmethod
+    def from_arguments(cls, arguments):
+        """
+        Build the engine from fio style arguments. Options before the first --name apply to all jobs
+        :param arguments: command line arguments
+        :type arguments: list[str]
+        :return: the engine
+        :rtype: IOEngine
+        """
+        command_options = {}
+        global_options = {}
+        job_options = []
+        current = global_options
+        for argument in arguments:
+            if not argument.startswith('--'):
+                raise ValueError('Unexpected argument {0}'.format(argument))
+            key, _, value = argument[2:].partition('=')
+            key = key.replace('-', '_')
+            if key == 'name':
+                current = {'name': value}
+                job_options.append(current)
+            elif key in cls.COMMAND_OPTIONS:
+                command_options[key] = value
+            elif key in cls.JOB_OPTIONS:
+                current[key] = value
+            else:
+                raise ValueError('Unsupported option --{0}'.format(key))
+        if len(job_options) == 0:
+            raise ValueError('No jobs were specified')
+        if command_options.get('output_format', 'json') not in ['json', 'json+']:
+            raise ValueError('Only the json output format is supported')
+        jobs = []
+        for options in job_options:
+            merged = dict(global_options)
+            merged.update(options)
+            if 'filename' not in merged or 'size' not in merged:
+                raise ValueError('Job {0} requires a filename and a size'.format(merged['name']))
+            rw = merged.get('rw', 'randrw')
+            if rw not in cls.RW_MODES:
+                raise ValueError('Unsupported rw={0}'.format(rw))
+            if rw in ['read', 'randread']:
+                rwmixread = 100
+            elif rw in ['write', 'randwrite']:
+                rwmixread = 0
+            elif 'rwmixread' in merged:
+                rwmixread = int(merged['rwmixread'])
+            else:
+                rwmixread = 100 - int(merged.get('rwmixwrite', 50))
+            bssplit = None
+            if 'bssplit' in merged:  # e.g. 4k/70:64k/30
+                bssplit = []
+                for entry in merged['bssplit'].split(':'):
+                    block_size, _, weight = entry.partition('/')
+                    bssplit.append((cls.parse_size(block_size), float(weight)))
+            jobs.append(IOJob(name=merged['name'], filename=merged['filename'], bs=cls.parse_size(merged.get('bs', '4k')),
+                              iodepth=int(merged.get('iodepth', 1)), size=cls.parse_size(merged['size']),
+                              rwmixread=rwmixread, direct=merged.get('direct', '0') == '1', bssplit=bssplit,
+                              percentage_random=int(merged.get('percentage_random', 100 if rw.startswith('rand') else 0)),
+                              rate_iops=int(merged['rate_iops']) if 'rate_iops' in merged else None))
+        status_interval = float(command_options['status_interval']) if 'status_interval' in command_options else None
+        return cls(jobs=jobs, output=command_options.get('output'), status_interval=status_interval)
+
+    def get_report(self):
+        """
+        :return: the current statistics of all jobs, as fio would report them
+        :rtype: dict
+        """
+        now = time.time()
+        return {'fio version': self.VERSION, 'timestamp': int(now), 'timestamp_ms': int(now * 1000),
+                'time': time.ctime(now), 'jobs': [job.to_fio() for job in self.jobs]}
+
+    def _write_report(self):
+        """
+        Append a report to the output
+        :return: None
+        :rtype: NoneType
+        """
+        report = json.dumps(self.get_report(), indent=2, sort_keys=True) + '\n'
+        with self._output_lock:
+            if self.output is None:
+                sys.stdout.write(report)
+                sys.stdout.flush()
+            else:
+                with open(self.output, 'a') as output_file:
+                    output_file.write(report)
+
+    def _report_status(self, finished):
+        """
+        Append a status report every interval until the jobs finished
+        :param finished: set once all jobs finished
+        :type finished: threading.Event
+        :return: None
+        :rtype: NoneType
+        """
+        while not finished.wait(self.status_interval):
+            self._write_report()
+
+    def run(self):
+        """
+        Run all jobs and write the results
+        :return: exit code: 0 when all jobs succeeded, 1 otherwise
+        :rtype: int
+        """
+        if self.output is not None:
+            open(self.output, 'w').close()
+        finished = threading.Event()
+        reporter = None
+        if self.status_interval is not None:
+            reporter = threading.Thread(target=self._report_status, args=(finished,), name='status_reporter')
+            reporter.daemon = True
+            reporter.start()
+        for job in self.jobs:
+            job.start()
+        for job in self.jobs:
+            job.join()
+        finished.set()
+        if reporter is not None:
+            reporter.join()
+        self._write_report()
+        return 0 if all(job.error == 0 for job in self.jobs) else 1
+
+
+def main(arguments=None):
+    """
+    Run the engine with the given command line arguments
+    :return: exit code
+    :rtype: int
+    """
+    try:
+        engine = IOEngine.from_arguments(sys.argv[1:] if arguments is None else arguments)
+    except ValueError as ex:
+        sys.stderr.write('io_engine: {0}\n'.format(ex))
+        return 2
+    return engine.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
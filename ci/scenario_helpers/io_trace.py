@@ -0,0 +1,549 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+# This module is copied to and executed on the clients that capture or replay IO, next to io_engine: it only depends on
+# the standard library and runs on both python 2 and 3
+import io
+import os
+import re
+import sys
+import json
+import mmap
+import stat
+import time
+import errno
+import struct
+import itertools
+import threading
+import subprocess
+from collections import namedtuple
+try:
+    from ci.scenario_helpers.io_engine import LatencyHistogram
+except ImportError:
+    from io_engine import LatencyHistogram
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+TraceRecord = namedtuple('TraceRecord', ['timestamp', 'offset', 'length', 'latency', 'op'])
+
+
+class TraceFile(object):
+    """
+    Compact binary format of a block IO trace: a header followed by fixed size records
+    Every record holds the time the IO was issued (nanoseconds since the first IO), its offset and length in bytes,
+    the latency with which it originally completed (nanoseconds, 0 when unknown) and the operation
+    """
+    MAGIC = b'OVSTRC01'
+    HEADER = struct.Struct('<8sII')  # Magic, version, record size
+    RECORD = struct.Struct('<QQIIB3x')  # Timestamp, offset, length, latency, operation
+    VERSION = 1
+    READ = 0
+    WRITE = 1
+    OPERATIONS = {READ: 'read', WRITE: 'write'}
+    MAX_LATENCY = 2 ** 32 - 1
+
+
+class TraceWriter(object):
+    """
+    Appends records to a trace file
+    The latency of a record is usually only known after later records were written, it can be filled in afterwards
+    """
+    FLUSH_RECORDS = 4096  # Records buffered before writing
+
+    def __init__(self, filename):
+        """
+        :param filename: trace file to create
+        :type filename: str
+        """
+        self.filename = filename
+        self.count = 0
+        self._file = open(filename, 'w+b')
+        self._file.write(TraceFile.HEADER.pack(TraceFile.MAGIC, TraceFile.VERSION, TraceFile.RECORD.size))
+        self._pending = []
+        self._latencies = {}  # Index -> latency of records that are still buffered
+
+    def append(self, timestamp, offset, length, op, latency=0):
+        """
+        Append a record
+        :return: index of the record
+        :rtype: int
+        """
+        self._pending.append(TraceFile.RECORD.pack(timestamp, offset, length, min(latency, TraceFile.MAX_LATENCY), op))
+        self.count += 1
+        if len(self._pending) >= self.FLUSH_RECORDS:
+            self.flush()
+        return self.count - 1
+
+    def set_latency(self, index, latency):
+        """
+        Fill in the latency of a record that was appended before
+        :return: None
+        :rtype: NoneType
+        """
+        latency = min(latency, TraceFile.MAX_LATENCY)
+        first_pending = self.count - len(self._pending)
+        if index >= first_pending:
+            self._latencies[index] = latency
+            return
+        position = self._file.tell()
+        self._file.seek(TraceFile.HEADER.size + index * TraceFile.RECORD.size + 20)  # Latency follows the timestamp, offset and length
+        self._file.write(struct.pack('<I', latency))
+        self._file.seek(position)
+
+    def flush(self):
+        """
+        Write the buffered records
+        :return: None
+        :rtype: NoneType
+        """
+        first_pending = self.count - len(self._pending)
+        for index, latency in self._latencies.items():
+            record = bytearray(self._pending[index - first_pending])
+            struct.pack_into('<I', record, 20, latency)
+            self._pending[index - first_pending] = bytes(record)
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(b''.join(self._pending))
+        self._pending = []
+        self._latencies = {}
+
+    def close(self):
+        """
+        Write the buffered records and close the file
+        :return: None
+        :rtype: NoneType
+        """
+        self.flush()
+        self._file.close()
+
+
+class TraceReader(object):
+    """
+    Reads a trace file through a memory mapping: records are only unpacked when accessed
+    """
+    def __init__(self, filename):
+        """
+        :param filename: trace file to read
+        :type filename: str
+        """
+        self.filename = filename
+        self._mapping = None
+        with open(filename, 'rb') as trace_file:
+            size = os.fstat(trace_file.fileno()).st_size
+            if size < TraceFile.HEADER.size:
+                raise ValueError('{0} is not a trace file'.format(filename))
+            magic, version, record_size = TraceFile.HEADER.unpack(trace_file.read(TraceFile.HEADER.size))
+            if magic != TraceFile.MAGIC or version != TraceFile.VERSION or record_size != TraceFile.RECORD.size:
+                raise ValueError('{0} is not a trace file of version {1}'.format(filename, TraceFile.VERSION))
+            self.count = (size - TraceFile.HEADER.size) // record_size  # A partially written record is ignored
+            if self.count > 0:
+                self._mapping = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        :return: the record at the index
+        :rtype: TraceRecord
+        """
+        if not 0 <= index < self.count:
+            raise IndexError('Record {0} is out of range'.format(index))
+        return TraceRecord._make(TraceFile.RECORD.unpack_from(self._mapping, TraceFile.HEADER.size + index * TraceFile.RECORD.size))
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Release the mapping
+        :return: None
+        :rtype: NoneType
+        """
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
+
+    def get_summary(self):
+        """
+        :return: summary of the trace (e.g. {'records': 120000, 'duration': 60.2, 'reads': 80000, 'writes': 40000, 'read_bytes': ..., 'extent': ...})
+        :rtype: dict
+        """
+        summary = {'records': self.count, 'duration': 0.0, 'reads': 0, 'writes': 0, 'read_bytes': 0, 'write_bytes': 0,
+                   'extent': 0, 'max_length': 0, 'with_latency': 0}
+        for record in self:
+            direction = TraceFile.OPERATIONS[record.op]
+            summary['{0}s'.format(direction)] += 1
+            summary['{0}_bytes'.format(direction)] += record.length
+            summary['extent'] = max(summary['extent'], record.offset + record.length)
+            summary['max_length'] = max(summary['max_length'], record.length)
+            if record.latency > 0:
+                summary['with_latency'] += 1
+        if self.count > 0:
+            summary['duration'] = self[self.count - 1].timestamp / 1e9
+        return summary
+
+
+class BlkparseConverter(object):
+    """
+    Converts the default output of blkparse into a trace
+    The requests issued to the driver (D) become records, their completions (C) provide the original latency
+    Requests without data (e.g. flushes) and discards are skipped
+    e.g.   8,0    3        1     0.000000000   697  D   W 223490 + 8 [kjournald]
+    """
+    LINE_REGEX = re.compile(r'^\s*(\d+,\d+)\s+\d+\s+\d+\s+(\d+)\.(\d+)\s+\d+\s+([A-Z]{1,2})\s+([A-Z]+)\s+(\d+)\s+\+\s+(\d+)')
+    SECTOR_SIZE = 512
+
+    def __init__(self, writer, action='D'):
+        """
+        :param writer: writer of the trace
+        :type writer: TraceWriter
+        :param action: blktrace action that marks the start of an IO: D (issued to the driver) or Q (queued)
+        :type action: str
+        """
+        self.writer = writer
+        self.action = action
+        self.skipped = 0
+        self._first_timestamp = None
+        self._in_flight = {}  # (device, sector) -> (record index, timestamp)
+
+    def feed(self, line):
+        """
+        Convert a line of blkparse output
+        :param line: the line
+        :type line: str
+        :return: None
+        :rtype: NoneType
+        """
+        match = self.LINE_REGEX.match(line)
+        if match is None:
+            return
+        device, seconds, fraction, action, rwbs, sector, sectors = match.groups()
+        if action not in [self.action, 'C']:
+            return
+        timestamp = int(seconds) * 10 ** 9 + int(fraction.ljust(9, '0')[:9])
+        key = (device, int(sector))
+        if action == 'C':
+            started = self._in_flight.pop(key, None)
+            if started is not None:
+                self.writer.set_latency(started[0], max(1, timestamp - started[1]))
+            return
+        if int(sectors) == 0 or 'D' in rwbs or ('R' not in rwbs and 'W' not in rwbs):
+            self.skipped += 1
+            return
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+        index = self.writer.append(timestamp=max(0, timestamp - self._first_timestamp),
+                                   offset=int(sector) * self.SECTOR_SIZE,
+                                   length=int(sectors) * self.SECTOR_SIZE,
+                                   op=TraceFile.WRITE if 'W' in rwbs else TraceFile.READ)
+        self._in_flight[key] = (index, timestamp)
+
+    @classmethod
+    def convert(cls, lines, filename, action='D'):
+        """
+        Convert blkparse output into a trace file
+        :param lines: lines of blkparse output
+        :type lines: iterable
+        :param filename: trace file to write
+        :type filename: str
+        :param action: blktrace action that marks the start of an IO
+        :type action: str
+        :return: amount of records written and lines skipped (e.g. {'records': 120000, 'skipped': 12})
+        :rtype: dict
+        """
+        writer = TraceWriter(filename)
+        converter = cls(writer, action)
+        try:
+            for line in lines:
+                converter.feed(line.decode('ascii', 'replace') if isinstance(line, bytes) else line)
+        finally:
+            writer.close()
+        return {'records': writer.count, 'skipped': converter.skipped}
+
+    @classmethod
+    def capture(cls, device, duration, filename, action='D'):
+        """
+        Trace the IO of a block device with blktrace and convert it on the fly
+        Requires blktrace and a mounted debugfs. Write the trace to a different device than the traced one
+        :param device: block device to trace
+        :type device: str
+        :param duration: seconds to trace
+        :type duration: int
+        :param filename: trace file to write
+        :type filename: str
+        :param action: blktrace action that marks the start of an IO
+        :type action: str
+        :return: amount of records written and lines skipped
+        :rtype: dict
+        """
+        with open(os.devnull, 'w') as devnull:
+            tracer = subprocess.Popen(['blktrace', '-d', device, '-w', str(duration), '-o', '-'], stdout=subprocess.PIPE, stderr=devnull)
+            parser = subprocess.Popen(['blkparse', '-q', '-i', '-'], stdin=tracer.stdout, stdout=subprocess.PIPE, stderr=devnull)
+            tracer.stdout.close()  # Only the parser reads it
+            try:
+                result = cls.convert(iter(parser.stdout.readline, b''), filename, action)
+            finally:
+                for process in [tracer, parser]:
+                    if process.poll() is None:
+                        process.terminate()
+                    process.wait()
+        if tracer.returncode not in [0, -15]:
+            raise RuntimeError('blktrace of {0} exited with {1}'.format(device, tracer.returncode))
+        return result
+
+
+class TraceReplayer(object):
+    """
+    Replays a trace against a file or block device (e.g. /mnt/<vpool>/<vdisk>.raw or a blktap device)
+    Every IO is issued at its original time, divided by the speed. 'threads' workers take the records in order, an IO is
+    issued late when all workers are still busy: that lag is reported together with the difference between the replayed
+    and the original latencies
+    """
+    THREADS = 32
+    ALIGNMENT = 512
+
+    def __init__(self, trace, filename, speed=1.0, threads=THREADS, direct=True):
+        """
+        :param trace: trace to replay
+        :type trace: TraceReader
+        :param filename: file or block device to replay on
+        :type filename: str
+        :param speed: factor to speed up (> 1) or slow down (< 1) the replay. 0 issues the IO as fast as possible
+        :type speed: float
+        :param threads: maximum amount of IO in flight
+        :type threads: int
+        :param direct: bypass the page cache
+        :type direct: bool
+        """
+        if speed < 0:
+            raise ValueError('The speed cannot be negative')
+        self.trace = trace
+        self.filename = filename
+        self.speed = speed
+        self.threads = threads
+        self.direct = direct
+        self.error = 0
+        self.region = 0
+        self._counter = itertools.count()
+        self._stats = []
+
+    def _open(self):
+        """
+        :return: a file descriptor, opened with O_DIRECT when possible
+        :rtype: int
+        """
+        flags = os.O_RDWR
+        if self.direct is True and hasattr(os, 'O_DIRECT'):
+            try:
+                return os.open(self.filename, flags | os.O_DIRECT)
+            except OSError as ex:
+                if ex.errno != errno.EINVAL:  # The filesystem does not support direct IO (e.g. tmpfs)
+                    raise
+        return os.open(self.filename, flags)
+
+    def _fail(self, exception):
+        """
+        Register the first error, every worker stops at its next IO
+        """
+        if self.error == 0:
+            self.error = getattr(exception, 'errno', None) or errno.EIO
+            sys.stderr.write('io_trace: error on {0}: {1}\n'.format(self.filename, exception))
+
+    def _get_offset(self, record):
+        """
+        :return: the offset to replay the record on. IO beyond the end of the target wraps around
+        :rtype: int
+        """
+        if record.offset + record.length <= self.region:
+            return record.offset
+        return record.offset % (self.region - record.length + 1) // self.ALIGNMENT * self.ALIGNMENT
+
+    def _work(self, stats, start):
+        """
+        Replay records until the trace is exhausted or an IO failed
+        :param stats: histograms and counters of this worker
+        :type stats: dict
+        :param start: clock value at which the replay started
+        :type start: float
+        :return: None
+        :rtype: NoneType
+        """
+        buffers = {}  # A buffer per length: slices of a single buffer are copies on python 2, which are not aligned
+        fd = None
+        try:
+            fd = self._open()
+            file_object = io.FileIO(fd, 'r+', closefd=False)
+            while self.error == 0:
+                index = next(self._counter)
+                if index >= len(self.trace):
+                    break
+                record = self.trace[index]
+                if record.length not in buffers:
+                    buffers[record.length] = mmap.mmap(-1, record.length)  # Anonymous mappings are page aligned, as required by O_DIRECT
+                    buffers[record.length].write(os.urandom(record.length))
+                buffer = buffers[record.length]
+                offset = self._get_offset(record)
+                if offset != record.offset:
+                    stats['wrapped'] += 1
+                if self.speed > 0:
+                    scheduled = start + record.timestamp / 1e9 / self.speed
+                    delay = scheduled - _clock()
+                    if delay > 0:
+                        time.sleep(delay)
+                    stats['lag'].add(max(0, int((_clock() - scheduled) * 1e9)))
+                issued = _clock()
+                if record.op == TraceFile.READ:
+                    if hasattr(os, 'preadv'):
+                        done = os.preadv(fd, [buffer], offset)
+                    else:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        done = file_object.readinto(buffer)
+                else:
+                    if hasattr(os, 'pwrite'):
+                        done = os.pwrite(fd, buffer, offset)
+                    else:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        done = os.write(fd, buffer)
+                latency = max(1, int((_clock() - issued) * 1e9))
+                if done != record.length:
+                    raise IOError(errno.EIO, 'Short {0} of {1} bytes at offset {2}'.format(TraceFile.OPERATIONS[record.op], done, offset))
+                stats[TraceFile.OPERATIONS[record.op]].add(latency)
+                if record.latency > 0:
+                    deviation = latency - record.latency
+                    stats['original'].add(record.latency)
+                    stats['compared'].add(latency)
+                    stats['deviation_total'] += deviation
+                    stats['deviation_squares'] += deviation * deviation
+                    if deviation > 0:
+                        stats['slower'] += 1
+        except (OSError, IOError) as ex:
+            self._fail(ex)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            for buffer in buffers.values():
+                buffer.close()
+
+    def replay(self):
+        """
+        Replay the trace
+        :return: report of the replay. Latencies are in nanoseconds, formatted as the clat_ns section of fio
+                 (e.g. {'records': 120000, 'duration': 30.1, 'read': {...}, 'write': {...}, 'lag': {...},
+                        'deviation': {'compared': 120000, 'mean': 35000.2, 'stddev': 12000.5, 'slower': 80000, 'original': {...}, 'replayed': {...}}})
+        :rtype: dict
+        """
+        fd = self._open()
+        try:
+            if stat.S_ISBLK(os.fstat(fd).st_mode):
+                self.region = os.lseek(fd, 0, os.SEEK_END)
+            else:
+                self.region = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        max_length = max([record.length for record in self.trace] or [0])
+        if self.region < max_length:
+            raise ValueError('{0} is smaller than the largest IO of the trace'.format(self.filename))
+        start = _clock()
+        workers = []
+        for index in range(max(1, min(self.threads, len(self.trace)))):
+            stats = {'read': LatencyHistogram(), 'write': LatencyHistogram(), 'lag': LatencyHistogram(), 'original': LatencyHistogram(),
+                     'compared': LatencyHistogram(), 'deviation_total': 0, 'deviation_squares': 0, 'slower': 0, 'wrapped': 0}
+            self._stats.append(stats)
+            worker = threading.Thread(target=self._work, args=(stats, start), name='replay_{0}'.format(index))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)  # Joining without a timeout blocks signals on python 2
+        duration = _clock() - start
+        merged = dict((key, LatencyHistogram.merge([stats[key] for stats in self._stats])) for key in ['read', 'write', 'lag', 'original', 'compared'])
+        compared = merged['compared'].count
+        deviation_mean = float(sum(stats['deviation_total'] for stats in self._stats)) / compared if compared > 0 else 0.0
+        deviation_variance = float(sum(stats['deviation_squares'] for stats in self._stats)) / compared - deviation_mean ** 2 if compared > 0 else 0.0
+        return {'records': merged['read'].count + merged['write'].count,
+                'speed': self.speed,
+                'duration': round(duration, 3),
+                'original_duration': self.trace[len(self.trace) - 1].timestamp / 1e9 if len(self.trace) > 0 else 0.0,
+                'error': self.error,
+                'wrapped': sum(stats['wrapped'] for stats in self._stats),
+                'read': merged['read'].to_fio(),
+                'write': merged['write'].to_fio(),
+                'lag': merged['lag'].to_fio(),
+                'deviation': {'compared': compared,
+                              'mean': deviation_mean,
+                              'stddev': max(0.0, deviation_variance) ** 0.5,
+                              'slower': sum(stats['slower'] for stats in self._stats),
+                              'original': merged['original'].to_fio(),
+                              'replayed': merged['compared'].to_fio()}}
+
+
+def main(arguments):
+    """
+    Command line entry, with --key=value options. The result is printed as JSON
+    e.g. python io_trace.py capture --device=/dev/sda --duration=60 --output=/root/trace.bin
+         python io_trace.py convert --input=/root/blkparse.txt --output=/root/trace.bin
+         python io_trace.py summary --trace=/root/trace.bin
+         python io_trace.py replay --trace=/root/trace.bin --filename=/mnt/myvpool01/vdisk.raw --speed=2 --threads=32
+    :return: exit code: 0 when successful, 2 on errors
+    :rtype: int
+    """
+    actions = ['capture', 'convert', 'summary', 'replay']
+    if len(arguments) == 0 or arguments[0] not in actions:
+        sys.stderr.write('Usage: io_trace.py {0} --key=value ...\n'.format('|'.join(actions)))
+        return 2
+    options = {}
+    for argument in arguments[1:]:
+        key, _, value = argument.lstrip('-').partition('=')
+        options[key.replace('-', '_')] = value
+    action = arguments[0]
+    try:
+        if action == 'capture':
+            kwargs = {'device': options.pop('device'), 'duration': int(options.pop('duration')), 'filename': options.pop('output'),
+                      'action': options.pop('action', 'D')}
+        elif action == 'convert':
+            kwargs = {'input_file': options.pop('input'), 'filename': options.pop('output'), 'action': options.pop('action', 'D')}
+        elif action == 'summary':
+            kwargs = {'trace': options.pop('trace')}
+        else:
+            speed = options.pop('speed', '1')
+            kwargs = {'trace': options.pop('trace'), 'filename': options.pop('filename'), 'speed': 0.0 if speed == 'max' else float(speed),
+                      'threads': int(options.pop('threads', TraceReplayer.THREADS)), 'direct': options.pop('direct', '1') == '1'}
+        if len(options) > 0:
+            raise ValueError('Unsupported options: {0}'.format(', '.join(sorted(options))))
+        if action == 'capture':
+            result = BlkparseConverter.capture(**kwargs)
+        elif action == 'convert':
+            with open(kwargs.pop('input_file'), 'rb') as input_file:
+                result = BlkparseConverter.convert(input_file, **kwargs)
+        else:
+            with TraceReader(kwargs.pop('trace')) as trace:
+                result = trace.get_summary() if action == 'summary' else TraceReplayer(trace, **kwargs).replay()
+    except (KeyError, ValueError, OSError, IOError, RuntimeError) as ex:
+        sys.stdout.write(json.dumps({'error': str(ex)}) + '\n')
+        return 2
+    sys.stdout.write(json.dumps(result) + '\n')
+    return 2 if result.get('error', 0) != 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
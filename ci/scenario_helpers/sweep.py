@@ -0,0 +1,172 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+import time
+import itertools
+import traceback
+from datetime import date
+from ci.scenario_helpers.ci_constants import CIConstants
+from ovs.extensions.generic.logger import Logger
+
+
+class ParameterSweep(CIConstants):
+    """
+    Runs the IO phase of a scenario over every combination of read/write mix, block size, iodepth and amount of vdisks
+    Cells are grouped on the amount of vdisks: the setup (vms, vdisks, ...) is done once per amount and reused by all its cells
+    """
+    LOGGER = Logger('scenario_helpers-parameter_sweep')
+    BLOCK_SIZES = ['4k']
+    IODEPTHS = [32]
+    VDISK_AMOUNTS = [1]
+
+    def __init__(self, configurations=CIConstants.DATA_TEST_CASES, block_sizes=BLOCK_SIZES, iodepths=IODEPTHS, vdisk_amounts=VDISK_AMOUNTS):
+        """
+        :param configurations: read/write mixes to test (e.g. [(0, 100), (100, 0)])
+        :type configurations: list[tuple]
+        :param block_sizes: block sizes to test (e.g. ['4k', '64k'])
+        :type block_sizes: list[str]
+        :param iodepths: iodepths to test (e.g. [1, 32])
+        :type iodepths: list[int]
+        :param vdisk_amounts: amounts of vdisks to test with
+        :type vdisk_amounts: list[int]
+        """
+        self.configurations = self._unique(tuple(configuration) for configuration in configurations)
+        self.block_sizes = self._unique(block_sizes)
+        self.iodepths = self._unique(iodepths)
+        self.vdisk_amounts = self._unique(vdisk_amounts)
+        self.results = []
+
+    @staticmethod
+    def _unique(values):
+        """
+        Remove duplicate values, preserving their order
+        :param values: values to deduplicate
+        :type values: iterable
+        :return: unique values
+        :rtype: list
+        """
+        unique_values = []
+        for value in values:
+            if value not in unique_values:
+                unique_values.append(value)
+        return unique_values
+
+    def get_cells(self):
+        """
+        List all cells of the sweep, grouped on the amount of vdisks
+        :return: cells (e.g. [{'vdisk_amount': 1, 'configuration': (0, 100), 'bs': '4k', 'iodepth': 32}])
+        :rtype: list[dict]
+        """
+        return [{'vdisk_amount': vdisk_amount, 'configuration': configuration, 'bs': block_size, 'iodepth': iodepth}
+                for vdisk_amount, configuration, block_size, iodepth in itertools.product(self.vdisk_amounts, self.configurations, self.block_sizes, self.iodepths)]
+
+    @staticmethod
+    def get_fio_configuration(cell, io_size):
+        """
+        Build the fio configuration of a cell, as expected by DataWriter.write_data_fio
+        :param cell: cell of the sweep
+        :type cell: dict
+        :param io_size: amount of bytes to read/write
+        :type io_size: int
+        :return: fio configuration
+        :rtype: dict
+        """
+        return {'io_size': io_size, 'configuration': cell['configuration'], 'bs': cell['bs'], 'iodepth': cell['iodepth']}
+
+    def run(self, setup, run_cell, teardown=None, stop_on_failure=False, logger=LOGGER):
+        """
+        Run all cells of the sweep
+        :param setup: sets up the environment for an amount of vdisks: setup(vdisk_amount) -> context
+        :type setup: callable
+        :param run_cell: executes the IO of one cell: run_cell(context, cell) -> metrics of the cell (optional)
+        :type run_cell: callable
+        :param teardown: cleans up the environment of an amount of vdisks: teardown(context)
+        :type teardown: callable
+        :param stop_on_failure: skip the remaining cells once a cell failed
+        :type stop_on_failure: bool
+        :param logger: logging instance
+        :return: result of every cell (e.g. [{'parameters': {...}, 'status': 'PASSED', 'duration': 12.5, 'metrics': None, 'errors': None}])
+        :rtype: list[dict]
+        """
+        self.results = []
+        failed = False
+        for vdisk_amount, cells in itertools.groupby(self.get_cells(), key=lambda cell: cell['vdisk_amount']):
+            cells = list(cells)
+            if failed is True and stop_on_failure is True:
+                self.results.extend({'parameters': cell, 'status': 'SKIPPED', 'duration': 0, 'metrics': None, 'errors': None} for cell in cells)
+                continue
+            logger.info('Setting up the sweep for {0} vdisk(s)'.format(vdisk_amount))
+            context = setup(vdisk_amount)
+            try:
+                for cell in cells:
+                    if failed is True and stop_on_failure is True:
+                        self.results.append({'parameters': cell, 'status': 'SKIPPED', 'duration': 0, 'metrics': None, 'errors': None})
+                        continue
+                    logger.info('Running sweep cell {0}'.format(cell))
+                    start = time.time()
+                    try:
+                        metrics = run_cell(context, cell)
+                        self.results.append({'parameters': cell, 'status': 'PASSED', 'duration': time.time() - start, 'metrics': metrics, 'errors': None})
+                    except Exception as ex:
+                        logger.exception('Sweep cell {0} has failed'.format(cell))
+                        failed = True
+                        self.results.append({'parameters': cell, 'status': 'FAILED', 'duration': time.time() - start, 'metrics': None,
+                                             'errors': '{0}\n{1}'.format(str(ex), traceback.format_exc())})
+            finally:
+                if teardown is not None:
+                    teardown(context)
+        return self.results
+
+    def get_failed(self):
+        """
+        :return: the results of the cells that failed
+        :rtype: list[dict]
+        """
+        return [result for result in self.results if result['status'] == 'FAILED']
+
+    def format_matrix(self):
+        """
+        Render the results as a table, one row per cell
+        Metrics returned as a dict by the cells (e.g. FioResult.get_summary) are added as columns
+        :return: the results matrix
+        :rtype: str
+        """
+        metric_names = sorted(set(name for result in self.results if isinstance(result['metrics'], dict) for name in result['metrics']))
+        rows = [tuple(['vdisks', 'read/write', 'bs', 'iodepth', 'status', 'duration'] + metric_names)]
+        for result in self.results:
+            parameters = result['parameters']
+            metrics = result['metrics'] if isinstance(result['metrics'], dict) else {}
+            rows.append(tuple([str(parameters['vdisk_amount']), '{0}/{1}'.format(*parameters['configuration']), parameters['bs'],
+                               str(parameters['iodepth']), result['status'], '{0:.1f}s'.format(result['duration'])] +
+                              ['-' if metrics.get(name) is None else str(metrics[name]) for name in metric_names]))
+        widths = [max(len(row[index]) for row in rows) for index in xrange(len(rows[0]))]
+        return '\n'.join(' | '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+    @staticmethod
+    def rotate(values, day=None):
+        """
+        Deterministically pick one of the values, moving on to the next one every day
+        Consecutive nightly runs cover all values in turn and runs of the same value remain comparable
+        :param values: values to pick from (e.g. CIConstants.DATA_TEST_CASES)
+        :type values: list
+        :param day: day to pick the value for. Defaults to today
+        :type day: datetime.date
+        :return: the value of the day
+        """
+        if len(values) == 0:
+            raise ValueError('No values to pick from')
+        if day is None:
+            day = date.today()
+        return values[day.toordinal() % len(values)]
@@ -14,10 +14,10 @@
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
 import re
-import math
 import time
 import threading
 from datetime import datetime
+from multiprocessing.pool import ThreadPool
 from ci.api_lib.helpers.thread import ThreadHelper, Waiter
 from ci.api_lib.setup.vdisk import VDiskSetup
 from ci.scenario_helpers.ci_constants import CIConstants
@@ -30,78 +30,110 @@ class ThreadingHandler(CIConstants):
     """
     IO_REFRESH_RATE = 5  # in seconds
     LOGGER = Logger('scenario_helpers-threading_handler')
-    VDISK_THREAD_LIMIT = 5  # Each monitor thread queries x amount of vdisks
+    VDISK_THREAD_LIMIT = 5  # Each monitor thread or fetch queries x amount of vdisks
+    MONITOR_POOL_SIZE = 10  # Bundles of vdisks the io polling thread queries concurrently
+    MAX_FAILED_REFRESHES = 2  # Consecutive refreshes a bundle can fail to fetch before polling gives up on it
 
-    @staticmethod
-    def monitor_changes(results, vdisks, r_semaphore, event, refresh_rate=IO_REFRESH_RATE, logger=LOGGER):
+    @classmethod
+    def monitor_changes(cls, monitoring_data, vdisk_bundles, r_semaphore, event, refresh_rate=IO_REFRESH_RATE, logger=LOGGER):
         """
         Threading method that will check for IOPS downtimes
-        :param results: variable reserved for this thread
-        :type results: dict
-        :param vdisks: vdisk object
-        :type vdisks: list(ovs.dal.hybrids.vdisk.VDISK)
+        Every refresh, the statistics and edge clients of all bundles are fetched concurrently by a bounded pool
+        A bundle that fails to fetch keeps its previous results, its error and amount of consecutive failures are kept under general
+        :param monitoring_data: variable reserved for this thread. Holds the results per bundle
+        :type monitoring_data: dict
+        :param vdisk_bundles: bundles of vdisks to monitor {volume_number_range: [vdisk object]}
+        :type vdisk_bundles: dict
         :param r_semaphore: semaphore object to lock threads
-        :type r_semaphore: ovs.extensions.generic.threadhelpers.Waiter
-        :param refresh_rate: interval between checking the io
-        :param logger: logging instance
+        :type r_semaphore: ci.api_lib.helpers.thread.Waiter
         :param event: Threading event to watch for
         :type event: threading._Event
+        :param refresh_rate: interval between checking the io
+        :param logger: logging instance
         :return: None
         :rtype: NoneType
         """
         last_recorded_iops = {}
-        while not event.is_set():
-            general_info = results['general']
-            general_info['in_progress'] = True
-            has_io = []
-            edge_info = {}
-            for vdisk in vdisks:
-                edge_info[vdisk.name] = []
-            # Reset counters
-            general_info['io'] = has_io
-            general_info['edge_clients'].update(edge_info)
-            now = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
-            now_sec = time.time()
-            for vdisk in vdisks:
-                last_iops = last_recorded_iops.get(vdisk.name, 0)
-                result = results[vdisk.name]
-                vdisk_stats = vdisk.statistics
-                vdisk_edge_clients = vdisk.edge_clients
-                current_iops = vdisk_stats['4k_read_operations_ps'] + vdisk_stats['4k_write_operations_ps']
-                io_section = result['io']
-                if current_iops == 0:
-                    io_section['down'].append((now, current_iops))
-                else:
-                    has_io.append(vdisk.name)
-                    if last_iops >= current_iops:
-                        io_section['rising'].append((now, current_iops))
-                    else:
-                        io_section['descending'].append((now, current_iops))
-                    if current_iops > io_section['highest'] or io_section['highest'] is None:
-                        io_section['highest'] = current_iops
-                    if current_iops < io_section['lowest'] or io_section['lowest'] is None:
-                        io_section['lowest'] = current_iops
-                edge_client_section = result['edge_clients']
-                edge_info[vdisk.name] = vdisk_edge_clients
-                if len(vdisk_edge_clients) == 0:
-                    edge_client_section['down'].append((now, vdisk_edge_clients))
-                else:
-                    edge_client_section['up'].append((now, vdisk_edge_clients))
-                # Sleep to avoid caching
-                last_recorded_iops[vdisk.name] = current_iops
-            general_info['io'] = has_io
-            general_info['edge_clients'].update(edge_info)
-            duration = time.time() - now_sec
-            logger.debug('IO for {0} at {1}. Call took {2}'.format(has_io, now, duration))
-            logger.debug('Edge clients for {0} at {1}. Call took {2}'.format(edge_info, now, duration))
-            general_info['in_progress'] = False
-            time.sleep(0 if duration > refresh_rate else refresh_rate - duration)
-            r_semaphore.wait(30 * 60)  # Let each thread wait for another
+        bundles = sorted(vdisk_bundles.iteritems())
+        pool = ThreadPool(max(1, min(cls.MONITOR_POOL_SIZE, len(bundles))))
+        try:
+            while not event.is_set():
+                for volume_number_range, _ in bundles:
+                    monitoring_data[volume_number_range]['general']['in_progress'] = True
+                now = datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+                now_sec = time.time()
+                fetched_bundles = pool.map(cls._fetch_statistics, [vdisks for _, vdisks in bundles])
+                has_io = []
+                for (volume_number_range, _), fetched in zip(bundles, fetched_bundles):
+                    results = monitoring_data[volume_number_range]
+                    fetched, error = fetched
+                    if fetched is None:  # Keeps its previous results and stays in progress until a fetch succeeds again
+                        results['general']['error'] = 'Fetching the statistics failed at {0}: {1}'.format(now, error)
+                        results['general']['failed_refreshes'] += 1
+                        continue
+                    bundle_io = []
+                    edge_info = {}
+                    for vdisk_name, vdisk_stats, vdisk_edge_clients in fetched:
+                        last_iops = last_recorded_iops.get(vdisk_name, 0)
+                        result = results[vdisk_name]
+                        current_iops = vdisk_stats['4k_read_operations_ps'] + vdisk_stats['4k_write_operations_ps']
+                        io_section = result['io']
+                        if current_iops == 0:
+                            io_section['down'].append((now, current_iops))
+                        else:
+                            bundle_io.append(vdisk_name)
+                            if last_iops >= current_iops:
+                                io_section['rising'].append((now, current_iops))
+                            else:
+                                io_section['descending'].append((now, current_iops))
+                            if current_iops > io_section['highest'] or io_section['highest'] is None:
+                                io_section['highest'] = current_iops
+                            if current_iops < io_section['lowest'] or io_section['lowest'] is None:
+                                io_section['lowest'] = current_iops
+                        edge_client_section = result['edge_clients']
+                        edge_info[vdisk_name] = vdisk_edge_clients
+                        if len(vdisk_edge_clients) == 0:
+                            edge_client_section['down'].append((now, vdisk_edge_clients))
+                        else:
+                            edge_client_section['up'].append((now, vdisk_edge_clients))
+                        last_recorded_iops[vdisk_name] = current_iops
+                    general_info = results['general']
+                    general_info['io'] = bundle_io
+                    general_info['edge_clients'].update(edge_info)
+                    general_info['in_progress'] = False
+                    general_info['error'] = None
+                    general_info['failed_refreshes'] = 0
+                    has_io.extend(bundle_io)
+                duration = time.time() - now_sec
+                logger.debug('IO for {0} at {1}. Call took {2}'.format(has_io, now, duration))
+                time.sleep(0 if duration > refresh_rate else refresh_rate - duration)
+                r_semaphore.wait(30 * 60)  # Let each thread wait for another
+        finally:
+            pool.terminate()
+
+    @classmethod
+    def _fetch_statistics(cls, vdisks, logger=LOGGER):
+        """
+        Fetch the statistics and edge clients of a bundle of vdisks
+        A failing bundle does not stop the monitoring of the other bundles
+        :param vdisks: vdisks to fetch for
+        :type vdisks: list(ovs.dal.hybrids.vdisk.VDISK)
+        :param logger: logging instance
+        :return: name, statistics and edge clients of every vdisk (None when fetching failed) and the error fetching failed with
+        :rtype: tuple(list[tuple(str, dict, list)], str)
+        """
+        try:
+            return [(vdisk.name, vdisk.statistics, vdisk.edge_clients) for vdisk in vdisks], None
+        except Exception as ex:
+            logger.exception('Unable to fetch the statistics of vdisks {0}'.format(', '.join(vdisk.name for vdisk in vdisks)))
+            return None, str(ex)
 
     @classmethod
     def start_io_polling_threads(cls, volume_bundle, logger=LOGGER):
         """
-        Will start the io polling threads
+        Will start the io polling thread
+        A single thread monitors all volumes: the volumes are bundled per VDISK_THREAD_LIMIT and a pool of at most
+        MONITOR_POOL_SIZE threads fetches the bundles concurrently, so the load on the DAL does not grow with the amount of volumes
         :param volume_bundle: bundle of volumes {vdiskname: vdisk object}
         :type volume_bundle: dict
         :param logger: logger instance
@@ -109,47 +141,37 @@ class ThreadingHandler(CIConstants):
         :return: threads, monitoring_data, r_semaphore
         :rtype: tuple(list, dict, ci.api_lib.helpers.thread.Waiter)
         """
-        required_thread_amount = math.ceil(float(len(volume_bundle.keys())) / cls.VDISK_THREAD_LIMIT)  # Amount of threads we will need
-        r_semaphore = Waiter(required_thread_amount + 1, auto_reset=True)  # Add another target to let this thread control the semaphore
         threads = []
         monitoring_data = {}
+        vdisk_bundles = {}
         current_thread_bundle = {'index': 1, 'vdisks': []}
-        logger.info(
-            'Starting threads.')  # Separate because creating vdisks takes a while, while creating the threads does not
-        try:
-            for index, (vdisk_name, vdisk_object) in enumerate(volume_bundle.iteritems(), 1):
-                vdisks = current_thread_bundle['vdisks']
-                volume_number_range = '{0}-{1}'.format(current_thread_bundle['index'], index)
-                vdisks.append(vdisk_object)
-                if index % cls.VDISK_THREAD_LIMIT == 0 or index == len(volume_bundle.keys()):
-                    # New thread bundle
-                    monitor_resource = {'general': {'io': [], 'edge_clients': {}}}
-                    # noinspection PyTypeChecker
-                    for vdisk in vdisks:
-                        monitor_resource[vdisk.name] = {
-                            'io': {'down': [], 'descending': [], 'rising': [], 'highest': None, 'lowest': None},
-                            'edge_clients': {'down': [], 'up': []}}
-                    monitoring_data[volume_number_range] = monitor_resource
-                    threads.append(ThreadHelper.start_thread_with_event(target=cls.monitor_changes,
-                                                                        name='iops_{0}'.format(current_thread_bundle['index']),
-                                                                        args=(monitor_resource, vdisks, r_semaphore)))
-                    current_thread_bundle['index'] = index + 1
-                    current_thread_bundle['vdisks'] = []
-        except Exception:
-            for thread_pair in threads:  # Attempt to cleanup current inflight threads
-                if thread_pair[0].isAlive():
-                    thread_pair[1].set()
-            while r_semaphore.get_counter() < len(threads):  # Wait for the number of threads we currently have.
-                time.sleep(0.05)
-            r_semaphore.wait()  # Unlock them to let them stop (the object is set -> wont loop)
-            # Wait for threads to die
-            for thread_pair in threads:
-                thread_pair[0].join()
-            raise
+        for index, (vdisk_name, vdisk_object) in enumerate(volume_bundle.iteritems(), 1):
+            vdisks = current_thread_bundle['vdisks']
+            volume_number_range = '{0}-{1}'.format(current_thread_bundle['index'], index)
+            vdisks.append(vdisk_object)
+            if index % cls.VDISK_THREAD_LIMIT == 0 or index == len(volume_bundle.keys()):
+                # New bundle
+                monitor_resource = {'general': {'io': [], 'edge_clients': {}, 'error': None, 'failed_refreshes': 0}}
+                # noinspection PyTypeChecker
+                for vdisk in vdisks:
+                    monitor_resource[vdisk.name] = {
+                        'io': {'down': [], 'descending': [], 'rising': [], 'highest': None, 'lowest': None},
+                        'edge_clients': {'down': [], 'up': []}}
+                monitoring_data[volume_number_range] = monitor_resource
+                vdisk_bundles[volume_number_range] = vdisks
+                current_thread_bundle['index'] = index + 1
+                current_thread_bundle['vdisks'] = []
+        r_semaphore = Waiter(2 if len(vdisk_bundles) > 0 else 1, auto_reset=True)  # Add another target to let this thread control the semaphore
+        logger.info('Starting the io polling thread for {0} volumes.'.format(len(volume_bundle)))
+        if len(vdisk_bundles) > 0:
+            threads.append(ThreadHelper.start_thread_with_event(target=cls.monitor_changes,
+                                                                name='iops_monitor',
+                                                                args=(monitoring_data, vdisk_bundles, r_semaphore)))
         return threads, monitoring_data, r_semaphore
 
     @classmethod
-    def poll_io(cls, r_semaphore, required_thread_amount, shared_resource, downed_time, disk_amount, timeout, output_files=None, client=None, logger=LOGGER):
+    def poll_io(cls, r_semaphore, required_thread_amount, shared_resource, downed_time, disk_amount, timeout, output_files=None, client=None,
+                fio_handle=None, logger=LOGGER):
         """
         Will start IO polling
         Prerequisite: all threads must have synced up before calling this function
@@ -169,11 +191,15 @@ class ThreadingHandler(CIConstants):
         :type client: ovs.extensions.generic.sshclient.SSHClient
         :param disk_amount: amount of disks that were checked with
         :type disk_amount: int
+        :param fio_handle: OPTIONAL: fio instances started by DataWriter.dispatch_fio, checked for errors on every iteration
+        :type fio_handle: ci.scenario_helpers.data_writing.FioDispatch
         :param logger: logging instance
         :type logger: ovs.log.log_handler.LogHandler
         :return: None
+        Raises when the statistics of a bundle could not be fetched for more than MAX_FAILED_REFRESHES refreshes in a row,
+        as its IO would never be seen coming back
         """
-        if output_files is None and client is None:
+        if output_files is not None and client is None:
             raise ValueError('When output files is specified, a compute client is needed.')
         if output_files is None:
             output_files = []
@@ -193,6 +219,16 @@ class ThreadingHandler(CIConstants):
             if len(errors) > 0:
                 raise RuntimeError('Fio has reported errors: {} at {}. Fetched from {}: {}'
                                    .format(', '.join(errors), datetime.today().strftime('%Y-%m-%d %H:%M:%S'), client.ip, ', '.join(output_files)))
+            if fio_handle is not None:
+                handle_errors = fio_handle.get_errors()
+                if len(handle_errors) > 0:
+                    raise RuntimeError('Fio has reported errors at {0}: {1}'.format(datetime.today().strftime('%Y-%m-%d %H:%M:%S'),
+                                                                                   ', '.join('{0}: {1}'.format(ip, ', '.join(sorted(errors)))
+                                                                                             for ip, errors in sorted(handle_errors.iteritems()))))
+            failing_bundles = cls.get_failing_bundles(shared_resource)
+            if len(failing_bundles) > 0:
+                raise RuntimeError('Unable to monitor the IO: {0}'.format(', '.join('vdisks {0}: {1}'.format(volume_number_range, error)
+                                                                                  for volume_number_range, error in sorted(failing_bundles.iteritems()))))
             # Calculate to see if IO is back
             io_volumes = cls.get_all_vdisks_with_io(shared_resource)
             logger.info('Currently got io for {0}: {1}'.format(len(io_volumes), io_volumes))
@@ -224,10 +260,15 @@ class ThreadingHandler(CIConstants):
         :return: None
         """
         now = time.time()
+        reported_bundles = set()  # Failing bundles that were logged already
         while time.time() - now < duration:
             if r_semaphore.get_counter() < len(threads):
                 time.sleep(0.05)
                 continue
+            failing_bundles = cls.get_failing_bundles(shared_resource)
+            for volume_number_range in set(failing_bundles) - reported_bundles:
+                logger.warning('Unable to monitor the IO of vdisks {0}: {1}'.format(volume_number_range, failing_bundles[volume_number_range]))
+            reported_bundles = set(failing_bundles)
             if time.time() - now % 1 == 0:
                 io_volumes = cls.get_all_vdisks_with_io(shared_resource)
                 logger.info('Currently got io for {0} volumes: {1}'.format(len(io_volumes), io_volumes))
@@ -247,6 +288,18 @@ class ThreadingHandler(CIConstants):
             output.extend(monitor_resource['general']['io'])
         return output
 
+    @classmethod
+    def get_failing_bundles(cls, monitoring_data):
+        """
+        Retrieve the bundles of which the statistics could not be fetched for more than MAX_FAILED_REFRESHES refreshes in a row
+        :param monitoring_data: results of the io polling thread
+        :type monitoring_data: dict
+        :return: volume number range -> last error
+        :rtype: dict
+        """
+        return dict((volume_number_range, monitor_resource['general']['error']) for volume_number_range, monitor_resource in monitoring_data.iteritems()
+                    if monitor_resource['general'].get('failed_refreshes', 0) > cls.MAX_FAILED_REFRESHES)
+
     @classmethod
     def start_snapshotting_threads(cls, volume_bundle, args=(), kwargs=None, logger=LOGGER):
         """
@@ -0,0 +1,153 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+import re
+import pipes
+from ovs.extensions.generic.logger import Logger
+
+
+class VdbenchParser(object):
+    """
+    Incremental parser for the console output of vdbench
+    Every interval report becomes a sample, data validation errors and other failures become events
+    e.g. 13:47:31.049         1    5432.00    21.22    4096  50.02    0.734    0.612    0.856   12.345    0.512   4.0  12.3   4.5
+    """
+    INTERVAL_REGEX = re.compile(r'^(\d{2}:\d{2}:\d{2}\.\d{3})\s+(\d+|avg_\S+)\s+([\d.\s]+)$')
+    COLUMNS = ['rate', 'mb_sec', 'bytes_io', 'read_pct', 'resp_time', 'read_resp', 'write_resp', 'resp_max', 'resp_stddev',
+               'queue_depth', 'cpu_total', 'cpu_sys']  # In the order of the vdbench report. Response times are in milliseconds
+    DATA_ERROR_REGEX = re.compile(r'data validation|dv error|corrupt|bad block|bad sector', re.IGNORECASE)
+    ERROR_REGEX = re.compile(r'error|exception|abort', re.IGNORECASE)
+
+    def __init__(self):
+        self.samples = []
+        self.averages = []  # The averages vdbench reports at the end of a run (e.g. avg_2-120)
+        self.events = []
+        self._remainder = ''
+
+    def feed(self, data):
+        """
+        Parse a chunk of output. Incomplete lines are kept until the rest arrives
+        :param data: the chunk
+        :type data: str
+        :return: the events found within the chunk (e.g. [{'type': 'data_error', 'time': '13:47:33.123', 'line': '...'}])
+        :rtype: list[dict]
+        """
+        lines = (self._remainder + data).split('\n')
+        self._remainder = lines.pop()
+        events = []
+        for line in lines:
+            event = self._parse_line(line.rstrip('\r'))
+            if event is not None:
+                events.append(event)
+        self.events.extend(events)
+        return events
+
+    def _parse_line(self, line):
+        """
+        Parse a complete line
+        :return: an event, if the line reports one
+        :rtype: dict
+        """
+        match = self.INTERVAL_REGEX.match(line.strip())
+        if match is not None:
+            values = [float(value) for value in match.group(3).split()]
+            sample = dict(zip(self.COLUMNS, values))
+            sample['time'] = match.group(1)
+            if match.group(2).startswith('avg'):
+                sample['interval'] = match.group(2)
+                self.averages.append(sample)
+            else:
+                sample['interval'] = int(match.group(2))
+                self.samples.append(sample)
+            return None
+        if self.DATA_ERROR_REGEX.search(line):
+            return {'type': 'data_error', 'time': line.split(' ', 1)[0], 'line': line.strip()}
+        if self.ERROR_REGEX.search(line):
+            return {'type': 'error', 'time': line.split(' ', 1)[0], 'line': line.strip()}
+        return None
+
+    @property
+    def data_errors(self):
+        """
+        :return: the data validation errors reported so far
+        :rtype: list[dict]
+        """
+        return [event for event in self.events if event['type'] == 'data_error']
+
+    def get_summary(self):
+        """
+        Summarize the series
+        :return: summary (e.g. {'intervals': 7200, 'data_errors': 0, 'errors': 0, 'rate': {'min': 5012.0, 'mean': 5432.1, 'max': 5830.0}, ...})
+        :rtype: dict
+        """
+        summary = {'intervals': len(self.samples),
+                   'data_errors': len(self.data_errors),
+                   'errors': len([event for event in self.events if event['type'] == 'error']),
+                   'vdbench_average': self.averages[-1] if len(self.averages) > 0 else None}
+        for column in ['rate', 'mb_sec', 'resp_time', 'resp_max']:
+            values = [sample[column] for sample in self.samples if column in sample]
+            summary[column] = {'min': min(values), 'mean': round(sum(values) / len(values), 3), 'max': max(values)} if len(values) > 0 else None
+        return summary
+
+
+class VdbenchMonitor(object):
+    """
+    Follows the captured output of vdbench on a client
+    Every update only fetches what was appended since the previous one
+    """
+    LOGGER = Logger('scenario_helpers-vdbench_monitor')
+    BEGIN_MARKER = 'BEGIN_VDBENCH_OUTPUT'
+    END_MARKER = 'END_VDBENCH_OUTPUT'
+
+    def __init__(self, client, output_file):
+        """
+        :param client: client vdbench runs on
+        :type client: ovs.extensions.generic.sshclient.SSHClient
+        :param output_file: file the output of vdbench is captured in
+        :type output_file: str
+        """
+        self.client = client
+        self.output_file = output_file
+        self.offset = 0
+        self.parser = VdbenchParser()
+
+    def update(self, logger=LOGGER):
+        """
+        Fetch and parse the output appended since the previous update
+        :param logger: logging instance
+        :return: the new events
+        :rtype: list[dict]
+        """
+        # The markers keep the whitespace around the data intact, the client might strip its output
+        output = self.client.run('echo {0}; tail -c +{1} {2} 2>/dev/null; echo {3}'.format(self.BEGIN_MARKER, self.offset + 1, pipes.quote(self.output_file),
+                                                                                          self.END_MARKER), allow_insecure=True)
+        output = output.rstrip('\r\n')
+        begin = output.find(self.BEGIN_MARKER + '\n')
+        if begin == -1 or not output.endswith(self.END_MARKER):
+            raise RuntimeError('Unexpected output while reading {0} on {1}'.format(self.output_file, self.client.ip))
+        data = output[begin + len(self.BEGIN_MARKER) + 1:len(output) - len(self.END_MARKER)]
+        self.offset += len(data)
+        events = self.parser.feed(data)
+        for event in events:
+            if event['type'] == 'data_error':
+                logger.error('Vdbench on {0} reported a data error: {1}'.format(self.client.ip, event['line']))
+        return events
+
+    def get_results(self):
+        """
+        :return: the series of interval samples and their summary
+        :rtype: dict
+        """
+        return {'samples': list(self.parser.samples), 'summary': self.parser.get_summary(), 'events': list(self.parser.events)}
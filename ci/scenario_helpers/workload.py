@@ -0,0 +1,140 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+import re
+
+
+class WorkloadProfile(object):
+    """
+    Describes a workload once and renders it for fio, the built-in IO engine and vdbench:
+    a histogram of transfer sizes, a read/write mix, the share of random IO and a rate
+    """
+    PROFILES = {
+        # Transfer size mix observed on production clusters
+        'mixed_production': {'block_sizes': [('4k', 25.68), ('8k', 26.31), ('16k', 6.4), ('32k', 7.52), ('60k', 10.52), ('128k', 9.82),
+                                             ('252k', 7.31), ('504k', 6.19), ('984k', 0.23), ('1032k', 0.02)],
+                             'read_percentage': 50, 'random_percentage': 100},
+        # Many desktops booting at once: mostly small random reads
+        'vdi_boot_storm': {'block_sizes': [('4k', 45), ('8k', 15), ('16k', 10), ('32k', 15), ('64k', 15)],
+                           'read_percentage': 90, 'random_percentage': 80},
+        # Database pages with some log and index IO
+        'database_oltp': {'block_sizes': [('8k', 70), ('4k', 10), ('16k', 10), ('64k', 10)],
+                          'read_percentage': 70, 'random_percentage': 100},
+        # Large sequential writes
+        'backup_stream': {'block_sizes': [('256k', 20), ('512k', 30), ('1m', 50)],
+                          'read_percentage': 5, 'random_percentage': 0}
+    }
+    SIZE_REGEX = re.compile(r'^\d+[kmg]?$')
+
+    def __init__(self, name, block_sizes, read_percentage, random_percentage=100, rate='max'):
+        """
+        :param name: name of the profile
+        :type name: str
+        :param block_sizes: transfer sizes and their weights, the weights do not need to add up to 100 (e.g. [('4k', 70), ('64k', 30)])
+        :type block_sizes: list[tuple(str, float)]
+        :param read_percentage: percentage of reads
+        :type read_percentage: int
+        :param random_percentage: percentage of IO at random offsets, the rest is sequential
+        :type random_percentage: int
+        :param rate: IOPS to generate, 'max' for as much as possible
+        :type rate: int / str
+        """
+        if len(block_sizes) == 0:
+            raise ValueError('A workload requires at least one transfer size')
+        for block_size, weight in block_sizes:
+            if not self.SIZE_REGEX.match(str(block_size).lower()) or weight <= 0:
+                raise ValueError('Invalid transfer size {0} with weight {1}'.format(block_size, weight))
+        for percentage in [read_percentage, random_percentage]:
+            if not 0 <= percentage <= 100:
+                raise ValueError('Percentages should be between 0 and 100, got {0}'.format(percentage))
+        if rate != 'max' and (not isinstance(rate, int) or rate <= 0):
+            raise ValueError('The rate should be a positive amount of IOPS or max')
+        self.name = name
+        self.block_sizes = [(str(block_size).lower(), weight) for block_size, weight in block_sizes]
+        self.read_percentage = read_percentage
+        self.random_percentage = random_percentage
+        self.rate = rate
+
+    @classmethod
+    def get_profile(cls, name, **overrules):
+        """
+        Retrieve a named profile
+        :param name: name of the profile (e.g. database_oltp)
+        :type name: str
+        :param overrules: attributes to change (e.g. rate=5000)
+        :return: the profile
+        :rtype: WorkloadProfile
+        """
+        if name not in cls.PROFILES:
+            raise ValueError('Unknown workload profile {0}. Choose from {1}'.format(name, ', '.join(sorted(cls.PROFILES))))
+        settings = dict(cls.PROFILES[name])
+        settings.update(overrules)
+        return cls(name=name, **settings)
+
+    def _get_percentages(self, decimals):
+        """
+        Normalize the weights to percentages that add up to exactly 100, distributing the rounding with the largest remainder method
+        Sizes of which the share rounds to 0 are dropped
+        :param decimals: amount of decimals of the percentages
+        :type decimals: int
+        :return: transfer sizes and their percentages
+        :rtype: list[tuple(str, float)]
+        """
+        factor = 10 ** decimals
+        total = float(sum(weight for _, weight in self.block_sizes))
+        exact = [weight / total * 100 * factor for _, weight in self.block_sizes]
+        rounded = [int(value) for value in exact]
+        by_remainder = sorted(range(len(exact)), key=lambda index: exact[index] - rounded[index], reverse=True)
+        for index in by_remainder[:100 * factor - sum(rounded)]:
+            rounded[index] += 1
+        return [(block_size, float(amount) / factor if decimals > 0 else amount)
+                for (block_size, _), amount in zip(self.block_sizes, rounded) if amount > 0]
+
+    def get_fio_configuration(self, io_size, iodepth=None):
+        """
+        Render the profile as a fio configuration for DataWriter.write_data_fio, for both fio and the built-in engine
+        fio only accepts whole percentages within a bssplit
+        :param io_size: amount of bytes to read/write
+        :type io_size: int
+        :param iodepth: iodepth to use, defaults to the one of write_data_fio
+        :type iodepth: int
+        :return: fio configuration (e.g. {'io_size': 1073741824, 'configuration': (70, 30), 'bssplit': '8k/70:4k/10:16k/10:64k/10', 'percentage_random': 100})
+        :rtype: dict
+        """
+        configuration = {'io_size': io_size,
+                         'configuration': (self.read_percentage, 100 - self.read_percentage),
+                         'bssplit': ':'.join('{0}/{1}'.format(block_size, percentage) for block_size, percentage in self._get_percentages(0)),
+                         'percentage_random': self.random_percentage}
+        if self.rate != 'max':
+            configuration['rate_iops'] = self.rate
+        if iodepth is not None:
+            configuration['iodepth'] = iodepth
+        return configuration
+
+    def get_vdbench_configuration(self):
+        """
+        Render the profile as the workload arguments of DataWriter.deploy_vdbench
+        :return: e.g. {'xfersize': '(4k,25.68,8k,26.31)', 'read_percentage': 50, 'random_seek_percentage': 100, 'io_rate': 'max'}
+        :rtype: dict
+        """
+        return {'xfersize': '({0})'.format(','.join('{0},{1:g}'.format(block_size, percentage) for block_size, percentage in self._get_percentages(2))),
+                'read_percentage': self.read_percentage,
+                'random_seek_percentage': self.random_percentage,
+                'io_rate': self.rate}
+
+    def __repr__(self):
+        return '<WorkloadProfile {0}: {1}, {2}% read, {3}% random, rate {4}>'.format(
+            self.name, ' '.join('{0}/{1:g}'.format(block_size, weight) for block_size, weight in self.block_sizes),
+            self.read_percentage, self.random_percentage, self.rate)
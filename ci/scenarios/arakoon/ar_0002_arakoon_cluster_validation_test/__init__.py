@@ -16,4 +16,6 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = []  # Reads the arakoon configurations and states
+EXPECTED_DURATION = 1 * 60
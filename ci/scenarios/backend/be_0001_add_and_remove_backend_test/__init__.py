@@ -16,4 +16,5 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = ['backend']
@@ -13,3 +13,9 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Init
+"""
+RESOURCES = ['vpool', 'storagerouter']
+EXPECTED_DURATION = 60 * 60  # One reroute per read/write mix of DATA_TEST_CASES
@@ -14,7 +14,6 @@
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
 import time
-import random
 from ci.api_lib.helpers.vdisk import VDiskHelper
 from ci.api_lib.helpers.domain import DomainHelper
 from ci.api_lib.helpers.storagedriver import StoragedriverHelper
@@ -25,6 +24,7 @@ from ci.api_lib.remove.vdisk import VDiskRemover
 from ci.api_lib.setup.vdisk import VDiskSetup
 from ci.autotests import gather_results
 from ci.scenario_helpers.data_writing import DataWriter
+from ci.scenario_helpers.sweep import ParameterSweep
 from ci.scenario_helpers.threading_handlers import ThreadingHandler
 from ci.scenario_helpers.ci_constants import CIConstants
 from ovs.extensions.generic.sshclient import SSHClient
@@ -43,20 +43,22 @@ class EdgeTester(CIConstants):
 
     @staticmethod
     @gather_results(CASE_TYPE, LOGGER, TEST_NAME, log_components=[{'framework': ['ovs-workers']}, 'volumedriver'])
-    def main(blocked):
+    def main(blocked, configuration=None):
         """
         Run all required methods for the test
         :param blocked: was the test blocked by other test?
+        :param configuration: read/write mix to reroute under, one of DATA_TEST_CASES is picked when not given
+        :type configuration: tuple
         :return: results of test
         :rtype: dict
         """
         _ = blocked
-        return EdgeTester.start_test()
+        return EdgeTester.start_test(configuration=configuration)
 
     @classmethod
-    def start_test(cls):
+    def start_test(cls, configuration=None):
         cluster_info, is_ee, fio_bin_loc = cls.setup()
-        cls.test_reroute_fio(fio_bin_loc, cluster_info, is_ee=is_ee)
+        cls.test_reroute_fio(fio_bin_loc, cluster_info, is_ee=is_ee, configuration=configuration)
 
     @classmethod
     def setup(cls, logger=LOGGER):
@@ -150,7 +152,7 @@ class EdgeTester(CIConstants):
             client.run(cmd)
 
     @classmethod
-    def test_reroute_fio(cls, fio_bin_path, cluster_info, disk_amount=1, timeout=CIConstants.HA_TIMEOUT, is_ee=False, logger=LOGGER):
+    def test_reroute_fio(cls, fio_bin_path, cluster_info, disk_amount=1, timeout=CIConstants.HA_TIMEOUT, is_ee=False, configuration=None, logger=LOGGER):
         """
         Uses a modified fio to work with the openvstorage protocol
         :param fio_bin_path: path of the fio binary
@@ -163,6 +165,8 @@ class EdgeTester(CIConstants):
         :type timeout: int
         :param is_ee: is it the enterprise edition
         :type is_ee: bool
+        :param configuration: read/write mix to do IO with, one of DATA_TEST_CASES is picked when not given
+        :type configuration: tuple
         :param logger: logger instance
         :type logger: ovs.log.log_handler.LogHandler
         :return: None
@@ -201,7 +205,8 @@ class EdgeTester(CIConstants):
             except RuntimeError as ex:
                 logger.error('Could not create the vdisk. Got {0}'.format(str(ex)))
                 raise
-        configuration = random.choice(cls.DATA_TEST_CASES)
+        if configuration is None:
+            configuration = ParameterSweep.rotate(cls.DATA_TEST_CASES)
         threads = {'evented': {'io': {'pairs': [], 'r_semaphore': None}}}
         screen_names = []
         adjusted = False
@@ -277,12 +282,12 @@ class EdgeTester(CIConstants):
 
 def run(blocked=False):
     """
-    Run a test
+    Run a test, rerouting once under every read/write mix of DATA_TEST_CASES
     :param blocked: was the test blocked by other test?
-    :return: results of test
+    :return: results of test, the results of every read/write mix are listed under cells
     :rtype: dict
     """
-    return EdgeTester().main(blocked)
+    return EdgeTester.main.run_matrix({'configuration': EdgeTester.DATA_TEST_CASES}, blocked)
 
 if __name__ == '__main__':
     run()
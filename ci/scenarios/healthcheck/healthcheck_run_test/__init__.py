@@ -16,4 +16,6 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = []  # The healthcheck does not change the cluster
+EXPECTED_DURATION = 3 * 60
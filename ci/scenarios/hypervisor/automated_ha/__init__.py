@@ -13,3 +13,9 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Init
+"""
+RESOURCES = ['cluster']  # Fails nodes while vms are running on them
+EXPECTED_DURATION = 60 * 60
@@ -14,7 +14,6 @@
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
 import time
-import random
 from ci.api_lib.helpers.api import TimeOutError
 from ci.api_lib.helpers.hypervisor.hypervisor import HypervisorFactory
 from ci.api_lib.helpers.system import SystemHelper
@@ -22,11 +21,12 @@ from ci.api_lib.helpers.thread import ThreadHelper
 from ci.api_lib.helpers.vdisk import VDiskHelper
 from ci.api_lib.remove.vdisk import VDiskRemover
 from ci.api_lib.setup.vdisk import VDiskSetup
-from ci.autotests import gather_results
+from ci.autotests import PhaseTimer, gather_results
 from ci.scenario_helpers.ci_constants import CIConstants
 from ci.scenario_helpers.data_writing import DataWriter
 from ci.scenario_helpers.fwk_handler import FwkHandler
 from ci.scenario_helpers.setup import SetupHelper
+from ci.scenario_helpers.sweep import ParameterSweep
 from ci.scenario_helpers.threading_handlers import ThreadingHandler
 from ci.scenario_helpers.vm_handler import VMHandler
 from ovs.extensions.generic.logger import Logger
@@ -50,7 +50,7 @@ class HATester(CIConstants):
     VM_NAME = 'HA-test'
 
     @staticmethod
-    @gather_results(CASE_TYPE, LOGGER, TEST_NAME, log_components=[{'framework': ['ovs-workers']}, 'volumedriver'])
+    @gather_results(CASE_TYPE, LOGGER, TEST_NAME, log_components=[{'framework': ['ovs-workers']}, 'volumedriver', 'arakoon'], log_all_nodes=True)
     def main(blocked):
         """
         Run all required methods for the test
@@ -71,30 +71,33 @@ class HATester(CIConstants):
         :type vm_amount: int
         :return:
         """
-        cluster_info, is_ee, cloud_image_path, cloud_init_loc, fio_bin_path = cls.setup()
-        compute_ip = cluster_info['storagerouters']['compute'].ip
+        with PhaseTimer.phase('setup'):
+            cluster_info, is_ee, cloud_image_path, cloud_init_loc, fio_bin_path = cls.setup()
+            compute_ip = cluster_info['storagerouters']['compute'].ip
 
-        vm_handler = VMHandler(hypervisor_ip=compute_ip, amount_of_vms=vm_amount)
+            vm_handler = VMHandler(hypervisor_ip=compute_ip, amount_of_vms=vm_amount)
 
-        source_storagedriver = cluster_info['storagedrivers']['source']
-        protocol = source_storagedriver.cluster_node_config['network_server_uri'].split(':')[0]
-        edge_details = {'port': source_storagedriver.ports['edge'], 'hostname': source_storagedriver.storage_ip, 'protocol': protocol}
-        edge_user_info = {}
-        if is_ee is True:
-            edge_user_info = cls.get_shell_user()
-            edge_details.update(edge_user_info)
-        vm_handler.prepare_vm_disks(source_storagedriver=source_storagedriver,
-                                    cloud_image_path=cloud_image_path,
-                                    cloud_init_loc=cloud_init_loc,
-                                    vm_name=cls.VM_NAME,
-                                    data_disk_size=cls.AMOUNT_TO_WRITE,
-                                    edge_user_info=edge_user_info)
-        vm_info = vm_handler.create_vms(edge_configuration=edge_details,
-                                        timeout=cls.VM_CREATION_TIMEOUT)
+            source_storagedriver = cluster_info['storagedrivers']['source']
+            protocol = source_storagedriver.cluster_node_config['network_server_uri'].split(':')[0]
+            edge_details = {'port': source_storagedriver.ports['edge'], 'hostname': source_storagedriver.storage_ip, 'protocol': protocol}
+            edge_user_info = {}
+            if is_ee is True:
+                edge_user_info = cls.get_shell_user()
+                edge_details.update(edge_user_info)
+            vm_handler.prepare_vm_disks(source_storagedriver=source_storagedriver,
+                                        cloud_image_path=cloud_image_path,
+                                        cloud_init_loc=cloud_init_loc,
+                                        vm_name=cls.VM_NAME,
+                                        data_disk_size=cls.AMOUNT_TO_WRITE,
+                                        edge_user_info=edge_user_info)
+        with PhaseTimer.phase('vm_creation'):
+            vm_info = vm_handler.create_vms(edge_configuration=edge_details,
+                                            timeout=cls.VM_CREATION_TIMEOUT)
         try:
             cls.run_test(cluster_info=cluster_info, vm_info=vm_info)
         finally:
-            vm_handler.destroy_vms(vm_info=vm_info)
+            with PhaseTimer.phase('teardown'):
+                vm_handler.destroy_vms(vm_info=vm_info)
 
     @classmethod
     def setup(cls, logger=LOGGER):
@@ -152,71 +155,68 @@ class HATester(CIConstants):
                 vdisk_info.update({vdisk.name: vdisk})
 
         with remote(compute_client.ip, [SSHClient]) as rem:
-            configuration = random.choice(cls.DATA_TEST_CASES)
+            configuration = ParameterSweep.rotate(cls.DATA_TEST_CASES)
             threads = {'evented': {'io': {'pairs': [], 'r_semaphore': None}}}
-            output_files = []
+            fio_handle = None
             vm_downed = False
             try:
                 logger.info('Starting the following configuration: {0}'.format(configuration))
-                for vm_name, vm_data in vm_info.iteritems():
-                    vm_client = rem.SSHClient(vm_data['ip'], cls.VM_USERNAME, cls.VM_PASSWORD)
-                    vm_client.file_create('/mnt/data/{0}.raw'.format(vm_data['create_msg']))
-                    vm_data['client'] = vm_client
-                io_thread_pairs, monitoring_data, io_r_semaphore = ThreadingHandler.start_io_polling_threads(volume_bundle=vdisk_info)
-                threads['evented']['io']['pairs'] = io_thread_pairs
-                threads['evented']['io']['r_semaphore'] = io_r_semaphore
-                for vm_name, vm_data in vm_info.iteritems():  # Write data
-                    screen_names, output_files = DataWriter.write_data_fio(client=vm_data['client'],
-                                                                           fio_configuration={
-                                                                               'io_size': cls.AMOUNT_TO_WRITE,
-                                                                               'configuration': configuration},
-                                                                           file_locations=['/mnt/data/{0}.raw'.format(vm_data['create_msg'])])
-                    vm_data['screen_names'] = screen_names
-                logger.info('Doing IO for {0}s before bringing down the node.'.format(cls.IO_TIME))
-                ThreadingHandler.keep_threads_running(r_semaphore=io_r_semaphore,
-                                                      threads=io_thread_pairs,
-                                                      shared_resource=monitoring_data,
-                                                      duration=cls.IO_TIME)
+                with PhaseTimer.phase('io'):
+                    for vm_name, vm_data in vm_info.iteritems():
+                        vm_client = rem.SSHClient(vm_data['ip'], cls.VM_USERNAME, cls.VM_PASSWORD)
+                        vm_client.file_create('/mnt/data/{0}.raw'.format(vm_data['create_msg']))
+                        vm_data['client'] = vm_client
+                    io_thread_pairs, monitoring_data, io_r_semaphore = ThreadingHandler.start_io_polling_threads(volume_bundle=vdisk_info)
+                    threads['evented']['io']['pairs'] = io_thread_pairs
+                    threads['evented']['io']['r_semaphore'] = io_r_semaphore
+                    fio_handle = DataWriter.dispatch_fio(targets=[{'client': vm_data['client'], 'file_locations': ['/mnt/data/{0}.raw'.format(vm_data['create_msg'])]}
+                                                                  for vm_data in vm_info.itervalues()],
+                                                         fio_configuration={'io_size': cls.AMOUNT_TO_WRITE, 'configuration': configuration},
+                                                         status_interval=cls.IO_REFRESH_RATE)  # Write data
+                    logger.info('Doing IO for {0}s before bringing down the node.'.format(cls.IO_TIME))
+                    ThreadingHandler.keep_threads_running(r_semaphore=io_r_semaphore,
+                                                          threads=io_thread_pairs,
+                                                          shared_resource=monitoring_data,
+                                                          duration=cls.IO_TIME)
                 # Threads ready for monitoring at this point
                 #########################
                 # Bringing original owner of the volume down
                 #########################
-                try:
-                    logger.info('Stopping {0}.'.format(vm_to_stop))
-                    VMHandler.stop_vm(hypervisor=parent_hypervisor, vmid=vm_to_stop)
-                    vm_downed = True
-                except Exception as ex:
-                    logger.error('Failed to stop. Got {0}'.format(str(ex)))
-                    raise
-                downed_time = time.time()
-                time.sleep(cls.IO_REFRESH_RATE * 2)
-                # Start IO polling to verify nothing went down
-                ThreadingHandler.poll_io(r_semaphore=io_r_semaphore,
-                                         required_thread_amount=len(io_thread_pairs),
-                                         shared_resource=monitoring_data,
-                                         downed_time=downed_time,
-                                         timeout=cls.HA_TIMEOUT,
-                                         output_files=output_files,
-                                         client=compute_client,
-                                         disk_amount=disk_amount)
-                cls._validate(values_to_check, monitoring_data)
+                with PhaseTimer.phase('io_recovery'):
+                    try:
+                        logger.info('Stopping {0}.'.format(vm_to_stop))
+                        VMHandler.stop_vm(hypervisor=parent_hypervisor, vmid=vm_to_stop)
+                        vm_downed = True
+                    except Exception as ex:
+                        logger.error('Failed to stop. Got {0}'.format(str(ex)))
+                        raise
+                    downed_time = time.time()
+                    time.sleep(cls.IO_REFRESH_RATE * 2)
+                    # Start IO polling to verify nothing went down
+                    ThreadingHandler.poll_io(r_semaphore=io_r_semaphore,
+                                             required_thread_amount=len(io_thread_pairs),
+                                             shared_resource=monitoring_data,
+                                             downed_time=downed_time,
+                                             timeout=cls.HA_TIMEOUT,
+                                             fio_handle=fio_handle,
+                                             disk_amount=disk_amount)
+                with PhaseTimer.phase('validation'):
+                    cls._validate(values_to_check, monitoring_data)
             except Exception as ex:
                 logger.error('Running the test for configuration {0} has failed because {1}'.format(configuration, str(ex)))
                 failed_configurations.append({'configuration': configuration, 'reason': str(ex)})
             finally:
-                for thread_category, thread_collection in threads['evented'].iteritems():
-                    ThreadHelper.stop_evented_threads(thread_collection['pairs'], thread_collection['r_semaphore'])
-                if vm_downed is True:
-                    VMHandler.start_vm(parent_hypervisor, vm_to_stop)
-                    logger.debug('Started {0}'.format(vm_to_stop))
-                    SystemHelper.idle_till_ovs_is_up(source_storagedriver.storage_ip, **cls.get_shell_user())
-                    # @TODO: Remove when https://github.com/openvstorage/integrationtests/issues/540 is fixed
-                    FwkHandler.restart_all()
-                for vm_name, vm_data in vm_info.iteritems():
-                    for screen_name in vm_data.get('screen_names', []):
-                        logger.debug('Stopping screen {0} on {1}.'.format(screen_name, vm_data['client'].ip))
-                        vm_data['client'].run(['screen', '-S', screen_name, '-X', 'quit'])
-                    vm_data['screen_names'] = []
+                with PhaseTimer.phase('teardown'):
+                    for thread_category, thread_collection in threads['evented'].iteritems():
+                        ThreadHelper.stop_evented_threads(thread_collection['pairs'], thread_collection['r_semaphore'])
+                    if vm_downed is True:
+                        VMHandler.start_vm(parent_hypervisor, vm_to_stop)
+                        logger.debug('Started {0}'.format(vm_to_stop))
+                        SystemHelper.idle_till_ovs_is_up(source_storagedriver.storage_ip, **cls.get_shell_user())
+                        # @TODO: Remove when https://github.com/openvstorage/integrationtests/issues/540 is fixed
+                        FwkHandler.restart_all()
+                    if fio_handle is not None:
+                        fio_handle.stop()
         assert len(failed_configurations) == 0, 'Certain configuration failed: {0}'.format(' '.join(failed_configurations))
 
     @classmethod
@@ -275,20 +275,20 @@ class HATester(CIConstants):
             except RuntimeError as ex:
                 logger.error('Could not create the vdisk. Got {0}'.format(str(ex)))
                 raise
-        configuration = random.choice(cls.DATA_TEST_CASES)
+        configuration = ParameterSweep.rotate(cls.DATA_TEST_CASES)
         threads = {'evented': {'io': {'pairs': [], 'r_semaphore': None}}}
         vm_downed = False
-        screen_names = []
+        fio_handle = None
         try:
             logger.info('Starting threads.')  # Separate because creating vdisks takes a while, while creating the threads does not
 
             io_thread_pairs, monitoring_data, io_r_semaphore = ThreadingHandler.start_io_polling_threads(volume_bundle=vdisk_info)
             threads['evented']['io']['pairs'] = io_thread_pairs
             threads['evented']['io']['r_semaphore'] = io_r_semaphore
-            screen_names, output_files = DataWriter.write_data_fio(client=compute_client,
-                                                                   fio_configuration={'io_size': cls.AMOUNT_TO_WRITE,
-                                                                                      'configuration': configuration},
-                                                                   edge_configuration=edge_configuration)
+            fio_handle = DataWriter.dispatch_fio(targets=[{'client': compute_client, 'edge_configuration': edge_configuration}],
+                                                 fio_configuration={'io_size': cls.AMOUNT_TO_WRITE, 'configuration': configuration},
+                                                 job_file=True,
+                                                 status_interval=cls.IO_REFRESH_RATE)
             logger.info('Doing IO for {0}s before bringing down the node.'.format(cls.IO_TIME))
             ThreadingHandler.keep_threads_running(r_semaphore=io_r_semaphore,
                                                   threads=io_thread_pairs,
@@ -313,8 +313,7 @@ class HATester(CIConstants):
                                      shared_resource=monitoring_data,
                                      downed_time=downed_time,
                                      timeout=timeout,
-                                     output_files=output_files,
-                                     client=compute_client,
+                                     fio_handle=fio_handle,
                                      disk_amount=disk_amount)
             cls._validate(values_to_check, monitoring_data)
         except Exception as ex:
@@ -327,9 +326,8 @@ class HATester(CIConstants):
                 SystemHelper.idle_till_ovs_is_up(source_storagedriver.storage_ip, **cls.get_shell_user())
                 # @TODO: Remove when https://github.com/openvstorage/integrationtests/issues/540 is fixed
                 FwkHandler.restart_all()
-            if screen_names:
-                for screen_name in screen_names:
-                    compute_client.run(['screen', '-S', screen_name, '-X', 'quit'])
+            if fio_handle is not None:
+                fio_handle.stop()
             for vdisk in vdisk_info.values():
                 VDiskRemover.remove_vdisk(vdisk.guid)
         assert len(failed_configurations) == 0, 'Certain configuration failed: {0}'.format(' '.join(failed_configurations))
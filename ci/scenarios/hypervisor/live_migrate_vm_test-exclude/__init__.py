@@ -13,3 +13,9 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Init
+"""
+RESOURCES = ['vpool', 'hypervisor']
+EXPECTED_DURATION = 45 * 60
@@ -14,7 +14,6 @@
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
 import time
-import random
 from ci.api_lib.helpers.hypervisor.hypervisor import HypervisorFactory, HypervisorCredentials
 from ci.api_lib.helpers.storagedriver import StoragedriverHelper
 from ci.api_lib.helpers.storagerouter import StoragerouterHelper
@@ -24,6 +23,7 @@ from ci.autotests import gather_results
 from ci.scenario_helpers.ci_constants import CIConstants
 from ci.scenario_helpers.data_writing import DataWriter
 from ci.scenario_helpers.setup import SetupHelper
+from ci.scenario_helpers.sweep import ParameterSweep
 from ci.scenario_helpers.threading_handlers import ThreadingHandler
 from ci.scenario_helpers.vm_handler import VMHandler
 from ovs.extensions.generic.logger import Logger
@@ -145,7 +145,7 @@ class MigrateTester(CIConstants):
 
         with remote(source_storagedriver.storage_ip, [SSHClient]) as rem:
             test_run_nr = 0
-            configuration = random.choice(cls.DATA_TEST_CASES)
+            configuration = ParameterSweep.rotate(cls.DATA_TEST_CASES)
             threads = {'evented': {'io': {'pairs': [], 'r_semaphore': None}}}
             output_files = []
             try:
@@ -16,4 +16,6 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = []  # Queries the service states
+EXPECTED_DURATION = 1 * 60
@@ -16,4 +16,6 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = []  # Opens ssh connections between the nodes
+EXPECTED_DURATION = 1 * 60
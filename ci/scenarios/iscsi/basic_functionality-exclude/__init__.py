@@ -13,3 +13,8 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Init
+"""
+RESOURCES = ['vpool', 'storagerouter']
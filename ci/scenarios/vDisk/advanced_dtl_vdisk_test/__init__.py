@@ -16,4 +16,6 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = ['vpool', 'hypervisor']
+EXPECTED_DURATION = 45 * 60
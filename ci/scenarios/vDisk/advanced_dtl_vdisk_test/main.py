@@ -55,9 +55,10 @@ class AdvancedDTLTester(CIConstants):
     # validate dtl
     VM_FILENAME = '/root/dtl_file'
     VM_RANDOM = '/root/random_file'
+    PATTERN_SIZE = 2 * 1024 ** 2  # Data written while the proxies are offline, has to fit in the DTL
 
     @staticmethod
-    @gather_results(CASE_TYPE, LOGGER, TEST_NAME, log_components=[{'framework': ['ovs-workers']}, 'volumedriver'])
+    @gather_results(CASE_TYPE, LOGGER, TEST_NAME, log_components=[{'framework': ['ovs-workers']}, 'volumedriver', 'arakoon'], log_all_nodes=True)
     def main(blocked):
         """
         Run all required methods for the test
@@ -171,9 +172,9 @@ class AdvancedDTLTester(CIConstants):
                     vm_client = rem.SSHClient(vm_data['ip'], cls.VM_USERNAME, cls.VM_PASSWORD)
                     vm_client.file_create('/mnt/data/{0}.raw'.format(vm_data['create_msg']))
                     vm_data['client'] = vm_client
-                    # Load dd, md5sum, screen & fio in memory
-                    vm_data['client'].run(['dd', 'if=/dev/urandom', 'of={0}'.format(cls.VM_RANDOM), 'bs=1M', 'count=2'])
-                    vm_data['client'].run(['md5sum', cls.VM_RANDOM])
+                    # Load the integrity check, screen & fio in memory
+                    DataWriter.write_pattern(client=vm_data['client'], location=cls.VM_RANDOM, size=cls.PATTERN_SIZE)
+                    DataWriter.verify_pattern(client=vm_data['client'], location=cls.VM_RANDOM)
 
                 logger.info("Stopping proxy services")
                 service_manager = ServiceFactory.get_manager()
@@ -183,10 +184,7 @@ class AdvancedDTLTester(CIConstants):
 
                 logger.info('Starting to WRITE file while proxy is offline. All data should be stored in the DTL!')
                 for vm_name, vm_data in vm_info.iteritems():
-                    vm_data['client'].run('dd if=/dev/urandom of={0} bs=1M count=2'.format(cls.VM_FILENAME).split())
-                    original_md5sum = ' '.join(vm_data['client'].run(['md5sum', cls.VM_FILENAME]).split())
-                    vm_data['original_md5sum'] = original_md5sum
-                    logger.info('Original MD5SUM for VM {0}: {1}.'.format(vm_name, original_md5sum))
+                    DataWriter.write_pattern(client=vm_data['client'], location=cls.VM_FILENAME, size=cls.PATTERN_SIZE)
                 logger.info('Finished to WRITE file while proxy is offline!')
                 logger.info("Starting fio to generate IO for failing over.".format(cls.IO_TIME))
                 io_thread_pairs, monitoring_data, io_r_semaphore = ThreadingHandler.start_io_polling_threads(volume_bundle=vdisk_info)
@@ -224,12 +222,12 @@ class AdvancedDTLTester(CIConstants):
                 cls._validate_move(values_to_check)
                 logger.info('Finished validating move!')
                 logger.info('Validate if DTL is working correctly!')
-                unmatching_checksum_vms = []
+                corrupted_vms = []
                 for vm_name, vm_data in vm_info.iteritems():
-                    current_md5sum = ' '.join(vm_data['client'].run(['md5sum', cls.VM_FILENAME]).split())
-                    if vm_data['original_md5sum'] != current_md5sum:
-                        unmatching_checksum_vms.append(vm_name)
-                assert len(unmatching_checksum_vms) == 0, 'Not all data was read from the DTL. Checksums do not line up for {}'.format(', '.join(unmatching_checksum_vms))
+                    report = DataWriter.verify_pattern(client=vm_data['client'], location=cls.VM_FILENAME, size=cls.PATTERN_SIZE)
+                    if report['corrupted_blocks'] > 0:
+                        corrupted_vms.append('{0}: {1}'.format(vm_name, DataWriter.format_corrupted_ranges(report)))
+                assert len(corrupted_vms) == 0, 'Not all data was read from the DTL. Corrupted ranges: {0}'.format('; '.join(corrupted_vms))
                 logger.info('DTL is working correctly!')
             finally:
                 for thread_category, thread_collection in threads['evented'].iteritems():
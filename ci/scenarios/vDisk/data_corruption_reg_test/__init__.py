@@ -16,4 +16,7 @@
 
 """
 Init 
-"""
\ No newline at end of file
+"""
+RESOURCES = ['vpool', 'hypervisor']
+EXPECTED_DURATION = 150 * 60
+TIMEOUT = 4 * 60 * 60
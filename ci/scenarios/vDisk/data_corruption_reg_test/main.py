@@ -13,18 +13,19 @@
 #
 # Open vStorage is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY of any kind.
+import time
 import random
 from ci.autotests import gather_results
 from ci.scenario_helpers.ci_constants import CIConstants
 from ci.scenario_helpers.data_writing import DataWriter
 from ci.scenario_helpers.setup import SetupHelper
 from ci.scenario_helpers.vm_handler import VMHandler
+from ci.scenario_helpers.workload import WorkloadProfile
 from ovs.extensions.generic.logger import Logger
 from ovs_extensions.generic.remote import remote
 from ovs.extensions.generic.sshclient import SSHClient
 
 
-# @ todo fix this test. No validation, just launches the vdbench async
 class DataCorruptionTester(CIConstants):
     """
     This is a regression test for https://github.com/openvstorage/integrationtests/issues/468
@@ -45,12 +46,11 @@ class DataCorruptionTester(CIConstants):
     AMOUNT_DATA_ERRORS = 1  # Nr of data errors that may occur
     VDBENCH_TIME = 120 * 60  # Time of run (seconds)
     VDBENCH_INTERVAL = 1  # Reporting interval (seconds)
-    IO_RATE = 'max'  # Rate of the IO
-    XFERSIZE = '(4k,25.68,8k,26.31,16k,6.4,32k,7.52,60k,10.52,128k,9.82,252k,7.31,504k,6.19,984k,0.23,1032k,0.02)'  # Transfer sizes
-    READ_PERCENTAGE = 50  # RW percent
-    RANDOM_SEEK_PERCENTAGE = 100  # Random seeks to throw in
+    WORKLOAD = WorkloadProfile.get_profile('mixed_production')  # Transfer sizes, RW percent, random seeks and rate of the IO
 
     VM_FILENAME = "/root/vdbench_file"  # File to use for IO
+    PATTERN_SIZE = CIConstants.AMOUNT_TO_WRITE / 2  # Integrity pattern written on the data disk, leaves room for the filesystem
+    VERIFY_INTERVAL = 5 * 60  # Seconds between the integrity checks while vdbench is running
     VM_VDBENCH_CFG_PATH = "/root/vdbench_run.cfg"
 
     @staticmethod
@@ -121,6 +121,7 @@ class DataCorruptionTester(CIConstants):
         """
         Deploy a vdbench and see if the following bug is triggered (or other datacorruption bugs)
         https://github.com/openvstorage/integrationtests/issues/468
+        While vdbench is running, an integrity pattern on the data disk of every vm is verified and rewritten with a new generation
         :param storagedriver: storagedriver to use for the VM its vdisks
         :type storagedriver: ovs.dal.hybrids.storagedriver.StorageDriver
         :param logger: logging instance
@@ -134,8 +135,10 @@ class DataCorruptionTester(CIConstants):
             try:
                 for vm_name, vm_data in vm_info.iteritems():
                     vm_client = rem.SSHClient(vm_data['ip'], cls.VM_USERNAME, cls.VM_PASSWORD)
-                    vm_client.file_create('/mnt/data/{0}.raw'.format(vm_data['create_msg']))
+                    vm_data['pattern_location'] = '/mnt/data/{0}.raw'.format(vm_data['create_msg'])
+                    vm_client.file_create(vm_data['pattern_location'])
                     vm_data['client'] = vm_client
+                    DataWriter.write_pattern(client=vm_client, location=vm_data['pattern_location'], size=cls.PATTERN_SIZE)
                     # install fio on the VM
                     logger.info('Installing vdbench on {0}.'.format(vm_name))
                     DataWriter.deploy_vdbench(client=vm_data['client'],
@@ -146,19 +149,37 @@ class DataCorruptionTester(CIConstants):
                                               lun_location=cls.VM_FILENAME,
                                               thread_amount=cls.AMOUNT_THREADS,
                                               write_amount=cls.AMOUNT_TO_WRITE,
-                                              xfersize=cls.XFERSIZE,
-                                              read_percentage=cls.READ_PERCENTAGE,
-                                              random_seek_percentage=cls.RANDOM_SEEK_PERCENTAGE,
-                                              io_rate=cls.IO_RATE,
                                               duration=cls.VDBENCH_TIME,
-                                              interval=cls.VDBENCH_INTERVAL
-                                              )
+                                              interval=cls.VDBENCH_INTERVAL,
+                                              **cls.WORKLOAD.get_vdbench_configuration())
                 for vm_name, vm_data in vm_info.iteritems():
                     logger.info('Starting VDBENCH on {0}!'.format(vm_name))
                     screen_names, output_files = DataWriter.write_data_vdbench(client=vm_data['client'],
                                                                                binary_location=cls.VM_VDBENCH_ZIP.replace('.zip', ''),
                                                                                config_location=cls.VM_VDBENCH_CFG_PATH)
                     vm_data['screen_names'] = screen_names
+                    vm_data['vdbench_monitor'] = DataWriter.get_vdbench_monitor(vm_data['client'], output_files)
+                generation = 1
+                end_time = time.time() + cls.VDBENCH_TIME
+                while time.time() < end_time:
+                    time.sleep(min(cls.VERIFY_INTERVAL, max(0, end_time - time.time())))
+                    corrupted_vms = []
+                    for vm_name, vm_data in vm_info.iteritems():
+                        data_errors = [event['line'] for event in vm_data['vdbench_monitor'].update() if event['type'] == 'data_error']
+                        if len(data_errors) > 0:
+                            corrupted_vms.append('{0}: vdbench reported {1}'.format(vm_name, ', '.join(data_errors)))
+                        report = DataWriter.verify_pattern(client=vm_data['client'], location=vm_data['pattern_location'],
+                                                           size=cls.PATTERN_SIZE, generation=generation)
+                        if report['corrupted_blocks'] > 0:
+                            corrupted_vms.append('{0}: {1}'.format(vm_name, DataWriter.format_corrupted_ranges(report)))
+                    assert len(corrupted_vms) == 0, 'Data corruption detected during generation {0}: {1}'.format(generation, '; '.join(corrupted_vms))
+                    generation += 1
+                    for vm_name, vm_data in vm_info.iteritems():
+                        DataWriter.write_pattern(client=vm_data['client'], location=vm_data['pattern_location'],
+                                                 size=cls.PATTERN_SIZE, generation=generation)
+                for vm_name, vm_data in vm_info.iteritems():
+                    vm_data['vdbench_monitor'].update()
+                    logger.info('VDBENCH results of {0}: {1}'.format(vm_name, vm_data['vdbench_monitor'].get_results()['summary']))
                 logger.info('Finished VDBENCH without errors!')
                 logger.info('No data corruption detected!')
             finally:
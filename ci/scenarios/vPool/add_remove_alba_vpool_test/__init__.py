@@ -17,3 +17,4 @@
 """
 Init
 """
+RESOURCES = ['vpool', 'storagerouter']
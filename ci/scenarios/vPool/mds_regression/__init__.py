@@ -17,3 +17,5 @@
 """
 Init
 """
+RESOURCES = ['vpool', 'storagerouter', 'hypervisor']
+EXPECTED_DURATION = 60 * 60
@@ -24,6 +24,7 @@ from ci.autotests import gather_results
 from ci.scenario_helpers.ci_constants import CIConstants
 from ci.scenario_helpers.data_writing import DataWriter
 from ci.scenario_helpers.setup import SetupHelper
+from ci.scenario_helpers.sweep import ParameterSweep
 from ci.scenario_helpers.threading_handlers import ThreadingHandler
 from ci.scenario_helpers.vm_handler import VMHandler
 from multiprocessing.pool import ThreadPool
@@ -152,10 +153,10 @@ class RegressionTester(CIConstants):
         try:
             cls._adjust_automatic_scrubbing(disable=True)
             with remote(compute_str.ip, [SSHClient]) as rem:
-                configuration = random.choice(data_test_cases)
+                configuration = ParameterSweep.rotate(data_test_cases)
                 threads = {'evented': {'io': {'pairs': [], 'r_semaphore': None},
                                        'snapshots': {'pairs': [], 'r_semaphore': None}}}
-                output_files = []
+                fio_handle = None
                 safety_set = False
                 try:
                     logger.info('Starting the following configuration: {0}'.format(configuration))
@@ -170,13 +171,10 @@ class RegressionTester(CIConstants):
                     threads['evented']['io']['r_semaphore'] = io_r_semaphore
                     # @todo snapshot every minute
                     threads['evented']['snapshots']['pairs'] = ThreadingHandler.start_snapshotting_threads(volume_bundle=vdisk_info, kwargs={'interval': 15})
-                    for vm_name, vm_data in vm_info.iteritems():  # Write data
-                        screen_names, output_files = DataWriter.write_data_fio(client=vm_data['client'],
-                                                                               fio_configuration={
-                                                                                   'io_size': cls.AMOUNT_TO_WRITE,
-                                                                                   'configuration': configuration},
-                                                                               file_locations=['/mnt/data/{0}.raw'.format(vm_data['create_msg'])])
-                        vm_data['screen_names'] = screen_names
+                    fio_handle = DataWriter.dispatch_fio(targets=[{'client': vm_data['client'], 'file_locations': ['/mnt/data/{0}.raw'.format(vm_data['create_msg'])]}
+                                                                  for vm_data in vm_info.itervalues()],
+                                                         fio_configuration={'io_size': cls.AMOUNT_TO_WRITE, 'configuration': configuration},
+                                                         status_interval=cls.IO_REFRESH_RATE)  # Write data
                     logger.info('Doing IO for {0}s before bringing down the node.'.format(cls.IO_TIME))
                     ThreadingHandler.keep_threads_running(r_semaphore=io_r_semaphore,
                                                           threads=io_thread_pairs,
@@ -201,8 +199,7 @@ class RegressionTester(CIConstants):
                                              shared_resource=monitoring_data,
                                              downed_time=downed_time,
                                              timeout=timeout,
-                                             output_files=output_files,
-                                             client=compute_client,
+                                             fio_handle=fio_handle,
                                              disk_amount=disk_amount)
                     possible_scrub_errors = async_scrubbing.get()  # Wait until scrubbing calls have given a result
                     assert len(possible_scrub_errors) == 0, 'Scrubbing has encountered some errors: {0}'.format(', '.join(possible_scrub_errors))
@@ -214,11 +211,8 @@ class RegressionTester(CIConstants):
                 finally:
                     for thread_category, thread_collection in threads['evented'].iteritems():
                         ThreadHelper.stop_evented_threads(thread_collection['pairs'], thread_collection['r_semaphore'])
-                    for vm_name, vm_data in vm_info.iteritems():
-                        for screen_name in vm_data.get('screen_names', []):
-                            logger.debug('Stopping screen {0} on {1}.'.format(screen_name, vm_data['client'].ip))
-                            vm_data['client'].run(['screen', '-S', screen_name, '-X', 'quit'])
-                        vm_data['screen_names'] = []
+                    if fio_handle is not None:
+                        fio_handle.stop()
                     if safety_set is True:
                         cls._set_mds_safety(source_storagedriver.vpool, len(StorageRouterList.get_masters()), checkup=True)
         finally:
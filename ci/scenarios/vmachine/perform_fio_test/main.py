@@ -23,6 +23,7 @@ from ci.api_lib.remove.vdisk import VDiskRemover
 from ci.autotests import gather_results
 from ci.scenario_helpers.ci_constants import CIConstants
 from ci.scenario_helpers.data_writing import DataWriter
+from ci.scenario_helpers.sweep import ParameterSweep
 from ci.scenario_helpers.vm_handler import VMHandler
 from ovs.extensions.generic.logger import Logger
 from ovs.extensions.generic.sshclient import SSHClient
@@ -40,6 +41,8 @@ class FioOnVDiskChecks(CIConstants):
     REQUIRED_PACKAGES = ['blktap-openvstorage-utils', 'qemu', 'fio']
     VDISK_CHECK_TIMEOUT = 10
     VDISK_CHECK_AMOUNT = 30
+    SWEEP_BLOCK_SIZES = ['4k', '64k']  # Swept together with every read/write mix of DATA_TEST_CASES on the FUSE vdisks
+    SWEEP_IODEPTHS = [1, 32]
 
     def __init__(self):
         pass
@@ -96,42 +99,63 @@ class FioOnVDiskChecks(CIConstants):
         :return:
         """
         logger.info("Starting to validate the fio on vdisks")
-        cls.run_test_fuse(storagedriver, amount_vdisks, amount_to_write)
+        fuse_matrix = cls.run_test_fuse(storagedriver, amount_vdisks, amount_to_write)
         cls.run_test_edge_blktap(storagedriver, image_path, amount_vdisks, amount_vdisks)
         logger.info("Finished validating fio on vdisks")
+        return 'FUSE results:\n{0}'.format(fuse_matrix)
 
     @classmethod
     def run_test_fuse(cls, storagedriver, disk_amount, write_amount, logger=LOGGER):
         """
         Deploy and run a small io test using the FUSE interface
         :param storagedriver: chosen storagedriver for testing
-        :param disk_amount: amount of disks to deploy and write/read to
+        :param disk_amount: largest amount of disks to deploy and write/read to. The sweep also runs on a single disk
         :param write_amount: amount of data to parse for writing/reading
         :param logger: logging instance
-        :return: 
+        :return: results matrix of the sweep
+        :rtype: str
         """
         vpool = storagedriver.vpool
         client = SSHClient(storagedriver.storagerouter, username='root')
-        vdisk_info = {}
-        try:
-            for vdisk_number in xrange(disk_amount):
-                vdisk_name = '{0}{1}-fuse'.format(cls.PREFIX, vdisk_number)
-                disk_location = "/mnt/{0}/{1}.raw".format(vpool.name, vdisk_name)
-                logger.info("Truncating vdisk {0} on {1}:{2}".format(vdisk_name, storagedriver.storage_ip, vpool.name))
-                client.run(["truncate", "-s", str(cls.VDISK_SIZE), disk_location])
-                vdisk = cls._get_vdisk('{0}.raw'.format(vdisk_name), vpool.name)
-                vdisk_info[disk_location] = vdisk
-            fio_configuration = {'io_size': write_amount, 'configuration': (0, 100)}
-            DataWriter.write_data_fio(client, fio_configuration, file_locations=vdisk_info.keys(), screen=False, loop_screen=False)
-            fio_configuration = {'io_size': write_amount, 'configuration': (100, 0)}
-            DataWriter.write_data_fio(client, fio_configuration, file_locations=vdisk_info.keys(), screen=False, loop_screen=False)
-        except Exception as ex:
-            logger.error('An exception occur while testing edge+blktap: {0}'.format(str(ex)))
-            raise
-        finally:
+        sweep = ParameterSweep(configurations=cls.DATA_TEST_CASES, block_sizes=cls.SWEEP_BLOCK_SIZES,
+                               iodepths=cls.SWEEP_IODEPTHS, vdisk_amounts=[1, disk_amount])
+
+        def _setup(vdisk_amount):
+            vdisk_info = {}
+            try:
+                for vdisk_number in xrange(vdisk_amount):
+                    vdisk_name = '{0}{1}-fuse'.format(cls.PREFIX, vdisk_number)
+                    disk_location = "/mnt/{0}/{1}.raw".format(vpool.name, vdisk_name)
+                    logger.info("Truncating vdisk {0} on {1}:{2}".format(vdisk_name, storagedriver.storage_ip, vpool.name))
+                    client.run(["truncate", "-s", str(cls.VDISK_SIZE), disk_location])
+                    vdisk = cls._get_vdisk('{0}.raw'.format(vdisk_name), vpool.name)
+                    vdisk_info[disk_location] = vdisk
+            except Exception:
+                _teardown(vdisk_info)
+                raise
+            return vdisk_info
+
+        def _run_cell(vdisk_info, cell):
+            _, _, fio_result = DataWriter.write_data_fio(client, ParameterSweep.get_fio_configuration(cell, write_amount), file_locations=vdisk_info.keys(),
+                                                         screen=False, loop_screen=False, fetch_results=True)
+            if fio_result is None:
+                return None
+            if len(fio_result.errors) > 0:
+                raise RuntimeError('Fio reported errors for jobs {0}'.format(', '.join(job.name for job in fio_result.errors)))
+            return fio_result.get_summary()
+
+        def _teardown(vdisk_info):
             for vdisk in vdisk_info.values():
                 VDiskRemover.remove_vdisk_by_name(vdisk.devicename, vdisk.vpool.name)
 
+        sweep.run(setup=_setup, run_cell=_run_cell, teardown=_teardown)
+        matrix = sweep.format_matrix()
+        logger.info('Results of the FUSE sweep:\n{0}'.format(matrix))
+        if len(sweep.get_failed()) > 0:
+            raise RuntimeError('Fio on FUSE failed for {0} out of {1} cells:\n{2}\n{3}'.format(len(sweep.get_failed()), len(sweep.results), matrix,
+                                                                                          '\n'.join(result['errors'] for result in sweep.get_failed())))
+        return matrix
+
     @staticmethod
     def _get_vdisk(vdisk_name, vpool_name, timeout=60, logger=LOGGER):
         """
@@ -0,0 +1,456 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+OVS autotest scenario scheduler
+"""
+import os
+import sys
+import json
+import time
+import signal
+import heapq
+import importlib
+import traceback
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from ci.api_lib.helpers.testrailapi import TestrailResult
+from ovs.extensions.generic.logger import Logger
+
+
+class ScenarioTimeoutError(Exception):
+    """
+    Raised within a scenario when it exceeded its TIMEOUT
+    """
+    pass
+
+
+def _raise_timeout(signum, frame):
+    """
+    SIGTERM handler of the worker processes. Raises within the scenario, so it can report its failure and clean up
+    """
+    _ = signum, frame
+    raise ScenarioTimeoutError('Scenario exceeded its timeout and was terminated')
+
+
+def _execute_scenario(test, blocked, connection):
+    """
+    Imports and runs a single scenario. Executed within a worker process
+    :param test: name of the scenario (e.g. ci.scenarios.arakoon.ar_0002_arakoon_cluster_validation_test)
+    :type test: str
+    :param blocked: was the test blocked by other test?
+    :type blocked: bool
+    :param connection: pipe to send the outcome of the scenario over
+    :type connection: multiprocessing.connection.Connection
+    :return: None
+    :rtype: NoneType
+    """
+    signal.signal(signal.SIGTERM, _raise_timeout)
+    try:
+        try:
+            mod = importlib.import_module('{0}.main'.format(test))
+        except Exception:
+            connection.send({'error': 'Unable to import test {0}: \n {1}'.format(test, traceback.format_exc())})
+            return
+        connection.send({'result': mod.run(blocked)})
+    except Exception:
+        connection.send({'error': 'Test {0} raised an unhandled exception: \n {1}'.format(test, traceback.format_exc())})
+    finally:
+        connection.close()
+
+
+class ScenarioScheduler(object):
+    """
+    Runs scenarios concurrently, each within its own worker process
+    A scenario that exceeds its TIMEOUT is terminated. It gets KILL_TIMEOUT seconds to report its failure before it is killed
+    Every scenario package can declare metadata within its __init__.py:
+        RESOURCES = ['vpool', 'hypervisor']  # Resources locked while running
+        PREREQUISITES = ['ci.scenarios.installation.services_check_test']  # Scenarios that have to pass first
+        EXPECTED_DURATION = 30 * 60  # Expected wall time in seconds
+        TIMEOUT = 2 * 60 * 60  # Wall time in seconds after which the scenario is terminated
+    Scenarios that share a resource will never run at the same time. Scenarios that do not declare any resources
+    lock the whole cluster, as nothing is known about what they touch
+    """
+    logger = Logger("autotests-ci_scheduler")
+
+    EXCLUSIVE_RESOURCE = 'cluster'  # Locks all other resources
+    DEFAULT_RESOURCES = [EXCLUSIVE_RESOURCE]
+    DEFAULT_DURATION = 5 * 60  # In seconds
+    DEFAULT_TIMEOUT = 2 * 60 * 60  # In seconds
+    KILL_TIMEOUT = 2 * 60  # Seconds a terminated scenario gets to report its failure before it is killed
+    POLL_INTERVAL = 1  # In seconds
+    ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Directory containing the ci package
+
+    _metadata_cache = {}
+
+    def __init__(self, tests, processes, fail_on_failed_scenario=False):
+        """
+        :param tests: scenarios to run, in order of preference (see order_by_critical_path)
+        :type tests: list[str]
+        :param processes: maximum amount of scenarios to run at the same time
+        :type processes: int
+        :param fail_on_failed_scenario: the run will block all other tests if one scenario would fail
+        :type fail_on_failed_scenario: bool
+        """
+        if processes < 1:
+            raise ValueError('At least one process is required to run scenarios, got {0}'.format(processes))
+        self.tests = tests
+        self.processes = processes
+        self.fail_on_failed_scenario = fail_on_failed_scenario
+        self.blocked = False
+        self.results = {}
+        self.error_messages = []
+        self._finished = set()
+        self._running = {}  # test name -> (process, connection, resources, start time)
+        self._terminated = {}  # test name -> time the scenario was terminated
+
+    @classmethod
+    def get_metadata(cls, test):
+        """
+        Retrieve the metadata of a scenario. Only the package is imported, not the scenario itself
+        :param test: name of the scenario
+        :type test: str
+        :return: resources locked by the scenario, its prerequisites, its expected duration and its timeout
+        :rtype: dict
+        """
+        if test not in cls._metadata_cache:
+            package = importlib.import_module(test)
+            metadata = {'resources': getattr(package, 'RESOURCES', cls.DEFAULT_RESOURCES),
+                        'prerequisites': getattr(package, 'PREREQUISITES', []),
+                        'expected_duration': getattr(package, 'EXPECTED_DURATION', cls.DEFAULT_DURATION),
+                        'timeout': getattr(package, 'TIMEOUT', cls.DEFAULT_TIMEOUT)}
+            for key in ['resources', 'prerequisites']:
+                if not isinstance(metadata[key], (list, tuple, set)):
+                    raise TypeError('{0} of {1} is of type {2}, expected a list'.format(key.upper(), test, type(metadata[key])))
+            metadata['resources'] = set(metadata['resources'])
+            cls._metadata_cache[test] = metadata
+        return cls._metadata_cache[test]
+
+    @classmethod
+    def get_resources(cls, test):
+        """
+        Retrieve the resources a scenario locks
+        :param test: name of the scenario
+        :type test: str
+        :return: resources locked by the scenario
+        :rtype: set
+        """
+        return cls.get_metadata(test)['resources']
+
+    @classmethod
+    def order_by_critical_path(cls, tests, durations=None):
+        """
+        Order scenarios so that the ones on the longest chain of prerequisites and expected durations come first
+        The order respects the prerequisites: a scenario is always listed after the prerequisites it shares with the selection
+        Scenarios of which the metadata cannot be loaded are listed last, so their import error surfaces when executed
+        :param tests: scenarios to order
+        :type tests: list[str]
+        :param durations: measured durations per scenario, take precedence over the declared EXPECTED_DURATION
+        :type durations: dict
+        :return: ordered scenarios
+        :rtype: list[str]
+        """
+        if durations is None:
+            durations = {}
+        selected = []
+        unknown = []
+        for test in tests:
+            try:
+                cls.get_metadata(test)
+                selected.append(test)
+            except Exception:
+                cls.logger.exception('Unable to load the metadata of test {0}'.format(test))
+                unknown.append(test)
+        dependents = dict((test, []) for test in selected)
+        in_degree = dict((test, 0) for test in selected)
+        for test in selected:
+            for prerequisite in cls.get_metadata(test)['prerequisites']:
+                if prerequisite in dependents:  # Prerequisites that were not selected are not waited for
+                    dependents[prerequisite].append(test)
+                    in_degree[test] += 1
+        # Rank = expected duration of the scenario + the longest chain of scenarios depending on it
+        ranks = {}
+
+        def _rank(current, path):
+            if current in path:
+                raise ValueError('Circular prerequisites detected: {0}'.format(' -> '.join(path + [current])))
+            if current not in ranks:
+                longest_chain = max([_rank(dependent, path + [current]) for dependent in dependents[current]] or [0])
+                ranks[current] = durations.get(current, cls.get_metadata(current)['expected_duration']) + longest_chain
+            return ranks[current]
+
+        # Topological sort, always picking the available scenario with the highest rank. Index keeps the sort stable
+        available = [(-_rank(test, []), index, test) for index, test in enumerate(selected) if in_degree[test] == 0]
+        heapq.heapify(available)
+        ordered = []
+        while len(available) > 0:
+            _, _, test = heapq.heappop(available)
+            ordered.append(test)
+            for dependent in dependents[test]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    heapq.heappush(available, (-_rank(dependent, []), selected.index(dependent), dependent))
+        if len(ordered) != len(selected):
+            raise ValueError('Circular prerequisites detected between: {0}'.format(', '.join(sorted(set(selected) - set(ordered)))))
+        return ordered + unknown
+
+    @classmethod
+    def prerequisites_passed(cls, test, tests, results):
+        """
+        Verify that all selected prerequisites of a scenario have passed
+        :param test: name of the scenario
+        :type test: str
+        :param tests: all selected scenarios
+        :type tests: list[str]
+        :param results: results of the scenarios that already ran
+        :type results: dict
+        :return: True when every selected prerequisite passed
+        :rtype: bool
+        """
+        for prerequisite in cls.get_metadata(test)['prerequisites']:
+            if prerequisite not in tests:
+                continue
+            if results.get(prerequisite, {}).get('status') != 'PASSED':
+                return False
+        return True
+
+    @classmethod
+    def preflight(cls, tests, processes):
+        """
+        Import all scenarios up front, in parallel, to report broken scenarios before any test starts
+        Each scenario is imported within a new interpreter (see ci.preflight), so its import time is not skewed by previously imported modules
+        :param tests: scenarios to import
+        :type tests: list[str]
+        :param processes: amount of scenarios to import at the same time
+        :type processes: int
+        :return: importable scenarios in their original order, error messages of the broken ones
+        :rtype: tuple(list[str], list[str])
+        """
+        pool = ThreadPool(processes=max(1, min(processes, len(tests))))
+        try:
+            outcomes = pool.map(cls._preflight_scenario, tests, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        error_messages = []
+        broken = set()
+        for outcome in sorted(outcomes, key=lambda item: item['duration'], reverse=True):
+            if outcome['error'] is not None:
+                cls.logger.error(outcome['error'])
+                error_messages.append(outcome['error'])
+                broken.add(outcome['test'])
+                continue
+            cls.logger.info('Imported {0} in {1:.3f}s. Slowest modules (self, cumulative): {2}'.format(
+                outcome['test'], outcome['duration'], ', '.join('{0} ({1:.3f}s, {2:.3f}s)'.format(*timing) for timing in outcome['modules'])))
+        return [test for test in tests if test not in broken], error_messages
+
+    @classmethod
+    def _preflight_scenario(cls, test):
+        """
+        Import a scenario within a new interpreter
+        :param test: name of the scenario
+        :type test: str
+        :return: outcome of the import: {'test': ..., 'duration': ..., 'modules': ..., 'error': None}
+        :rtype: dict
+        """
+        environment = os.environ.copy()
+        environment['PYTHONPATH'] = os.pathsep.join([cls.ROOT] + [path for path in environment.get('PYTHONPATH', '').split(os.pathsep) if path])
+        process = subprocess.Popen([sys.executable, '-m', 'ci.preflight', test], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+        stdout, stderr = process.communicate()
+        try:
+            return json.loads(stdout.splitlines()[-1])
+        except (IndexError, ValueError):
+            return {'test': test, 'duration': 0, 'modules': [],
+                    'error': 'Unable to import test {0}: the interpreter exited with code {1}: \n {2}'.format(test, process.returncode, stderr)}
+
+    @staticmethod
+    def evaluate_result(test, module_result, fail_on_failed_scenario):
+        """
+        Evaluate the result of a scenario
+        :param test: name of the scenario
+        :type test: str
+        :param module_result: result returned by the scenario
+        :type module_result: dict
+        :param fail_on_failed_scenario: the run will block all other tests if one scenario would fail
+        :type fail_on_failed_scenario: bool
+        :return: whether all other tests should be blocked, error message when the result could not be interpreted
+        :rtype: tuple(bool, str)
+        """
+        if not hasattr(TestrailResult, module_result['status']):
+            return False, 'Test {0} returned attribute `{1}` which does not exists as status in TestrailResult'.format(test, module_result['status'])
+        if getattr(TestrailResult, module_result['status']) == TestrailResult.FAILED and fail_on_failed_scenario:
+            # A failed test blocks all others by default, unless it explicitly reports blocking = False
+            return module_result.get('blocking') is not False, None
+        return False, None
+
+    def run(self):
+        """
+        Run all scenarios. Blocks until every scenario has reported back
+        Scenarios that are started after a blocking failure are executed with blocked=True
+        :return: results of the scenarios, error messages
+        :rtype: tuple(dict, list[str])
+        """
+        pending = self.tests[:]
+        locked = set()
+        while len(pending) > 0 or len(self._running) > 0:
+            for test in pending[:]:
+                if len(self._running) >= self.processes:
+                    break
+                try:
+                    resources = self.get_resources(test)
+                except Exception:
+                    pending.remove(test)
+                    self._finished.add(test)  # Its dependents start blocked instead of waiting for it
+                    message = 'Unable to import test {0}'.format(test)
+                    self.logger.exception(message)
+                    self.error_messages.append('{0}: \n {1}'.format(message, traceback.format_exc()))
+                    continue
+                if not self._can_lock(resources, locked):
+                    continue
+                if not self._can_start(test):
+                    continue
+                pending.remove(test)
+                locked.update(resources)
+                self._start(test, resources)
+            if len(self._running) == 0 and len(pending) > 0:
+                # Nothing runs, so every resource was free: the remaining scenarios can only be waiting on each other
+                for test in pending:
+                    message = 'Test {0} could not start: its prerequisites {1} never finished'.format(
+                        test, ', '.join(sorted(set(self.get_metadata(test)['prerequisites']) & set(pending))))
+                    self.logger.error(message)
+                    self.error_messages.append(message)
+                self._finished.update(pending)
+                pending = []
+            for test in self._collect():
+                locked.difference_update(self._running.pop(test)[2])
+                self._finished.add(test)
+            time.sleep(self.POLL_INTERVAL)
+        return self.results, self.error_messages
+
+    def _can_lock(self, resources, locked):
+        """
+        Check if the given resources can be locked
+        :param resources: resources to lock
+        :type resources: set
+        :param locked: resources currently locked
+        :type locked: set
+        :return: True if none of the resources are currently in use
+        :rtype: bool
+        """
+        if self.EXCLUSIVE_RESOURCE in locked:
+            return False
+        if self.EXCLUSIVE_RESOURCE in resources:
+            return len(self._running) == 0
+        return len(resources & locked) == 0
+
+    def _can_start(self, test):
+        """
+        Check if all selected prerequisites of a scenario have finished
+        :param test: name of the scenario
+        :type test: str
+        :return: True if the scenario no longer has to wait on other scenarios
+        :rtype: bool
+        """
+        prerequisites = set(self.get_metadata(test)['prerequisites']) & set(self.tests)
+        return prerequisites.issubset(self._finished)
+
+    def _start(self, test, resources):
+        """
+        Start a scenario within a new worker process
+        :param test: name of the scenario
+        :type test: str
+        :param resources: resources locked by the scenario
+        :type resources: set
+        :return: None
+        :rtype: NoneType
+        """
+        blocked = self.blocked or not self.prerequisites_passed(test, self.tests, self.results)
+        self.logger.info('\n{:=^100}\n'.format(test))
+        self.logger.info('Starting {0} locking {1}. Blocked: {2}'.format(test, ', '.join(sorted(resources)) or 'nothing', blocked))
+        parent_connection, child_connection = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=_execute_scenario, name=test, args=(test, blocked, child_connection))
+        process.start()
+        child_connection.close()  # Only the worker writes to the pipe
+        self._running[test] = (process, parent_connection, resources, time.time())
+
+    def _collect(self):
+        """
+        Collect the outcome of all finished scenarios
+        :return: names of the scenarios that finished
+        :rtype: list[str]
+        """
+        finished = []
+        for test, (process, connection, _, start) in self._running.iteritems():
+            if connection.poll():
+                try:
+                    outcome = connection.recv()
+                except EOFError:
+                    outcome = None
+            elif not process.is_alive():
+                outcome = None
+            else:
+                self._watch(test, process, start)
+                continue
+            process.join()
+            if outcome is None:
+                if test in self._terminated:
+                    # Killed before it could report: report the failure on its behalf. A hung scenario blocks like any other failure
+                    outcome = {'result': {'status': 'FAILED', 'case_type': None, 'blocking': True, 'duration': time.time() - start,
+                                          'errors': 'Test {0} exceeded its timeout and was killed'.format(test)}}
+                else:
+                    outcome = {'error': 'Test {0} exited with code {1} without reporting a result'.format(test, process.exitcode)}
+            self._terminated.pop(test, None)
+            connection.close()
+            finished.append(test)
+            if 'error' in outcome:
+                self.logger.error(outcome['error'])
+                self.error_messages.append(outcome['error'])
+                continue
+            module_result = outcome['result']
+            blocks, error_message = self.evaluate_result(test, module_result, self.fail_on_failed_scenario)
+            if error_message is not None:
+                self.error_messages.append(error_message)
+            self.blocked = self.blocked or blocks
+            self.results[test] = module_result
+            self.logger.info('Test {0} finished with status {1}'.format(test, module_result['status']))
+        return finished
+
+    def _watch(self, test, process, start):
+        """
+        Terminate a running scenario that exceeded its timeout and kill it when it does not stop in time
+        :param test: name of the scenario
+        :type test: str
+        :param process: worker process of the scenario
+        :type process: multiprocessing.Process
+        :param start: time the scenario was started
+        :type start: float
+        :return: None
+        :rtype: NoneType
+        """
+        now = time.time()
+        if test not in self._terminated:
+            timeout = self.get_metadata(test)['timeout']
+            if timeout is not None and now - start > timeout:
+                self.logger.error('Test {0} exceeded its timeout of {1}s, terminating it'.format(test, timeout))
+                self._terminated[test] = now
+                process.terminate()  # SIGTERM: raises ScenarioTimeoutError within the scenario
+        elif now - self._terminated[test] > self.KILL_TIMEOUT:
+            self.logger.error('Test {0} did not stop within {1}s after being terminated, killing it'.format(test, self.KILL_TIMEOUT))
+            try:
+                os.kill(process.pid, signal.SIGKILL)
+            except OSError:
+                pass  # Already gone
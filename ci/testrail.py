@@ -0,0 +1,272 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Bulk Testrail lib
+"""
+import json
+import requests
+import threading
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from ci.api_lib.helpers.exceptions import SectionNotFoundError
+from ovs.extensions.generic.logger import Logger
+
+
+class TestrailSession(object):
+    """
+    Pooled HTTP session towards the Testrail API v2
+    Exposes the list and bulk endpoints, so pushing results requires a fixed amount of calls instead of several per result
+    """
+    logger = Logger("autotests-ci_testrail")
+
+    API_PATH = '/index.php?/api/v2/'
+    THREADS = 8  # Concurrent calls for endpoints that have no bulk alternative
+    TIMEOUT = 60  # In seconds
+
+    def __init__(self, url, key=None, username=None, password=None, threads=THREADS):
+        """
+        :param url: url or hostname of the Testrail server. Https is assumed when no scheme is given
+        :type url: str
+        :param key: base64 encoded credentials, as used by TestrailApi
+        :type key: str
+        :param username: username to authenticate with, when no key is provided
+        :type username: str
+        :param password: password to authenticate with, when no key is provided
+        :type password: str
+        :param threads: amount of concurrent calls
+        :type threads: int
+        """
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://{0}'.format(url)
+        self.base_url = url.rstrip('/') + self.API_PATH
+        self.threads = threads
+        self.call_count = 0
+        self._call_count_lock = threading.Lock()  # Calls are made from the threads of add_cases
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=threads)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if key is not None:
+            self.session.headers.update({'Authorization': 'Basic {0}'.format(key)})
+        else:
+            self.session.auth = (username, password)
+
+    def _request(self, method, uri, data=None):
+        """
+        Execute a call towards the API
+        :param method: HTTP method
+        :type method: str
+        :param uri: API uri (e.g. get_cases/1&suite_id=2)
+        :type uri: str
+        :param data: body to send along
+        :type data: dict
+        :return: decoded response
+        :rtype: dict / list
+        """
+        with self._call_count_lock:
+            self.call_count += 1
+        response = self.session.request(method, self.base_url + uri, data=json.dumps(data) if data is not None else None, timeout=self.TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError('Testrail call {0} {1} failed with status {2}: {3}'.format(method, uri, response.status_code, response.text))
+        return response.json() if response.content else None
+
+    def _get_list(self, uri, key):
+        """
+        Retrieve all items of a list endpoint. Follows the pagination of newer Testrail versions
+        :param uri: API uri
+        :type uri: str
+        :param key: key under which paginated responses list their items
+        :type key: str
+        :return: all items
+        :rtype: list
+        """
+        items = []
+        while uri is not None:
+            response = self._request('GET', uri)
+            if isinstance(response, list):  # Unpaginated response
+                return response
+            items.extend(response[key])
+            next_link = (response.get('_links') or {}).get('next')
+            uri = next_link.split('/api/v2/', 1)[1] if next_link else None
+        return items
+
+    def get_sections(self, project_id, suite_id):
+        """
+        :return: all sections of a suite
+        :rtype: list[dict]
+        """
+        return self._get_list('get_sections/{0}&suite_id={1}'.format(project_id, suite_id), 'sections')
+
+    def get_cases(self, project_id, suite_id):
+        """
+        :return: all cases of a suite
+        :rtype: list[dict]
+        """
+        return self._get_list('get_cases/{0}&suite_id={1}'.format(project_id, suite_id), 'cases')
+
+    def add_case(self, section_id, title, type_id):
+        """
+        :return: the created case
+        :rtype: dict
+        """
+        return self._request('POST', 'add_case/{0}'.format(section_id), {'title': title, 'type_id': type_id})
+
+    def add_cases(self, cases):
+        """
+        Add multiple cases concurrently, Testrail has no bulk endpoint for cases
+        :param cases: cases to add (e.g. [{'section_id': 1, 'title': 'my_test', 'type_id': 2}])
+        :type cases: list[dict]
+        :return: the created cases, in the same order
+        :rtype: list[dict]
+        """
+        if len(cases) == 0:
+            return []
+        pool = ThreadPool(processes=min(self.threads, len(cases)))
+        try:
+            return pool.map(lambda case: self.add_case(**case), cases)
+        finally:
+            pool.close()
+            pool.join()
+
+    def add_results_for_cases(self, run_id, results):
+        """
+        Add results to multiple cases of a run in one call
+        :param run_id: ID of the run
+        :type run_id: int
+        :param results: results to add (e.g. [{'case_id': 1, 'status_id': 5, 'comment': 'Stack trace'}])
+        :type results: list[dict]
+        :return: the created results
+        :rtype: list[dict]
+        """
+        if len(results) == 0:
+            return []
+        return self._request('POST', 'add_results_for_cases/{0}'.format(run_id), {'results': results})
+
+
+class TestrailIndex(object):
+    """
+    Memoizing name -> id index around TestrailApi
+    Sections and cases are fetched once per project & suite and looked up in memory afterwards
+    Every other call is passed on to the wrapped TestrailApi instance
+    """
+    def __init__(self, client, session):
+        """
+        :param client: Testrail client to wrap
+        :type client: ci.api_lib.helpers.testrailapi.TestrailApi
+        :param session: session used to fetch the lists and to add cases
+        :type session: TestrailSession
+        """
+        self.client = client
+        self.session = session
+        self._sections = {}  # (project_id, suite_id) -> {name: section}
+        self._cases = {}  # (project_id, suite_id) -> {(section_id, title): case}
+        self._section_suites = {}  # section_id -> (project_id, suite_id)
+        self._case_types = {}  # name -> case type
+
+    def __getattr__(self, item):
+        return getattr(self.client, item)
+
+    def _get_sections(self, project_id, suite_id):
+        key = (project_id, suite_id)
+        if key not in self._sections:
+            self._sections[key] = {}
+            for section in self.session.get_sections(project_id, suite_id):
+                self._sections[key][section['name']] = section
+                self._section_suites[section['id']] = key
+        return self._sections[key]
+
+    def _get_cases(self, project_id, suite_id):
+        key = (project_id, suite_id)
+        if key not in self._cases:
+            self._cases[key] = {}
+            for case in self.session.get_cases(project_id, suite_id):
+                self._cases[key].setdefault((case['section_id'], case['title']), case)
+                self._cases[key].setdefault((None, case['title']), case)  # First match when no section is given
+        return self._cases[key]
+
+    def get_section_by_name(self, project_id, suite_id, name):
+        """
+        :return: the section with the given name
+        :rtype: dict
+        """
+        sections = self._get_sections(project_id, suite_id)
+        if name not in sections:
+            raise SectionNotFoundError('Section `{0}` does not exist in suite {1} of project {2}'.format(name, suite_id, project_id))
+        return sections[name]
+
+    def get_case_by_name(self, project_id, suite_id, name, section_id=None):
+        """
+        :return: the case with the given name, optionally within the given section
+        :rtype: dict
+        """
+        cases = self._get_cases(project_id, suite_id)
+        if (section_id, name) not in cases:
+            raise KeyError('Case `{0}` does not exist in suite {1} of project {2}'.format(name, suite_id, project_id))
+        return cases[(section_id, name)]
+
+    def get_case_ids(self, project_id, suite_id):
+        """
+        :return: IDs of all cases within the suite
+        :rtype: list[int]
+        """
+        return sorted(set(case['id'] for case in self._get_cases(project_id, suite_id).itervalues()))
+
+    def get_case_type_by_name(self, name):
+        """
+        :return: the case type with the given name
+        :rtype: dict
+        """
+        if name not in self._case_types:
+            self._case_types[name] = self.client.get_case_type_by_name(name)
+        return self._case_types[name]
+
+    def add_case(self, section_id, title, type_id):
+        """
+        Add a case and invalidate the cases of its suite
+        :return: the created case
+        :rtype: dict
+        """
+        return self.add_cases([{'section_id': section_id, 'title': title, 'type_id': type_id}])[0]
+
+    def add_cases(self, cases):
+        """
+        Add multiple cases concurrently and invalidate the cases of their suites
+        :param cases: cases to add (e.g. [{'section_id': 1, 'title': 'my_test', 'type_id': 2}])
+        :type cases: list[dict]
+        :return: the created cases, in the same order
+        :rtype: list[dict]
+        """
+        try:
+            return self.session.add_cases(cases)
+        finally:
+            for case in cases:
+                if case['section_id'] in self._section_suites:
+                    self.invalidate(*self._section_suites[case['section_id']])
+                else:
+                    self.invalidate()
+
+    def invalidate(self, project_id=None, suite_id=None):
+        """
+        Drop the cached cases of the given suite, or of all suites when none is given
+        :return: None
+        :rtype: NoneType
+        """
+        if project_id is None and suite_id is None:
+            self._cases.clear()
+        else:
+            self._cases.pop((project_id, suite_id), None)
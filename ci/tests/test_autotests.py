@@ -0,0 +1,90 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Result gathering test module
+"""
+import logging
+import unittest
+import ci.autotests
+from ci.autotests import PhaseTimer, gather_results
+
+
+class _LogCollector(object):
+    @staticmethod
+    def collect_logs(*args, **kwargs):
+        return 'Collected logs'
+
+
+class GatherResultsTest(unittest.TestCase):
+    """
+    Running a decorated scenario main across a parameter matrix
+    """
+    def setUp(self):
+        self._original_collector = ci.autotests.LogCollector
+        ci.autotests.LogCollector = _LogCollector
+        self.calls = []
+
+        @gather_results('FUNCTIONAL', logging.getLogger('test_autotests'), 'matrix_test')
+        def main(blocked, configuration=None, vdisk_amount=1):
+            _ = blocked
+            self.calls.append((configuration, vdisk_amount))
+            with PhaseTimer.phase('io'):
+                if configuration == (100, 0) and vdisk_amount == 2:
+                    raise RuntimeError('Reading failed')
+
+        self.main = main
+
+    def tearDown(self):
+        ci.autotests.LogCollector = self._original_collector
+
+    def test_matrix(self):
+        """
+        Every combination runs once, a failing cell fails the whole result but not the other cells
+        """
+        result = self.main.run_matrix({'configuration': [(0, 100), (100, 0)], 'vdisk_amount': [1, 2]}, False)
+        self.assertEqual(self.calls, [((0, 100), 1), ((0, 100), 2), ((100, 0), 1), ((100, 0), 2)])
+        self.assertEqual(result['status'], 'FAILED')
+        self.assertFalse(result['blocking'])
+        self.assertEqual([cell['status'] for cell in result['cells']], ['PASSED', 'PASSED', 'PASSED', 'FAILED'])
+        self.assertEqual(result['cells'][3]['parameters'], {'configuration': (100, 0), 'vdisk_amount': 2})
+        self.assertIn('in phase io', result['cells'][3]['errors'])
+        self.assertTrue(result['errors'].startswith('{0}: '.format(result['cells'][3]['parameters'])))
+        self.assertAlmostEqual(result['timings']['io'], sum(cell['timings']['io'] for cell in result['cells']))
+        self.assertTrue(all('duration' in cell for cell in result['cells']))
+
+    def test_matrix_cells(self):
+        """
+        A list of cells is run as given
+        """
+        result = self.main.run_matrix([{'configuration': (0, 100)}, {'configuration': (30, 70), 'vdisk_amount': 3}], blocked=False)
+        self.assertEqual(self.calls, [((0, 100), 1), ((30, 70), 3)])
+        self.assertEqual(result['status'], 'PASSED')
+        self.assertIsNone(result['errors'])
+        self.assertNotIn('blocking', result)
+
+    def test_matrix_blocked(self):
+        """
+        A blocked test does not run any cell
+        """
+        result = self.main.run_matrix({'configuration': [(0, 100), (100, 0)]}, True)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(result['status'], 'BLOCKED')
+        self.assertEqual(result['cells'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
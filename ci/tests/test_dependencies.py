@@ -0,0 +1,113 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Dependencies test module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from ci.dependencies import ScenarioDependencies
+
+
+class ScenarioDependenciesTest(unittest.TestCase):
+    """
+    Static analysis of the helpers a scenario depends on, within a temporary tree
+    """
+    SOURCES = {'ci/__init__.py': '',
+               'ci/scenario_helpers/__init__.py': '',
+               'ci/scenario_helpers/direct.py': 'import os\nfrom ci.scenario_helpers import indirect\n',
+               'ci/scenario_helpers/indirect.py': 'from .relative import RelativeHelper\n',
+               'ci/scenario_helpers/relative.py': 'class RelativeHelper(object):\n    pass\n',
+               'ci/scenario_helpers/unused.py': '',
+               'ci/scenario_helpers/broken.py': 'def broken(:\n',
+               'ci/scenarios/__init__.py': '',
+               'ci/scenarios/vDisk/__init__.py': '',
+               'ci/scenarios/vDisk/using_helpers/__init__.py': '',
+               'ci/scenarios/vDisk/using_helpers/main.py': ('from ci.api_lib.helpers.vdisk import VDiskHelper\n'
+                                                            'from ci.scenario_helpers.direct import DirectHelper\n'
+                                                            'import ci.scenario_helpers.broken\n'),
+               'ci/scenarios/vDisk/standalone/__init__.py': '',
+               'ci/scenarios/vDisk/standalone/main.py': 'import json\n'}
+
+    def setUp(self):
+        self._directory = os.path.realpath(tempfile.mkdtemp())
+        for relative_path, source in self.SOURCES.iteritems():
+            path = os.path.join(self._directory, relative_path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as source_file:
+                source_file.write(source)
+        self._original_root = ScenarioDependencies.ROOT
+        self._original_cache = ScenarioDependencies._imports_cache
+        ScenarioDependencies.ROOT = self._directory
+        ScenarioDependencies._imports_cache = {}
+
+    def tearDown(self):
+        ScenarioDependencies.ROOT = self._original_root
+        ScenarioDependencies._imports_cache = self._original_cache
+        shutil.rmtree(self._directory)
+
+    def _get_paths(self, *relative_paths):
+        return set(os.path.join(self._directory, relative_path) for relative_path in relative_paths)
+
+    def test_get_imports(self):
+        """
+        Only tracked modules are returned, together with the __init__ of their packages. Relative imports are resolved
+        """
+        self.assertEqual(ScenarioDependencies.get_imports(os.path.join(self._directory, 'ci/scenario_helpers/direct.py')),
+                         self._get_paths('ci/scenario_helpers/__init__.py', 'ci/scenario_helpers/indirect.py'))
+        self.assertEqual(ScenarioDependencies.get_imports(os.path.join(self._directory, 'ci/scenario_helpers/indirect.py')),
+                         self._get_paths('ci/scenario_helpers/__init__.py', 'ci/scenario_helpers/relative.py'))
+
+    def test_get_dependencies(self):
+        """
+        Imports are followed through other helpers. Files that cannot be parsed are still a dependency
+        """
+        self.assertEqual(ScenarioDependencies.get_dependencies('ci.scenarios.vDisk.using_helpers'),
+                         self._get_paths('ci/scenarios/vDisk/using_helpers/__init__.py', 'ci/scenarios/vDisk/using_helpers/main.py',
+                                         'ci/scenario_helpers/__init__.py', 'ci/scenario_helpers/direct.py', 'ci/scenario_helpers/indirect.py',
+                                         'ci/scenario_helpers/relative.py', 'ci/scenario_helpers/broken.py'))
+        self.assertEqual(ScenarioDependencies.get_dependencies('ci.scenarios.vDisk.standalone'),
+                         self._get_paths('ci/scenarios/vDisk/standalone/__init__.py', 'ci/scenarios/vDisk/standalone/main.py'))
+
+    def test_select_changed(self):
+        """
+        Scenarios are selected when their own files or the helpers they depend on changed since the revision
+        """
+        tests = ['ci.scenarios.vDisk.using_helpers', 'ci.scenarios.vDisk.standalone']
+        with open(os.devnull, 'w') as devnull:
+            for command in [['git', 'init', '-q'], ['git', 'add', '.'],
+                            ['git', '-c', 'user.name=ci', '-c', 'user.email=ci@localhost', 'commit', '-q', '-m', 'Initial']]:
+                subprocess.check_call(command, cwd=self._directory, stdout=devnull)
+        self.assertEqual(ScenarioDependencies.select_changed(tests, 'HEAD'), [])
+        with open(os.path.join(self._directory, 'ci/scenario_helpers/unused.py'), 'a') as source_file:
+            source_file.write('UNUSED = True\n')
+        self.assertEqual(ScenarioDependencies.select_changed(tests, 'HEAD'), [])
+        with open(os.path.join(self._directory, 'ci/scenario_helpers/relative.py'), 'a') as source_file:
+            source_file.write('RELATIVE = True\n')
+        self.assertEqual(ScenarioDependencies.select_changed(tests, 'HEAD'), ['ci.scenarios.vDisk.using_helpers'])
+        with open(os.path.join(self._directory, 'ci/scenarios/vDisk/standalone/main.py'), 'a') as source_file:
+            source_file.write('import os\n')
+        self.assertEqual(ScenarioDependencies.select_changed(tests, 'HEAD'), tests)
+        with self.assertRaises(RuntimeError):
+            ScenarioDependencies.select_changed(tests, 'non_existing_revision')
+
+
+if __name__ == '__main__':
+    unittest.main()
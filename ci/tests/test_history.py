@@ -0,0 +1,115 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+History test module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from ci.history import ScenarioHistory
+from ci.scheduler import ScenarioScheduler
+
+
+class ScenarioHistoryTest(unittest.TestCase):
+    """
+    Expected durations, reruns and sharding based on the history
+    """
+    DURATIONS = {'a': 100, 'b': 90, 'c': 50, 'd': 40, 'e': 30, 'f': 20}
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._original_cache = ScenarioScheduler._metadata_cache
+        ScenarioScheduler._metadata_cache = {}
+        for test in self.DURATIONS:
+            self._declare(test)
+
+    def tearDown(self):
+        ScenarioScheduler._metadata_cache = self._original_cache
+        shutil.rmtree(self._directory)
+
+    @staticmethod
+    def _declare(test, prerequisites=None, expected_duration=ScenarioScheduler.DEFAULT_DURATION):
+        ScenarioScheduler._metadata_cache[test] = {'resources': set(), 'prerequisites': prerequisites or [],
+                                                   'expected_duration': expected_duration, 'timeout': ScenarioScheduler.DEFAULT_TIMEOUT}
+
+    def _get_shards(self, tests, shard_count, durations):
+        return [ScenarioHistory.shard(tests, shard_index, shard_count, durations=durations) for shard_index in xrange(1, shard_count + 1)]
+
+    def test_durations(self):
+        """
+        The expected duration is the median of the most recent passed or failed executions
+        """
+        history_path = os.path.join(self._directory, 'history.jsonl')
+        for duration in [1000, 10, 20, 30, 40]:
+            ScenarioHistory.record({'a': {'status': 'PASSED', 'duration': duration}, 'b': {'status': 'BLOCKED', 'duration': 0}}, history_path=history_path)
+        with open(history_path, 'a') as history_file:
+            history_file.write('not json\n{"scenario": "c"}\n')
+        self.assertEqual(ScenarioHistory.get_durations(history_path=history_path, window=4), {'a': 25.0})
+        self.assertEqual(ScenarioHistory.get_durations(history_path=history_path), {'a': 30.0})
+        self.assertEqual(ScenarioHistory.get_durations(history_path=os.path.join(self._directory, 'missing.jsonl')), {})
+
+    def test_select_failed(self):
+        """
+        Failed and blocked scenarios are selected, scenarios that were not part of a later run keep their status
+        """
+        last_results_path = os.path.join(self._directory, 'last_results.json')
+        ScenarioHistory.save_last_results({'a': {'status': 'FAILED'}, 'b': {'status': 'BLOCKED'}, 'c': {'status': 'FAILED'}}, last_results_path=last_results_path)
+        ScenarioHistory.save_last_results({'c-exclude': {'status': 'PASSED'}, 'c': {'status': 'PASSED'}}, last_results_path=last_results_path)
+        self.assertEqual(ScenarioHistory.select_failed(['d', 'c', 'b-exclude', 'a'], exclude_flag='-exclude', last_results_path=last_results_path),
+                         ['b-exclude', 'a'])
+
+    def test_shard_balance(self):
+        """
+        Every scenario ends up in exactly one shard, the longest scenarios are handed out to the least loaded shard first
+        """
+        tests = sorted(self.DURATIONS)
+        shards = self._get_shards(tests, 2, self.DURATIONS)
+        self.assertEqual(shards, [['a', 'd', 'e'], ['b', 'c', 'f']])
+        shards = self._get_shards(tests, 4, self.DURATIONS)
+        self.assertEqual(sorted(test for shard in shards for test in shard), tests)
+        self.assertEqual([sum(self.DURATIONS[test] for test in shard) for shard in shards], [100, 90, 70, 70])
+        self.assertEqual(self._get_shards(['a'], 3, self.DURATIONS), [['a'], [], []])
+
+    def test_shard_fallback_durations(self):
+        """
+        Scenarios without history are balanced on their declared expected duration
+        """
+        self._declare('long', expected_duration=500)
+        shards = self._get_shards(['a', 'b', 'long'], 2, {'a': 100, 'b': 90})
+        self.assertEqual(shards, [['long'], ['a', 'b']])
+
+    def test_shard_prerequisites(self):
+        """
+        Scenarios linked through prerequisites, directly or not, stay within the same shard
+        """
+        self._declare('f', prerequisites=['a'])
+        self._declare('e', prerequisites=['f', 'not_selected'])
+        shards = self._get_shards(sorted(self.DURATIONS), 2, self.DURATIONS)
+        self.assertEqual(shards, [['a', 'e', 'f'], ['b', 'c', 'd']])
+
+    def test_shard_index(self):
+        """
+        Only existing shards can be requested
+        """
+        for shard_index, shard_count in [(0, 2), (3, 2), (1, 0)]:
+            with self.assertRaises(ValueError):
+                ScenarioHistory.shard(['a'], shard_index, shard_count, durations={})
+
+
+if __name__ == '__main__':
+    unittest.main()
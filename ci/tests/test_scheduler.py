@@ -0,0 +1,253 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Scheduler test module
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from ci.scheduler import ScenarioScheduler
+
+
+class _SimulatedScheduler(ScenarioScheduler):
+    """
+    Scheduler that simulates the scenarios instead of running them within worker processes
+    Every started scenario finishes on the next poll with the status listed in STATUSES (PASSED by default)
+    """
+    POLL_INTERVAL = 0
+    STATUSES = {}
+
+    def __init__(self, tests, processes):
+        super(_SimulatedScheduler, self).__init__(tests, processes)
+        self.started = []  # (test, blocked) in order of starting
+        self.batches = []  # Scenarios that were running at the same time
+
+    def _start(self, test, resources):
+        self.started.append((test, self.blocked or not self.prerequisites_passed(test, self.tests, self.results)))
+        self._running[test] = (None, None, resources, 0)
+
+    def _collect(self):
+        finished = sorted(self._running)
+        if len(finished) > 0:
+            self.batches.append(finished)
+        for test in finished:
+            self.results[test] = {'status': self.STATUSES.get(test, 'PASSED')}
+        return finished
+
+
+class ScenarioSchedulerTest(unittest.TestCase):
+    """
+    Locking of resources and waiting on prerequisites by the scheduler
+    """
+    BROKEN = 'ci.tests.non_existing_scenario'
+
+    def setUp(self):
+        self._original_cache = ScenarioScheduler._metadata_cache
+        ScenarioScheduler._metadata_cache = {}
+        _SimulatedScheduler.STATUSES = {}
+
+    def tearDown(self):
+        ScenarioScheduler._metadata_cache = self._original_cache
+
+    @staticmethod
+    def _declare(test, resources, prerequisites=None, expected_duration=60):
+        ScenarioScheduler._metadata_cache[test] = {'resources': set(resources),
+                                                   'prerequisites': prerequisites or [],
+                                                   'expected_duration': expected_duration,
+                                                   'timeout': ScenarioScheduler.DEFAULT_TIMEOUT}
+
+    def test_shared_resources(self):
+        """
+        Scenarios sharing a resource never run at the same time, the exclusive resource runs alone
+        """
+        self._declare('vpool_a', ['vpool'])
+        self._declare('vpool_b', ['vpool'])
+        self._declare('backend', ['backend'])
+        self._declare('read_only', [])
+        self._declare('whole_cluster', [ScenarioScheduler.EXCLUSIVE_RESOURCE])
+        scheduler = _SimulatedScheduler(['vpool_a', 'vpool_b', 'backend', 'read_only', 'whole_cluster'], processes=4)
+        results, errors = scheduler.run()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(scheduler.batches, [['backend', 'read_only', 'vpool_a'], ['vpool_b'], ['whole_cluster']])
+
+    def test_processes_limit(self):
+        """
+        No more scenarios run at the same time than the amount of processes
+        """
+        tests = ['test_{0}'.format(index) for index in xrange(5)]
+        for test in tests:
+            self._declare(test, [])
+        scheduler = _SimulatedScheduler(tests, processes=2)
+        scheduler.run()
+        self.assertEqual([len(batch) for batch in scheduler.batches], [2, 2, 1])
+
+    def test_prerequisites(self):
+        """
+        Scenarios wait on their selected prerequisites and start blocked when one of them did not pass
+        """
+        self._declare('install', [])
+        self._declare('failing', [], prerequisites=['install'])
+        self._declare('dependent', [], prerequisites=['failing'])
+        self._declare('unselected_prerequisite', [], prerequisites=['not_selected'])
+        _SimulatedScheduler.STATUSES = {'failing': 'FAILED'}
+        scheduler = _SimulatedScheduler(['dependent', 'failing', 'install', 'unselected_prerequisite'], processes=4)
+        scheduler.run()
+        self.assertEqual(scheduler.batches, [['install', 'unselected_prerequisite'], ['failing'], ['dependent']])
+        self.assertEqual(dict(scheduler.started), {'install': False, 'unselected_prerequisite': False, 'failing': False, 'dependent': True})
+
+    def test_broken_prerequisite(self):
+        """
+        A prerequisite of which the metadata cannot be loaded does not keep its dependents waiting
+        """
+        self._declare('dependent', [], prerequisites=[self.BROKEN])
+        scheduler = _SimulatedScheduler([self.BROKEN, 'dependent'], processes=2)
+        results, errors = scheduler.run()
+        self.assertEqual(scheduler.started, [('dependent', True)])
+        self.assertEqual(sorted(results), ['dependent'])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('Unable to import test {0}'.format(self.BROKEN), errors[0])
+
+    def test_circular_prerequisites(self):
+        """
+        Scenarios waiting on each other are reported instead of waited on forever
+        """
+        self._declare('first', [], prerequisites=['second'])
+        self._declare('second', [], prerequisites=['first'])
+        self._declare('independent', [])
+        scheduler = _SimulatedScheduler(['first', 'second', 'independent'], processes=2)
+        results, errors = scheduler.run()
+        self.assertEqual(sorted(results), ['independent'])
+        self.assertEqual(sorted(errors), ['Test first could not start: its prerequisites second never finished',
+                                          'Test second could not start: its prerequisites first never finished'])
+
+    def test_order_by_critical_path(self):
+        """
+        The longest chain of prerequisites comes first, prerequisites are always listed before their dependents
+        """
+        self._declare('short', [], expected_duration=10)
+        self._declare('chain_start', [], expected_duration=5)
+        self._declare('chain_end', [], prerequisites=['chain_start'], expected_duration=60)
+        self._declare('medium', [], expected_duration=30)
+        ordered = ScenarioScheduler.order_by_critical_path(['short', 'chain_end', 'medium', 'chain_start', self.BROKEN])
+        self.assertEqual(ordered, ['chain_start', 'chain_end', 'medium', 'short', self.BROKEN])
+        self.assertEqual(ScenarioScheduler.order_by_critical_path(['short', 'medium'], durations={'short': 100}), ['short', 'medium'])
+
+    def test_order_circular_prerequisites(self):
+        """
+        Circular prerequisites cannot be ordered
+        """
+        self._declare('first', [], prerequisites=['second'])
+        self._declare('second', [], prerequisites=['first'])
+        with self.assertRaises(ValueError):
+            ScenarioScheduler.order_by_critical_path(['first', 'second'])
+
+
+class PreflightTest(unittest.TestCase):
+    """
+    Importing the scenarios up front
+    """
+    SCENARIOS = {'working': 'import unittest\nprint "Imported"\n',
+                 'broken': 'import non_existing_module\n'}
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._original_path = os.environ.get('PYTHONPATH')
+        os.environ['PYTHONPATH'] = self._directory
+        package = os.path.join(self._directory, 'preflight_scenarios')
+        for name, content in self.SCENARIOS.iteritems():
+            os.makedirs(os.path.join(package, name))
+            for path, source in [(os.path.join(package, '__init__.py'), ''),
+                                 (os.path.join(package, name, '__init__.py'), ''),
+                                 (os.path.join(package, name, 'main.py'), content)]:
+                with open(path, 'w') as source_file:
+                    source_file.write(source)
+
+    def tearDown(self):
+        if self._original_path is None:
+            os.environ.pop('PYTHONPATH')
+        else:
+            os.environ['PYTHONPATH'] = self._original_path
+        shutil.rmtree(self._directory)
+
+    def test_preflight(self):
+        """
+        Broken scenarios are left out. Modules are measured even when they were already imported by the scheduler itself
+        """
+        tests, errors = ScenarioScheduler.preflight(['preflight_scenarios.working', 'preflight_scenarios.broken'], processes=2)
+        self.assertEqual(tests, ['preflight_scenarios.working'])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('No module named non_existing_module', errors[0])
+        outcome = ScenarioScheduler._preflight_scenario('preflight_scenarios.working')
+        self.assertIsNone(outcome['error'])
+        # The unittest package was already imported by this process but still has to be loaded by the scenario
+        self.assertTrue(set(['unittest', 'case', 'loader', 'suite']) & set(name for name, _, _ in outcome['modules']))
+
+
+class _FastScheduler(ScenarioScheduler):
+    """
+    Scheduler that polls and kills quickly
+    """
+    POLL_INTERVAL = 0.05
+    KILL_TIMEOUT = 0.5
+
+
+class TimeoutTest(unittest.TestCase):
+    """
+    Scenarios exceeding their timeout, executed within worker processes
+    """
+    SCENARIOS = {'hanging': ('RESOURCES = []\nTIMEOUT = 0.5\n',
+                             'import time, signal\n\ndef run(blocked=False):\n    signal.signal(signal.SIGTERM, signal.SIG_IGN)\n    time.sleep(60)\n'),
+                 'dependent': ('RESOURCES = []\nPREREQUISITES = ["timeout_scenarios.hanging"]\n',
+                               'def run(blocked=False):\n    return {"status": "BLOCKED" if blocked else "PASSED", "case_type": None, "errors": None}\n')}
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._original_cache = ScenarioScheduler._metadata_cache
+        ScenarioScheduler._metadata_cache = {}
+        sys.path.insert(0, self._directory)
+        package = os.path.join(self._directory, 'timeout_scenarios')
+        for name, (metadata, content) in self.SCENARIOS.iteritems():
+            os.makedirs(os.path.join(package, name))
+            for path, source in [(os.path.join(package, '__init__.py'), ''),
+                                 (os.path.join(package, name, '__init__.py'), metadata),
+                                 (os.path.join(package, name, 'main.py'), content)]:
+                with open(path, 'w') as source_file:
+                    source_file.write(source)
+
+    def tearDown(self):
+        sys.path.remove(self._directory)
+        ScenarioScheduler._metadata_cache = self._original_cache
+        shutil.rmtree(self._directory)
+
+    def test_killed_scenario_blocks(self):
+        """
+        A scenario that had to be killed is reported as a blocking failure
+        """
+        scheduler = _FastScheduler(['timeout_scenarios.hanging', 'timeout_scenarios.dependent'], processes=2, fail_on_failed_scenario=True)
+        results, errors = scheduler.run()
+        self.assertEqual(errors, [])
+        self.assertEqual(results['timeout_scenarios.hanging']['status'], 'FAILED')
+        self.assertTrue(results['timeout_scenarios.hanging']['blocking'])
+        self.assertTrue(scheduler.blocked)
+        self.assertEqual(results['timeout_scenarios.dependent']['status'], 'BLOCKED')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,297 @@
+# Copyright (C) 2016 iNuron NV
+#
+# This file is part of Open vStorage Open Source Edition (OSE),
+# as available from
+#
+#      http://www.openvstorage.org and
+#      http://www.openvstorage.com.
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License v3 (GNU AGPLv3)
+# as published by the Free Software Foundation, in version 3 as it comes
+# in the LICENSE.txt file of the Open vStorage OSE distribution.
+#
+# Open vStorage is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY of any kind.
+
+"""
+Testrail test module
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+import ci.autotests
+from ci.autotests import AutoTests
+from ci.testrail import TestrailIndex, TestrailSession
+
+
+class FakeTestrailServer(object):
+    """
+    In-process Testrail API v2 on localhost
+    List endpoints are paginated by PAGE_SIZE, every call is delayed by the latency and counted per endpoint
+    """
+    PAGE_SIZE = 2
+
+    def __init__(self, sections, cases, latency=0.0):
+        """
+        :param sections: sections of the suite (e.g. [{'id': 1, 'name': 'Arakoon'}])
+        :type sections: list[dict]
+        :param cases: existing cases of the suite (e.g. [{'id': 1, 'section_id': 1, 'title': 'ar_0001'}])
+        :type cases: list[dict]
+        :param latency: seconds every call takes
+        :type latency: float
+        """
+        self.sections = sections
+        self.cases = cases
+        self.latency = latency
+        self.results = []
+        self.calls = collections.Counter()  # Endpoint -> amount of calls
+        self.max_concurrent = 0
+        self._concurrent = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self, None)
+
+            def do_POST(self):
+                server._handle(self, json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+
+            def log_message(self, *args):
+                pass
+
+        class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self._httpd = _Server(('127.0.0.1', 0), _Handler)
+        self.url = 'http://127.0.0.1:{0}'.format(self._httpd.server_address[1])
+        self._thread = threading.Thread(target=self._httpd.serve_forever, kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _paginate(self, endpoint, uri, arguments, items, key):
+        offset = int(arguments.get('offset', 0))
+        next_link = None
+        if offset + self.PAGE_SIZE < len(items):
+            next_link = '/api/v2/{0}/{1}&suite_id={2}&offset={3}'.format(endpoint, uri, arguments['suite_id'], offset + self.PAGE_SIZE)
+        return {'offset': offset, 'limit': self.PAGE_SIZE, 'size': len(items[offset:offset + self.PAGE_SIZE]),
+                '_links': {'next': next_link, 'prev': None}, key: items[offset:offset + self.PAGE_SIZE]}
+
+    def _handle(self, request, body):
+        with self._lock:
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            time.sleep(self.latency)
+            endpoint, _, uri = request.path.split('/api/v2/', 1)[1].partition('/')
+            uri, _, arguments = uri.partition('&')
+            arguments = dict(argument.split('=', 1) for argument in arguments.split('&') if argument)
+            with self._lock:
+                self.calls[endpoint] += 1
+                if endpoint == 'get_projects':
+                    response = [{'id': 1, 'name': 'Open vStorage'}]
+                elif endpoint == 'get_suites':
+                    response = [{'id': 2, 'name': 'Autotests'}]
+                elif endpoint == 'get_case_types':
+                    response = [{'id': 3, 'name': 'AT Quick'}]
+                elif endpoint == 'get_sections':
+                    response = self._paginate(endpoint, uri, arguments, self.sections, 'sections')
+                elif endpoint == 'get_cases':
+                    response = self._paginate(endpoint, uri, arguments, self.cases, 'cases')
+                elif endpoint == 'add_case':
+                    response = {'id': len(self.cases) + 1, 'section_id': int(uri), 'title': body['title'], 'type_id': body['type_id']}
+                    self.cases.append(response)
+                elif endpoint == 'add_plan':
+                    response = {'id': 4, 'url': 'http://testrail/plans/view/4'}
+                elif endpoint == 'add_plan_entry':
+                    response = {'runs': [{'id': 5, 'case_ids': body.get('case_ids')}]}
+                elif endpoint == 'add_results_for_cases':
+                    self.results.extend(body['results'])
+                    response = body['results']
+                else:
+                    request.send_error(400, 'Unknown endpoint {0}'.format(endpoint))
+                    return
+            content = json.dumps(response)
+            request.send_response(200)
+            request.send_header('Content-Type', 'application/json')
+            request.send_header('Content-Length', str(len(content)))
+            request.end_headers()
+            request.wfile.write(content)
+        finally:
+            with self._lock:
+                self._concurrent -= 1
+
+
+class _TestrailApi(object):
+    """
+    The calls of TestrailApi used by AutoTests.push_to_testrail, executed against the fake server
+    """
+    def __init__(self, server, key=None, user=None, password=None):
+        self._session = TestrailSession(server, key=key, username=user, password=password)
+
+    def get_project_by_name(self, name):
+        return [project for project in self._session._request('GET', 'get_projects') if project['name'] == name][0]
+
+    def get_suite_by_name(self, project_id, name):
+        return [suite for suite in self._session._request('GET', 'get_suites/{0}'.format(project_id)) if suite['name'] == name][0]
+
+    def get_case_type_by_name(self, name):
+        return [case_type for case_type in self._session._request('GET', 'get_case_types') if case_type['name'] == name][0]
+
+    def add_plan(self, project_id, name, description):
+        return self._session._request('POST', 'add_plan/{0}'.format(project_id), {'name': name, 'description': description})
+
+    def add_plan_entry(self, plan_id, suite_id, name, case_ids=None, include_all=True):
+        return self._session._request('POST', 'add_plan_entry/{0}'.format(plan_id), {'suite_id': suite_id, 'name': name,
+                                                                                     'case_ids': case_ids, 'include_all': include_all})
+
+
+class _TestrailCaseType(object):
+    AT_QUICK = 'AT Quick'
+
+
+class TestrailTest(unittest.TestCase):
+    """
+    Calls made by the bulk Testrail lib
+    """
+    SECTIONS = [{'id': 1, 'name': 'Arakoon'}, {'id': 2, 'name': 'Vdisk'}, {'id': 3, 'name': 'Installation'}]
+
+    def _get_cases(self, amount):
+        return [{'id': index + 1, 'section_id': 1, 'title': 'ar_{0:04d}'.format(index + 1)} for index in xrange(amount)]
+
+    def test_pagination(self):
+        """
+        Every page of the list endpoints is fetched
+        """
+        with FakeTestrailServer(self.SECTIONS, self._get_cases(5)) as server:
+            session = TestrailSession(server.url, key='a2V5')
+            self.assertEqual([case['id'] for case in session.get_cases(1, 2)], [1, 2, 3, 4, 5])
+            self.assertEqual(len(session.get_sections(1, 2)), 3)
+        self.assertEqual(server.calls, {'get_cases': 3, 'get_sections': 2})
+        self.assertEqual(session.call_count, 5)
+
+    def test_index(self):
+        """
+        Sections and cases are fetched once, adding cases invalidates the cases of their suite
+        """
+        with FakeTestrailServer(self.SECTIONS, self._get_cases(3)) as server:
+            session = TestrailSession(server.url, key='a2V5')
+            index = TestrailIndex(None, session)
+            section_id = index.get_section_by_name(1, 2, 'Vdisk')['id']
+            self.assertEqual(index.get_case_by_name(1, 2, 'ar_0002')['id'], 2)
+            self.assertEqual(index.get_case_by_name(1, 2, 'ar_0003', section_id=1)['id'], 3)
+            with self.assertRaises(KeyError):
+                index.get_case_by_name(1, 2, 'vd_0001')
+            self.assertEqual(server.calls, {'get_sections': 2, 'get_cases': 2})
+            index.add_cases([{'section_id': section_id, 'title': 'vd_0001', 'type_id': 3}])
+            self.assertEqual(index.get_case_by_name(1, 2, 'vd_0001', section_id=section_id)['id'], 4)
+            self.assertEqual(index.get_case_ids(1, 2), [1, 2, 3, 4])
+        self.assertEqual(server.calls, {'get_sections': 2, 'get_cases': 4, 'add_case': 1})
+
+    def test_concurrent_calls(self):
+        """
+        Cases are added concurrently and every call is counted
+        """
+        with FakeTestrailServer(self.SECTIONS, [], latency=0.05) as server:
+            session = TestrailSession(server.url, key='a2V5', threads=4)
+            start = time.time()
+            cases = session.add_cases([{'section_id': 1, 'title': 'ar_{0:04d}'.format(index), 'type_id': 3} for index in xrange(16)])
+            duration = time.time() - start
+        self.assertEqual(sorted(case['title'] for case in cases), ['ar_{0:04d}'.format(index) for index in xrange(16)])
+        self.assertEqual(session.call_count, 16)
+        self.assertGreater(server.max_concurrent, 1)
+        self.assertLess(duration, 16 * server.latency)
+
+
+class PushToTestrailTest(unittest.TestCase):
+    """
+    Pushing the results of a run: the amount of calls only depends on the amount of new cases
+    """
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._originals = {}
+        for module, name, value in [(ci.autotests, 'TestrailApi', _TestrailApi),
+                                    (ci.autotests, 'TestrailCaseType', _TestrailCaseType),
+                                    (AutoTests, '_get_test_name', staticmethod(lambda: 'fake_cluster')),
+                                    (AutoTests, '_get_ovs_version', staticmethod(lambda: 'fake_version')),
+                                    (AutoTests, '_get_description', staticmethod(lambda: 'fake description'))]:
+            self._originals[(module, name)] = module.__dict__[name]
+            setattr(module, name, value)
+
+    def tearDown(self):
+        for (module, name), value in self._originals.iteritems():
+            setattr(module, name, value)
+        shutil.rmtree(self._directory)
+
+    def _push(self, server, results, only_add_given_cases):
+        config_path = os.path.join(self._directory, 'testrail.json')
+        with open(config_path, 'w') as config_file:
+            json.dump({'url': server.url, 'key': 'a2V5', 'project': 'Open vStorage', 'suite': 'Autotests'}, config_file)
+        return AutoTests.push_to_testrail(results, config_path=config_path, only_add_given_cases=only_add_given_cases)
+
+    def test_push(self):
+        """
+        Existing cases are looked up in memory, new cases are added and all results are pushed in a single call
+        """
+        existing_cases = [{'id': index + 1, 'section_id': 1, 'title': 'ar_{0:04d}'.format(index + 1)} for index in xrange(10)]
+        results = {}
+        for index in xrange(20):  # 10 existing cases and 10 new ones
+            results['ci.scenarios.arakoon.ar_{0:04d}'.format(index + 1)] = {'status': 'PASSED', 'case_type': 'AT_QUICK', 'errors': None, 'duration': 61}
+        results['ci.scenarios.arakoon.ar_0001']['status'] = 'FAILED'
+        results['ci.scenarios.arakoon.ar_0001']['errors'] = 'Stack trace'
+        results['ci.scenarios.unknown.un_0001'] = {'status': 'PASSED', 'case_type': 'AT_QUICK', 'errors': None, 'duration': 1}
+        with FakeTestrailServer(TestrailTest.SECTIONS, existing_cases) as server:
+            plan_url, error_messages = self._push(server, results, only_add_given_cases=True)
+        self.assertEqual(plan_url, 'http://testrail/plans/view/4')
+        self.assertEqual(len(error_messages), 1)
+        self.assertIn('un_0001', error_messages[0])
+        self.assertEqual(server.calls, {'get_projects': 1, 'get_suites': 1, 'get_case_types': 1, 'get_sections': 2,
+                                        'get_cases': 5 + 10, 'add_case': 10, 'add_plan': 1, 'add_plan_entry': 1, 'add_results_for_cases': 1})
+        self.assertEqual(len(server.results), 20)
+        failed = [result for result in server.results if result['case_id'] == 1][0]
+        self.assertEqual(failed['comment'], 'Stack trace')
+        self.assertEqual(failed['elapsed'], '1m 1s')
+
+    def test_push_skips_untested(self):
+        """
+        All other cases of the suite are reported as skipped, within the same call
+        """
+        existing_cases = [{'id': index + 1, 'section_id': 1, 'title': 'ar_{0:04d}'.format(index + 1)} for index in xrange(5)]
+        results = {'ci.scenarios.arakoon.ar_0001': {'status': 'PASSED', 'case_type': 'AT_QUICK', 'errors': None, 'duration': 10}}
+        with FakeTestrailServer(TestrailTest.SECTIONS, existing_cases) as server:
+            _, error_messages = self._push(server, results, only_add_given_cases=False)
+        self.assertEqual(error_messages, [])
+        self.assertEqual(server.calls['add_results_for_cases'], 1)
+        self.assertEqual(sorted((result['case_id'], result['status_id']) for result in server.results),
+                         [(1, int(ci.autotests.TestrailResult.PASSED))] + [(case_id, int(ci.autotests.TestrailResult.SKIPPED)) for case_id in xrange(2, 6)])
+
+    def test_push_case_in_other_section(self):
+        """
+        A case with the same name within another section does not count, the case is added to the section of the test
+        """
+        existing_cases = [{'id': 1, 'section_id': 2, 'title': 'ar_0001'}]
+        results = {'ci.scenarios.arakoon.ar_0001': {'status': 'PASSED', 'case_type': 'AT_QUICK', 'errors': None, 'duration': 10}}
+        with FakeTestrailServer(TestrailTest.SECTIONS, existing_cases) as server:
+            _, error_messages = self._push(server, results, only_add_given_cases=True)
+        self.assertEqual(error_messages, [])
+        self.assertEqual(server.cases[-1], {'id': 2, 'section_id': 1, 'title': 'ar_0001', 'type_id': 3})
+        self.assertEqual([result['case_id'] for result in server.results], [2])
+
+
+if __name__ == '__main__':
+    unittest.main()